@@ -5,25 +5,39 @@ from flask import Flask, render_template, request, jsonify, send_from_directory
 # Use gevent for async mode with SocketIO / 使用 gevent 作为 SocketIO 的异步模式
 from gevent import monkey
 monkey.patch_all()
+import gevent # Native threadpool for blocking disk work / 用于阻塞磁盘操作的原生线程池
 from flask_socketio import SocketIO, emit, join_room, leave_room, Namespace
 from flask_cors import CORS
 import os
 import json
 import uuid
+import copy
+import hashlib
 import websocket # For main ComfyUI connection AND bridge connection (managed by Node) / 用于主 ComfyUI 连接和桥接连接（由 Node 管理）
+import requests # Pooled HTTP session for ComfyUI REST endpoints / 用于 ComfyUI REST 端点的连接池 HTTP 会话
+from requests.adapters import HTTPAdapter
 import threading
 import time
 import base64
+import mimetypes
 from io import BytesIO
 from PIL import Image
 import sys
 import logging # Import logging module
 import numpy as np # Required for tensor_to_pil
+import shared_config # launcher_config.json, shared with launcher.py / 与 launcher.py 共用的 launcher_config.json
+import workflow_compiler # UI-format -> API-format workflows / UI 格式 -> API 格式工作流
+import logging_setup # Queue-backed, redacting log handlers / 基于队列、带脱敏的日志处理器
+import render_history # SQLite index of completed renders / 已完成渲染的 SQLite 索引
+import retention # Size/age quotas for ComfyUI's directories / ComfyUI 目录的容量/时长配额
+from collections import OrderedDict
 
 # --- Logging Setup ---
-# Setup basic logging / 设置基本日志记录
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-log = logging.getLogger('ComfyFlowApp') # Create a logger instance / 创建记录器实例
+# Handlers are installed once the shared config is loaded (see logging_setup.py); subsystem levels come from 'log_levels'
+# 共享配置加载后安装处理器（见 logging_setup.py）；各子系统级别来自 'log_levels'
+log = logging_setup.get_logger('app') # Create a logger instance / 创建记录器实例
+listener_log = logging_setup.get_logger('listener') # ComfyUI WS listener, high-frequency events are sampled / ComfyUI WS 监听器，高频事件会被采样
+bridge_log = logging_setup.get_logger('bridge')
 
 # --- Configuration / 配置 ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -31,16 +45,179 @@ sys.path.insert(0, BASE_DIR)
 STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
 TEMPLATE_FOLDER = os.path.join(BASE_DIR, 'templates')
 
-# ComfyUI Configuration (Ensure these are correct) / ComfyUI 配置（确保这些是正确的）
-# IMPORTANT: Please double-check this path carefully! / 重要提示：请仔细复核此路径！
-# Using raw string and normalizing the path / 使用原始字符串并规范化路径
-COMFYUI_WORKFLOWS_PATH = os.path.normpath(r"D:\Program\ComfyUI_Program\ComfyUI\user\default\workflows")
-# IMPORTANT: Ensure this path is correct and accessible / 重要提示：确保存储路径正确且可访问
-COMFYUI_INPUT_PATH = os.path.normpath(r"D:\Program\ComfyUI_Program\ComfyUI\input")
-# IMPORTANT: Ensure this path is correct and accessible / 重要提示：确保存储路径正确且可访问
-COMFYUI_OUTPUT_PATH = os.path.normpath(r"D:\Program\ComfyUI_Program\ComfyUI\output")
-# IMPORTANT: Ensure this matches your ComfyUI API address / 重要提示：确保这与您的 ComfyUI API 地址匹配
-COMFYUI_API_ADDRESS = "127.0.0.1:8188" # Example: "127.0.0.1:8188" / 示例："127.0.0.1:8188"
+# ComfyUI Configuration, read from the shared launcher_config.json (see shared_config.py)
+# ComfyUI 配置，读取自共享的 launcher_config.json（见 shared_config.py）
+# The launcher's COMFYUI_HOST/COMFYUI_API_PORT environment variables win over the file at startup.
+# 启动时，启动器设置的 COMFYUI_HOST/COMFYUI_API_PORT 环境变量优先于配置文件。
+SHARED_CONFIG, _shared_config_loaded, _shared_config_problems = shared_config.load_config()
+_effective_config = shared_config.apply_env_overrides(SHARED_CONFIG)
+logging_setup.configure_logging(SHARED_CONFIG['log_format'], SHARED_CONFIG['log_sample_interval'])
+logging_setup.apply_log_levels(SHARED_CONFIG['log_levels'])
+
+# --- Output Encoder Profiles / 输出编码配置 ---
+# Named encoder settings used when converting result images to Base64 for the frontend; 'encoder_profiles' in the config adds to / overrides these.
+# 将结果图像转换为 Base64 发送到前端时使用的命名编码设置；配置中的 'encoder_profiles' 可添加或覆盖这些设置。
+# PNG 'compress_level' 1-3 is far cheaper than PIL's default 6 on multi-megapixel images.
+# 对于数百万像素的图像，PNG 'compress_level' 1-3 比 PIL 默认的 6 快得多。
+BUILTIN_ENCODER_PROFILES = {
+    'fast-preview': {'format': 'JPEG', 'quality': 85, 'optimize': False}, # Lowest latency, lossy / 最低延迟，有损
+    'balanced': {'format': 'PNG', 'compress_level': 1, 'optimize': False}, # Lossless, fast zlib / 无损，快速 zlib
+    'lossless-archive': {'format': 'PNG', 'compress_level': 9, 'optimize': True}, # Smallest lossless, slow / 最小无损，较慢
+}
+
+def derive_app_settings(config):
+    """Maps a validated shared config to this module's settings (global name -> value)."""
+    """将校验后的共享配置映射为本模块的设置（全局变量名 -> 值）。"""
+    paths = shared_config.comfyui_paths(config)
+    encoder_profiles = dict(BUILTIN_ENCODER_PROFILES, **config['encoder_profiles'])
+    default_profile = config['default_encoder_profile']
+    if default_profile not in encoder_profiles:
+        log.warning(f"default_encoder_profile '{default_profile}' is not defined; using 'balanced'.")
+        default_profile = 'balanced'
+    return {
+        'COMFYUI_WORKFLOWS_PATH': paths['workflows'],
+        'COMFYUI_INPUT_PATH': paths['input'],
+        'COMFYUI_OUTPUT_PATH': paths['output'],
+        'COMFYUI_TEMP_PATH': paths['temp'], # PreviewImage and 'temp' type results / PreviewImage 和 'temp' 类型结果
+        'COMFYUI_API_ADDRESS': shared_config.comfyui_address(config),
+        'COMFYUI_HTTP_POOL_SIZE': config['comfyui_http_pool_size'], # Max pooled keep-alive connections to ComfyUI / 到 ComfyUI 的最大保持连接数
+        'COMFYUI_HTTP_TIMEOUT': config['comfyui_http_timeout'], # Seconds / 秒
+        'ENCODER_PROFILES': encoder_profiles,
+        'DEFAULT_ENCODER_PROFILE': default_profile,
+        'WORKFLOW_ENCODER_PROFILES': config['workflow_encoder_profiles'], # Per-workflow default profile, keyed by workflow_key / 按工作流默认配置，以 workflow_key 为键
+        'WORKFLOW_CACHE_SIZE': config['workflow_cache_size'], # Compiled workflows kept in memory (LRU) / 内存中保留的已编译工作流（LRU）
+        'PREVIEW_MAX_FPS': config['preview_max_fps'], # 0 disables live previews / 0 表示关闭实时预览
+        'PREVIEW_MAX_SIZE': config['preview_max_size'],
+        'SESSION_GRACE_SECONDS': config['session_grace_seconds'], # Disconnected sessions keep their render this long / 断开的会话在此时长内保留其渲染
+        'SESSION_REPLAY_MAX_EVENTS': config['session_replay_max_events'],
+        'SESSION_REPLAY_MAX_BYTES': int(config['session_replay_max_mb'] * 1024 * 1024),
+        'API_JOB_MAX_ACTIVE': config['api_job_max_active'], # REST jobs handed to ComfyUI at once; the rest wait locally / 同时交给 ComfyUI 的 REST 任务数，其余在本地等待
+        'API_JOB_HISTORY': config['api_job_history'], # Finished REST jobs kept for polling / 保留供轮询的已结束 REST 任务数
+        'API_WEBHOOK_HOSTS': config['api_webhook_hosts'], # Hosts webhook callbacks may target / 回调可指向的主机
+        'HISTORY_DIR': config['history_dir'] or os.path.join(BASE_DIR, 'history'), # Render index and thumbnails / 渲染索引和缩略图
+        'HISTORY_THUMBNAIL_SIZE': config['history_thumbnail_size'],
+        # Per directory ('output', 'input', 'temp'): {'max_bytes', 'max_age'}, 0 = no limit / 按目录的配额，0 表示不限制
+        'RETENTION_QUOTAS': {name: {'max_bytes': int(quota.get('max_gb', 0) * 1024 ** 3), 'max_age': quota.get('max_age_days', 0) * 86400}
+                             for name, quota in config['retention_quotas'].items()},
+        'RETENTION_INTERVAL': config['retention_interval'], # Seconds between sweeps / 两次清理之间的秒数
+        'RETENTION_MIN_AGE': config['retention_min_age'], # Younger files are never deleted / 更新的文件永不删除
+    }
+
+_app_settings = derive_app_settings(_effective_config)
+COMFYUI_WORKFLOWS_PATH = _app_settings['COMFYUI_WORKFLOWS_PATH']
+COMFYUI_INPUT_PATH = _app_settings['COMFYUI_INPUT_PATH']
+COMFYUI_OUTPUT_PATH = _app_settings['COMFYUI_OUTPUT_PATH']
+COMFYUI_TEMP_PATH = _app_settings['COMFYUI_TEMP_PATH']
+COMFYUI_API_ADDRESS = _app_settings['COMFYUI_API_ADDRESS']
+COMFYUI_HTTP_POOL_SIZE = _app_settings['COMFYUI_HTTP_POOL_SIZE']
+COMFYUI_HTTP_TIMEOUT = _app_settings['COMFYUI_HTTP_TIMEOUT']
+ENCODER_PROFILES = _app_settings['ENCODER_PROFILES']
+DEFAULT_ENCODER_PROFILE = _app_settings['DEFAULT_ENCODER_PROFILE']
+WORKFLOW_ENCODER_PROFILES = _app_settings['WORKFLOW_ENCODER_PROFILES']
+WORKFLOW_CACHE_SIZE = _app_settings['WORKFLOW_CACHE_SIZE']
+PREVIEW_MAX_FPS = _app_settings['PREVIEW_MAX_FPS']
+PREVIEW_MAX_SIZE = _app_settings['PREVIEW_MAX_SIZE']
+SESSION_GRACE_SECONDS = _app_settings['SESSION_GRACE_SECONDS']
+SESSION_REPLAY_MAX_EVENTS = _app_settings['SESSION_REPLAY_MAX_EVENTS']
+SESSION_REPLAY_MAX_BYTES = _app_settings['SESSION_REPLAY_MAX_BYTES']
+API_JOB_MAX_ACTIVE = _app_settings['API_JOB_MAX_ACTIVE']
+API_JOB_HISTORY = _app_settings['API_JOB_HISTORY']
+API_WEBHOOK_HOSTS = _app_settings['API_WEBHOOK_HOSTS']
+HISTORY_DIR = _app_settings['HISTORY_DIR']
+HISTORY_THUMBNAIL_SIZE = _app_settings['HISTORY_THUMBNAIL_SIZE']
+RETENTION_QUOTAS = _app_settings['RETENTION_QUOTAS']
+RETENTION_INTERVAL = _app_settings['RETENTION_INTERVAL']
+RETENTION_MIN_AGE = _app_settings['RETENTION_MIN_AGE']
+# The output watcher's directories and the history database are fixed once they run; everything else is applied on the fly
+# 输出监视器的目录和历史数据库运行后即固定；其余设置均可即时生效
+RESTART_REQUIRED_SETTINGS = ('COMFYUI_OUTPUT_PATH', 'COMFYUI_TEMP_PATH', 'HISTORY_DIR')
+
+# --- Workflow Compilation / 工作流编译 ---
+# Minimum seconds between /object_info refetches triggered by unknown node types (e.g. newly installed custom nodes)
+# 因未知节点类型（如新安装的自定义节点）触发的 /object_info 重新获取的最小间隔（秒）
+OBJECT_INFO_REFRESH_INTERVAL = 30
+
+# --- Live Sampler Previews / 实时采样预览 ---
+# ComfyUI sends previews as binary WS frames: 4-byte event type, then (type 1) 4-byte image type + image,
+# or (type 4) 4-byte metadata length + JSON metadata + image. ComfyUI only sends them when started with --preview-method.
+# ComfyUI 以二进制 WS 帧发送预览：4 字节事件类型，其后为（类型 1）4 字节图像类型 + 图像，
+# 或（类型 4）4 字节元数据长度 + JSON 元数据 + 图像。仅当 ComfyUI 以 --preview-method 启动时才会发送。
+PREVIEW_EVENT_IMAGE = 1
+PREVIEW_EVENT_IMAGE_WITH_METADATA = 4
+PREVIEW_IMAGE_TYPES = {1: 'image/jpeg', 2: 'image/png'}
+PREVIEW_JPEG_QUALITY = 80 # Used when a preview has to be downscaled / 预览需要缩小时使用
+
+# --- Client Sessions / 客户端会话 ---
+# Browsers identify themselves with a session token (kept in sessionStorage), not the Socket.IO SID, so a reconnect or page
+# refresh reattaches to a running render. The token is also the Socket.IO room all client events go to.
+# 浏览器以会话令牌（保存在 sessionStorage 中）而非 Socket.IO SID 标识自身，因此重连或刷新页面后可重新接上正在进行的渲染。
+# 该令牌同时也是所有客户端事件发送到的 Socket.IO 房间。
+SESSION_TOKEN_MAX_LENGTH = 64
+# Events kept for replay after a reconnect; for the "latest only" ones just the newest is kept / 重连后重放的事件；"仅最新"类只保留最新一条
+SESSION_REPLAY_EVENTS = ('render_result', 'render_error', 'render_cancelled', 'render_partial_result', 'batch_result', 'batch_complete',
+                         'status_update', 'progress_update', 'batch_progress', 'preview_frame')
+SESSION_REPLAY_LATEST_ONLY = ('status_update', 'progress_update', 'batch_progress', 'preview_frame')
+
+# --- REST Job API / REST 任务 API ---
+# Non-browser clients submit jobs over HTTP; each job runs through the same listener/queue path as a browser render,
+# under a synthetic client_id whose events are captured into the job record instead of a Socket.IO room.
+# 非浏览器客户端通过 HTTP 提交任务；每个任务与浏览器渲染走相同的监听器/队列路径，
+# 使用一个合成的 client_id，其事件被记录到任务记录中，而不是发往 Socket.IO 房间。
+API_JOB_CLIENT_PREFIX = 'api-'
+API_JOB_MAX_WAIT = 60 # Longest long-poll in seconds / 长轮询的最长时间（秒）
+API_JOB_TERMINAL_STATES = ('completed', 'failed', 'cancelled')
+API_WEBHOOK_TIMEOUT = 5
+# Finished jobs keep result file paths; only images that never touched the disk (pushed) stay in memory, bounded by this
+# 已结束的任务只保留结果文件路径；只有从未落盘的（推送的）图像留在内存中，总量受此限制
+API_JOB_MAX_IMAGE_BYTES = 256 * 1024 * 1024
+
+# --- Render History / 渲染历史 ---
+# Completed prompts are indexed in HISTORY_DIR/render_history.db (see render_history.py), thumbnails go to HISTORY_DIR/thumbnails
+# 已完成的任务索引在 HISTORY_DIR/render_history.db 中（见 render_history.py），缩略图存放在 HISTORY_DIR/thumbnails
+HISTORY_DB_NAME = 'render_history.db'
+HISTORY_THUMBNAIL_QUALITY = 80
+
+# --- Directory Retention / 目录保留策略 ---
+# Annotated file references ComfyUI loaders accept, e.g. "render_00001_.png [output]" / ComfyUI 加载器接受的带目录标注的文件引用
+RETENTION_ANNOTATIONS = {' [output]': 'output', ' [input]': 'input', ' [temp]': 'temp'}
+# Inputs of loader nodes (LoadImage, LoadImageMask, video/audio loaders) that name a file; other string inputs only count if the file exists
+# 加载器节点（LoadImage、LoadImageMask、视频/音频加载器）中表示文件名的输入；其他字符串输入仅在文件存在时才计入
+RETENTION_FILE_INPUTS = ('image', 'video', 'audio', 'file')
+
+# ComfyUI WS reconnect settings / ComfyUI WS 重连设置
+COMFYUI_WS_RECONNECT_ATTEMPTS = 6
+COMFYUI_WS_RECONNECT_BASE_DELAY = 0.5 # Doubles per attempt / 每次尝试翻倍
+COMFYUI_WS_RECONNECT_MAX_DELAY = 10
+
+# --- Output Directory Watcher / 输出目录监视器 ---
+# Picks up result files as soon as they are fully written, independent of the 'executed' WS message.
+# 在结果文件完整写入后立即获取，不依赖 'executed' WS 消息。
+OUTPUT_WATCHER_ENABLED = True
+OUTPUT_WATCHER_INTERVAL = 0.5 # Seconds between scans while prompts are in flight / 有任务进行时的扫描间隔（秒）
+OUTPUT_WATCHER_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+# How long to wait for result files after the listener lost ComfyUI / 监听器与 ComfyUI 断开后等待结果文件的时长
+OUTPUT_WATCHER_RECOVERY_TIMEOUT = 300
+OUTPUT_WATCHER_SETTLE_SECONDS = 2.0 # Quiet period before recovered files are delivered / 交付恢复文件前的静默期
+
+# --- Batch Rendering / 批量渲染（抽卡） ---
+BATCH_MAX_VARIANTS = 64 # Upper bound of prompts per batch submission / 每次批量提交的最大任务数
+# Batch variation fields answered directly to NodeBridge_Input modes / 直接应答 NodeBridge_Input 模式的批次变体字段
+BATCH_VARIATION_BRIDGE_MODES = {'text': 'Text', 'cn_strength': 'CN', 'count': 'Count'}
+
+# --- NodeBridge Context / NodeBridge 上下文 ---
+# Prompt/client context reaches bridge nodes out of band (extra_data -> EXTRA_PNGINFO, or a lookup of the node's _node_id and
+# _input_key among the prompts in flight), never as node inputs, so identical user inputs submit a byte-identical graph and
+# ComfyUI reuses its cached node outputs.
+# 任务/客户端上下文通过带外方式（extra_data -> EXTRA_PNGINFO，或在进行中的任务里按节点的 _node_id 和 _input_key 查找）传给桥接节点，
+# 不写入节点输入，因此相同的用户输入会提交完全相同的任务图，ComfyUI 可复用缓存的节点输出。
+BRIDGE_CONTEXT_KEY = 'comfyflow' # Key inside extra_pnginfo / extra_pnginfo 中的键
+BRIDGE_INPUT_MODES = ('Image', 'Reference', 'Text', 'CN', 'Count') # Values the frontend may send with the trigger / 前端可随触发请求发送的值
+BRIDGE_CONTEXT_INPUTS = ('_node_id', '_input_key') # Filled in per job by prepare_prompt_job / 由 prepare_prompt_job 按任务填充
+
+# Results pushed by NodeBridge_Output as binary attachments (see BridgeNamespace.on_push_output_images)
+# NodeBridge_Output 以二进制附件推送的结果（见 BridgeNamespace.on_push_output_images）
+BRIDGE_PUSH_MAX_BYTES = 64 * 1024 * 1024 # Also the Socket.IO message size limit / 同时也是 Socket.IO 消息大小上限
+BRIDGE_PUSH_MIME_TYPES = ('image/png', 'image/jpeg', 'image/webp')
 
 # Bridge Namespace WebSocket URL (used by NodeBridge.py) / 桥接命名空间 WebSocket URL（由 NodeBridge.py 使用）
 # This app hosts this namespace / 此应用程序托管此命名空间
@@ -51,7 +228,11 @@ app = Flask(__name__, template_folder=TEMPLATE_FOLDER, static_folder=STATIC_FOLD
 app.config['SECRET_KEY'] = 'your_very_secret_key_v4_bridge_change_me!' # Change this! / 更改这个！
 CORS(app)
 # Use gevent for robust SocketIO / 使用 gevent 以获得健壮的 SocketIO
-socketio = SocketIO(app, async_mode='gevent', cors_allowed_origins="*", logger=True, engineio_logger=True) # Enable SocketIO logging / 启用 SocketIO 日志
+# Socket.IO/Engine.IO log every event and packet (full Base64 images included) at INFO; their own loggers default to WARNING
+# Socket.IO/Engine.IO 会在 INFO 级别记录每个事件和数据包（包括完整的 Base64 图像）；其记录器默认为 WARNING
+# max_http_buffer_size: Engine.IO's 1 MB default would reject pushed results and uploads / Engine.IO 默认 1 MB 会拒绝推送的结果和上传
+socketio = SocketIO(app, async_mode='gevent', cors_allowed_origins="*", logger=logging_setup.get_logger('socketio'), engineio_logger=logging_setup.get_logger('engineio'),
+                    max_http_buffer_size=BRIDGE_PUSH_MAX_BYTES)
 
 # --- Data Structures ---
 # Stores mapping from client's SID to their current prompt info / 存储从客户端 SID 到其当前提示信息的映射
@@ -62,6 +243,106 @@ prompt_client_map = {} # { prompt_id: client_id }
 # Key: unique request_id generated by NodeBridge / 键：由 NodeBridge 生成的唯一 request_id
 pending_node_requests = {}
 # { request_id: {'prompt_id': ..., 'node_id':..., 'client_id':..., 'mode':..., 'node_sid':..., 'timestamp': ...} }
+# Per-prompt NodeBridge_Input values answered without a frontend round trip (batch variants)
+# 按任务存储的 NodeBridge_Input 值，无需经前端往返即可应答（批次变体）
+prompt_bridge_overrides = {} # { prompt_id: {mode: value} }
+# Running ComfyUI listeners, used to cancel them / 运行中的 ComfyUI 监听器，用于取消
+active_listeners = {} # { listener_id: {'client_id':..., 'prompt_ids': [...], 'jobs': [...], 'cancel_event': Event, 'ws': ws} }
+# Renders cancelled before their listener registered; the listener cancels itself on start / 监听器注册前被取消的渲染；监听器启动时自行取消
+pending_cancels = set() # { listener_id }
+# Prompt ComfyUI is executing right now (it runs one at a time); resolves bridge requests without a prompt_id
+# ComfyUI 当前正在执行的任务（一次只执行一个）；用于解析不带 prompt_id 的桥接请求
+executing_prompt = {'prompt_id': None}
+# Images pushed in memory by NodeBridge_Output, delivered when its 'executed' message arrives
+# NodeBridge_Output 在内存中推送的图像，在其 'executed' 消息到达时交付
+pushed_output_images = {} # { prompt_id: {'node_id':..., 'images': [{'mime':..., 'data': bytes}], 'timestamp':...} }
+# ComfyUI's /object_info node schemas, fetched once; 'version' changes whenever it is replaced
+# ComfyUI 的 /object_info 节点结构，只获取一次；每次替换时 'version' 都会变化
+object_info_snapshot = {'data': None, 'version': 0, 'fetched_at': 0}
+# Compiled API prompts per workflow file, recompiled only when the file or the schema snapshot changes
+# 按工作流文件缓存的已编译 API 任务图，仅在文件或结构快照变化时重新编译
+compiled_workflows = OrderedDict() # { path: {'signature': (mtime_ns, size), 'schema_version':..., 'prompt':..., 'problems': {schema_version: [...]}} }
+workflow_cache_lock = threading.Lock()
+
+# Frontend sessions, keyed by session token / 前端会话，以会话令牌为键
+client_sessions = {} # { token: {'sids': set(), 'generation': int, 'disconnected_at': float or None, 'replay': [(event, payload, size)], 'replay_bytes': int} }
+sid_sessions = {} # { socketio_sid: token }
+# REST jobs, oldest first / REST 任务，按时间从旧到新
+api_jobs = OrderedDict() # { job_id: {'job_id':..., 'client_id':..., 'prompt_id':..., 'status':..., 'images': [...], 'done': Event, ...} }
+api_job_slots = threading.Condition() # Guards api_job_slots_active / 保护 api_job_slots_active
+api_job_slots_active = {'count': 0}
+# Digests of NodeBridge values the frontend answered, recorded with the render / 前端应答的 NodeBridge 值摘要，随渲染一起记录
+prompt_input_hashes = {} # { prompt_id: {mode: digest} }
+# Retention sweeps: incremental directory indexes and the last report / 保留策略清理：增量目录索引和最近一次报告
+retention_indexes = {} # { 'output'|'input'|'temp': retention.DirectoryIndex }
+retention_state = {'last_sweep_at': None, 'running': False, 'directories': {}}
+retention_wakeup = threading.Event() # Set to sweep now / 设置后立即清理
+
+# --- Client Sessions / 客户端会话 ---
+def session_for_sid(sid):
+    """Returns the session token of a connected frontend socket (its client_id everywhere else), or None."""
+    """返回已连接前端套接字的会话令牌（即其他地方使用的 client_id），或 None。"""
+    return sid_sessions.get(sid)
+
+def replay_payload_size(payload):
+    """Rough byte size of an event payload; only images matter. / 事件载荷的粗略字节数；只计算图像。"""
+    if not isinstance(payload, dict): return 0
+    images = payload.get('images') or ([payload['image']] if payload.get('image') else [])
+    return sum(len(image) if isinstance(image, (str, bytes)) else len(image.get('data', b'')) for image in images)
+
+def emit_to_client(client_id, event, payload):
+    """Emits an event to a frontend session's room and keeps it (bounded per session) for replay after a reconnect.
+    Events for REST jobs update the job record instead."""
+    """向前端会话的房间发送事件，并保存该事件（每个会话有上限）以便重连后重放。REST 任务的事件则更新任务记录。"""
+    if client_id and client_id.startswith(API_JOB_CLIENT_PREFIX):
+        api_job = api_jobs.get(client_id[len(API_JOB_CLIENT_PREFIX):])
+        if api_job: update_api_job(api_job, event, payload)
+        return
+    socketio.emit(event, payload, room=client_id)
+    session = client_sessions.get(client_id)
+    if session is None or event not in SESSION_REPLAY_EVENTS: return
+    replay = session['replay']
+    if event in SESSION_REPLAY_LATEST_ONLY:
+        for i, (old_event, _, old_size) in enumerate(replay):
+            if old_event == event:
+                del replay[i]; session['replay_bytes'] -= old_size; break
+    size = replay_payload_size(payload)
+    replay.append((event, payload, size)); session['replay_bytes'] += size
+    while replay and (len(replay) > SESSION_REPLAY_MAX_EVENTS or session['replay_bytes'] > SESSION_REPLAY_MAX_BYTES):
+        session['replay_bytes'] -= replay.pop(0)[2]
+
+def reset_session_replay(client_id):
+    """Forgets the replay buffer when a session starts a new render. / 会话开始新渲染时清空其重放缓冲。"""
+    session = client_sessions.get(client_id)
+    if session: session['replay'] = []; session['replay_bytes'] = 0
+
+def release_client_session(client_id, reason):
+    """Stops a session's render and drops everything kept for it; runs once its grace period has passed without a reconnect."""
+    """停止会话的渲染并丢弃为其保留的全部内容；在宽限期内未重连时执行。"""
+    log.warning(f"Releasing session {client_id}: {reason}")
+    # Nobody will see the result, so stop spending GPU time on it / 无人接收结果，停止占用 GPU
+    cancel_render_for_client(client_id, reason)
+
+    # Clean up prompt mappings / 清理提示映射
+    prompt_info = client_prompt_map.pop(client_id, None)
+    if prompt_info:
+        # Batches track several prompt IDs under one listener / 批次在一个监听器下跟踪多个任务 ID
+        for prompt_id in prompt_info.get('prompt_ids') or [prompt_info.get('prompt_id')]:
+            if prompt_id and prompt_client_map.get(prompt_id) == client_id:
+                del prompt_client_map[prompt_id]
+                log.info(f"Cleaned up prompt mapping for session {client_id}, prompt {prompt_id}")
+
+    # Clean up pending requests initiated FOR this client / 清理为此客户端启动的待处理请求
+    fail_pending_node_requests(lambda req: req['client_id'] == client_id, reason)
+    client_sessions.pop(client_id, None)
+
+def expire_client_session(client_id, generation):
+    """Background task: releases a disconnected session after SESSION_GRACE_SECONDS unless it reconnected meanwhile."""
+    """后台任务：断开的会话在 SESSION_GRACE_SECONDS 后若仍未重连则释放。"""
+    socketio.sleep(SESSION_GRACE_SECONDS)
+    session = client_sessions.get(client_id)
+    if session and not session['sids'] and session['generation'] == generation:
+        release_client_session(client_id, 'Frontend client did not reconnect in time.')
 
 # --- Helper Functions ---
 def tensor_to_pil(tensor):
@@ -88,14 +369,26 @@ def tensor_to_pil(tensor):
         log.error(f"Error converting tensor to PIL: {e}", exc_info=True)
         return []
 
-def pil_to_base64(pil_image, image_format='PNG'):
-    """Converts a PIL image to a Base64 Data URL."""
-    """将 PIL 图像转换为 Base64 数据 URL。"""
+def resolve_encoder_profile(requested_profile=None, workflow_key=None):
+    """Resolves the encoder profile name and settings (request > workflow > default)."""
+    """解析编码配置名称和设置（请求 > 工作流 > 默认）。"""
+    profile_name = requested_profile or WORKFLOW_ENCODER_PROFILES.get(workflow_key) or DEFAULT_ENCODER_PROFILE
+    if profile_name not in ENCODER_PROFILES:
+        log.warning(f"Unknown encoder profile '{profile_name}', falling back to '{DEFAULT_ENCODER_PROFILE}'.")
+        profile_name = DEFAULT_ENCODER_PROFILE
+    return profile_name, ENCODER_PROFILES[profile_name]
+
+def pil_to_base64(pil_image, image_format='PNG', profile=None):
+    """Converts a PIL image to a Base64 Data URL, optionally using an encoder profile."""
+    """将 PIL 图像转换为 Base64 数据 URL，可选使用编码配置。"""
     if not isinstance(pil_image, Image.Image):
         log.error("pil_to_base64 received non-PIL image input.")
         return None
     try:
         buffered = BytesIO()
+        # Profile format overrides the requested format / 配置中的格式优先于请求的格式
+        if profile and profile.get('format'):
+            image_format = profile['format']
         # Handle transparency and format / 处理透明度和格式
         img_format_upper = image_format.upper()
         if img_format_upper not in ['PNG', 'JPEG', 'WEBP']:
@@ -107,22 +400,245 @@ def pil_to_base64(pil_image, image_format='PNG'):
         # Ensure correct mode for saving / 确保保存时模式正确
         if save_format == 'JPEG' and pil_image.mode != 'RGB':
             pil_image = pil_image.convert('RGB')
+        elif save_format == 'WEBP' and pil_image.mode not in ['RGB', 'RGBA']:
+            pil_image = pil_image.convert('RGBA' if 'A' in pil_image.getbands() else 'RGB')
         elif save_format == 'PNG' and pil_image.mode not in ['RGB', 'RGBA', 'L']:
              # Try converting common modes to RGB for PNG compatibility / 尝试将常见模式转换为 RGB 以兼容 PNG
             try:
+                 original_mode = pil_image.mode
                  pil_image = pil_image.convert('RGB')
-                 log.warning(f"Converted PIL image mode {pil_image.mode} to RGB for PNG saving.")
+                 log.warning(f"Converted PIL image mode {original_mode} to RGB for PNG saving.")
             except Exception as conv_err:
                  log.error(f"Could not convert PIL image mode {pil_image.mode} for PNG. Error: {conv_err}")
                  return None # Cannot save in this state / 无法在此状态下保存
 
-        pil_image.save(buffered, format=save_format)
+        # Build format-specific save options from the profile / 根据配置构建特定格式的保存选项
+        save_kwargs = {}
+        if profile:
+            if save_format == 'PNG':
+                save_kwargs['compress_level'] = profile.get('compress_level', 6)
+            elif save_format in ('JPEG', 'WEBP') and 'quality' in profile:
+                save_kwargs['quality'] = profile['quality']
+            if save_format == 'WEBP':
+                save_kwargs['method'] = profile.get('method', 4)
+                save_kwargs['lossless'] = profile.get('lossless', False)
+            elif profile.get('optimize'):
+                save_kwargs['optimize'] = True
+
+        pil_image.save(buffered, format=save_format, **save_kwargs)
         img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
         return f"data:{mime_type};base64,{img_base64}"
     except Exception as e:
         log.error(f"Error converting PIL image to base64: {e}", exc_info=True)
         return None
 
+def resolve_output_image_path(img_info):
+    """Maps a ComfyUI image descriptor (filename/subfolder/type) to a local file path."""
+    """将 ComfyUI 图像描述（filename/subfolder/type）映射为本地文件路径。"""
+    filename = img_info.get('filename')
+    if not filename:
+        return None
+    img_type = img_info.get('type', 'output') # 'output' or 'temp' or 'input' / 'output' 或 'temp' 或 'input'
+    base_path = COMFYUI_OUTPUT_PATH
+    if img_type == 'input': base_path = COMFYUI_INPUT_PATH
+    elif img_type == 'temp': base_path = COMFYUI_TEMP_PATH
+    return os.path.normpath(os.path.join(base_path, img_info.get('subfolder', ''), filename))
+
+def encode_image_file(img_path, profile_settings=None):
+    """Opens an image file and encodes it as a Base64 Data URL, or returns None."""
+    """打开图像文件并编码为 Base64 数据 URL，失败时返回 None。"""
+    try:
+        if not (os.path.exists(img_path) and os.path.isfile(img_path)):
+            log.error(f"Output image file not found or is not a file: {img_path}")
+            return None
+        with Image.open(img_path) as img:
+            return pil_to_base64(img, image_format=img.format or 'PNG', profile=profile_settings)
+    except Exception as e:
+        log.error(f"Error processing output image file {img_path}: {e}", exc_info=True)
+        return None
+
+def create_comfyui_http_session(pool_size=COMFYUI_HTTP_POOL_SIZE):
+    """Creates a requests Session with a keep-alive connection pool for ComfyUI."""
+    """创建带保持连接池的 requests 会话，用于访问 ComfyUI。"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    return session
+
+comfyui_http = create_comfyui_http_session()
+
+# --- Shared Configuration Hot Reload / 共享配置热重载 ---
+def apply_shared_config_change(config, changed_keys, problems):
+    """Applies a changed launcher_config.json without restarting: backend address, HTTP pool and timeout, workflow folder and
+    encoder profiles take effect immediately. Running renders and connected clients are left alone."""
+    """无需重启即可应用修改后的 launcher_config.json：后端地址、HTTP 连接池与超时、工作流目录和编码配置立即生效。
+    正在进行的渲染和已连接的客户端不受影响。"""
+    global SHARED_CONFIG, _effective_config, comfyui_http
+    for problem in problems: log.warning(f"[Config] Invalid value {problem}")
+    effective = dict(config)
+    for key in ('comfyui_host', 'comfyui_api_port'):
+        # Keep the launcher's environment override unless the file value itself changed / 除非文件中的值本身发生变化，否则保留启动器的环境变量覆盖
+        if key not in changed_keys: effective[key] = _effective_config[key]
+    new_settings = derive_app_settings(effective)
+    module_globals = globals(); applied = []
+    for name, value in new_settings.items():
+        if module_globals[name] == value: continue
+        if name in RESTART_REQUIRED_SETTINGS:
+            log.warning(f"[Config] {name} changed to '{value}'; restart the app to apply it. / 需要重启应用才能生效。")
+            continue
+        module_globals[name] = value; applied.append(name)
+    if changed_keys & {'log_levels', 'log_sample_interval'}:
+        levels = logging_setup.apply_log_levels(config['log_levels'], config['log_sample_interval'])
+        log.info(f"[Config] Log levels: {', '.join(f'{name}={level}' for name, level in levels.items())}")
+    if 'log_format' in changed_keys:
+        log.warning("[Config] log_format changed; restart the app to apply it. / 需要重启应用才能生效。")
+    if 'COMFYUI_API_ADDRESS' in applied:
+        reset_object_info() # Another ComfyUI may have other custom nodes / 另一个 ComfyUI 可能有不同的自定义节点
+    if 'WORKFLOW_CACHE_SIZE' in applied:
+        with workflow_cache_lock: trim_workflow_cache()
+    if 'COMFYUI_HTTP_POOL_SIZE' in applied:
+        # Requests in flight finish on the old session / 进行中的请求在旧会话上完成
+        comfyui_http = create_comfyui_http_session(COMFYUI_HTTP_POOL_SIZE)
+    SHARED_CONFIG = config; _effective_config = effective
+    if applied: log.info(f"[Config] Reloaded {shared_config.CONFIG_FILE}; applied: {', '.join(applied)}")
+    return applied
+
+config_watcher = shared_config.ConfigWatcher(SHARED_CONFIG, apply_shared_config_change, on_error=lambda message: log.warning(f"[Config] {message}"), interval=SHARED_CONFIG['config_reload_interval'])
+
+def comfyui_api_get(path):
+    """GETs a ComfyUI REST endpoint through the pooled session and returns the decoded JSON."""
+    """通过连接池会话请求 ComfyUI REST 端点并返回解码后的 JSON。"""
+    response = comfyui_http.get(f"http://{COMFYUI_API_ADDRESS}{path}", timeout=COMFYUI_HTTP_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+def fetch_prompt_history(prompt_id):
+    """Returns ComfyUI's /history entry for the prompt, or None if it has not finished."""
+    """返回任务在 ComfyUI /history 中的条目，若尚未完成则返回 None。"""
+    return comfyui_api_get(f"/history/{prompt_id}").get(prompt_id)
+
+def comfyui_api_post(path, payload):
+    """POSTs JSON to a ComfyUI REST endpoint through the pooled session."""
+    """通过连接池会话向 ComfyUI REST 端点 POST JSON。"""
+    response = comfyui_http.post(f"http://{COMFYUI_API_ADDRESS}{path}", json=payload, timeout=COMFYUI_HTTP_TIMEOUT)
+    response.raise_for_status()
+    return response
+
+def fetch_queue_prompt_ids():
+    """Returns (running_ids, pending_ids) from ComfyUI's /queue endpoint."""
+    """从 ComfyUI 的 /queue 端点返回 (运行中 ID, 等待中 ID)。"""
+    queue_state = comfyui_api_get("/queue")
+    # Queue items are [number, prompt_id, prompt, extra_data, outputs_to_execute] / 队列项格式
+    running = {item[1] for item in queue_state.get('queue_running', []) if len(item) > 1}
+    pending = {item[1] for item in queue_state.get('queue_pending', []) if len(item) > 1}
+    return running, pending
+
+def submit_comfyui_prompt(prompt, client_id, prompt_id):
+    """Queues a prompt through ComfyUI's POST /prompt, keeping our prompt_id so /history can find it.
+    The bridge context travels in extra_data, which is not part of ComfyUI's cache keys."""
+    """通过 ComfyUI 的 POST /prompt 提交任务，并保留我们的 prompt_id 以便在 /history 中查找。
+    桥接上下文放在 extra_data 中，不参与 ComfyUI 的缓存键。"""
+    extra_data = {'extra_pnginfo': {BRIDGE_CONTEXT_KEY: {'prompt_id': prompt_id, 'client_id': client_id}}}
+    payload = {'prompt': prompt, 'client_id': client_id, 'prompt_id': prompt_id, 'extra_data': extra_data}
+    response = comfyui_http.post(f"http://{COMFYUI_API_ADDRESS}/prompt", json=payload, timeout=COMFYUI_HTTP_TIMEOUT)
+    if response.status_code != 200:
+        try: error_info = response.json().get('error', {})
+        except ValueError: error_info = {}
+        message = error_info.get('message') if isinstance(error_info, dict) else str(error_info)
+        raise RuntimeError(f"ComfyUI rejected the prompt ({response.status_code}): {message or response.text[:200]}")
+    return response.json()
+
+def reset_object_info():
+    """Drops the /object_info snapshot; compiled workflows are recompiled against the next one."""
+    """丢弃 /object_info 快照；已编译的工作流将基于下一个快照重新编译。"""
+    with workflow_cache_lock:
+        object_info_snapshot.update(data=None, version=object_info_snapshot['version'] + 1, fetched_at=0)
+
+def get_object_info(refresh=False):
+    """Returns the cached /object_info snapshot, fetching it from ComfyUI on first use (or when refresh is allowed again)."""
+    """返回缓存的 /object_info 快照，首次使用时（或允许刷新时）从 ComfyUI 获取。"""
+    if object_info_snapshot['data'] is not None and not (refresh and time.time() - object_info_snapshot['fetched_at'] >= OBJECT_INFO_REFRESH_INTERVAL):
+        return object_info_snapshot['data'], object_info_snapshot['version']
+    started = time.time()
+    data = comfyui_api_get("/object_info")
+    with workflow_cache_lock:
+        object_info_snapshot.update(data=data, version=object_info_snapshot['version'] + 1, fetched_at=time.time())
+        log.info(f"Fetched /object_info: {len(data)} node types in {time.time() - started:.2f}s (snapshot v{object_info_snapshot['version']}).")
+        return data, object_info_snapshot['version']
+
+def trim_workflow_cache():
+    """Evicts the least recently used compiled workflows beyond WORKFLOW_CACHE_SIZE. Caller holds workflow_cache_lock."""
+    """淘汰超出 WORKFLOW_CACHE_SIZE 的最久未使用的已编译工作流。调用方需持有 workflow_cache_lock。"""
+    while len(compiled_workflows) > WORKFLOW_CACHE_SIZE:
+        compiled_workflows.popitem(last=False)
+
+def compile_workflow_file(path):
+    """Returns the API-format prompt of a workflow file. API-format files are used as-is; UI-format files are compiled with the
+    /object_info snapshot. Results are cached per file (mtime, size), so compilation happens once per edit, not per render.
+    The returned dict is shared; callers copy it before changing it (see prepare_prompt_job)."""
+    """返回工作流文件的 API 格式任务图。API 格式文件直接使用；UI 格式文件借助 /object_info 快照编译。
+    结果按文件的 (mtime, size) 缓存，因此每次编辑只编译一次，而不是每次渲染都编译。
+    返回的字典是共享的；调用方修改前需先复制（见 prepare_prompt_job）。"""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with workflow_cache_lock:
+        cached = compiled_workflows.get(path)
+        if cached and cached['signature'] == signature and cached['schema_version'] in (None, object_info_snapshot['version']):
+            compiled_workflows.move_to_end(path)
+            return cached['prompt']
+    log.info(f"Loading workflow from: {path}")
+    with open(path, 'r', encoding='utf-8') as f:
+        workflow_data = json.load(f)
+    schema_version = None # API-format files do not depend on the schema / API 格式文件不依赖节点结构
+    if workflow_compiler.is_ui_workflow(workflow_data):
+        object_info, schema_version = get_object_info()
+        try:
+            prompt = workflow_compiler.compile_ui_workflow(workflow_data, object_info)
+        except workflow_compiler.WorkflowCompileError as e:
+            if not e.unknown_types: raise
+            # Custom nodes may have been installed since the snapshot / 快照之后可能安装了新的自定义节点
+            object_info, refreshed_version = get_object_info(refresh=True)
+            if refreshed_version == schema_version: raise
+            prompt, schema_version = workflow_compiler.compile_ui_workflow(workflow_data, object_info), refreshed_version
+        workflow_data = prompt
+        log.info(f"Compiled UI-format workflow {os.path.basename(path)}: {len(workflow_data)} nodes (schema v{schema_version}).")
+    with workflow_cache_lock:
+        compiled_workflows[path] = {'signature': signature, 'schema_version': schema_version, 'prompt': workflow_data, 'problems': {}}
+        compiled_workflows.move_to_end(path)
+        trim_workflow_cache()
+    return workflow_data
+
+def validate_workflow_prompt(path, prompt):
+    """Validates a compiled workflow against the /object_info snapshot before it is queued, so broken graphs fail without
+    reaching ComfyUI's queue. A passing result is memoized with the compiled workflow per schema version; a failing one is
+    not, so a retry re-checks against a refreshed snapshot once OBJECT_INFO_REFRESH_INTERVAL allows. Returns a list of problems."""
+    """提交前按 /object_info 快照校验已编译的工作流，使损坏的任务图不进入 ComfyUI 队列即失败。
+    通过的结果随已编译工作流按结构版本缓存；失败的结果不缓存，因此在 OBJECT_INFO_REFRESH_INTERVAL 允许后重试会基于刷新的快照重新校验。返回问题列表。"""
+    try:
+        object_info, schema_version = get_object_info()
+    except Exception as e:
+        # API-format files do not need the schema; ComfyUI still validates on /prompt / API 格式文件不依赖节点结构；ComfyUI 在 /prompt 时仍会校验
+        log.warning(f"Skipping validation of {os.path.basename(path)}: /object_info is unavailable ({e}).")
+        return []
+    with workflow_cache_lock:
+        entry = compiled_workflows.get(path)
+        if entry is not None and entry['prompt'] is prompt and schema_version in entry['problems']:
+            return entry['problems'][schema_version]
+    started = time.perf_counter()
+    problems = workflow_compiler.validate_prompt(prompt, object_info, ignore_inputs=BRIDGE_CONTEXT_INPUTS)
+    if problems:
+        # New models or custom nodes may have appeared since the snapshot / 快照之后可能新增了模型或自定义节点
+        try: object_info, refreshed_version = get_object_info(refresh=True)
+        except Exception as e: log.warning(f"Could not refresh /object_info: {e}"); refreshed_version = schema_version
+        if refreshed_version != schema_version:
+            schema_version = refreshed_version
+            problems = workflow_compiler.validate_prompt(prompt, object_info, ignore_inputs=BRIDGE_CONTEXT_INPUTS)
+    log.info(f"Validated workflow {os.path.basename(path)} in {(time.perf_counter() - started) * 1000:.1f} ms: {len(problems)} problem(s).")
+    if not problems:
+        with workflow_cache_lock:
+            if entry is not None and entry['prompt'] is prompt: entry['problems'] = {schema_version: problems}
+    return problems
+
 def load_workflow_safely(workflow_key):
     """Loads a workflow JSON file safely, preventing path traversal."""
     """安全地加载工作流 JSON 文件，防止路径遍历。"""
@@ -145,73 +661,624 @@ def load_workflow_safely(workflow_key):
             log.error(f"Workflow file not found at resolved path: {workflow_path_abs}")
             return None, f"Workflow file not found: {workflow_key}"
 
-        log.info(f"Loading workflow from: {workflow_path_abs}")
-        with open(workflow_path_abs, 'r', encoding='utf-8') as f:
-            workflow_data = json.load(f)
+        workflow_data = compile_workflow_file(workflow_path_abs)
+        problems = validate_workflow_prompt(workflow_path_abs, workflow_data)
+        if problems:
+            log.error(f"Workflow {workflow_key} failed validation: {'; '.join(problems)}")
+            return None, f"Invalid workflow {workflow_key}: {'; '.join(problems[:5])}" + (f" (+{len(problems) - 5} more)" if len(problems) > 5 else "")
         return workflow_data, None # Return data and no error / 返回数据且无错误
 
     except json.JSONDecodeError as e:
         log.error(f"Invalid JSON in workflow file: {workflow_path_abs} - {e}")
         return None, f"Invalid JSON in workflow file: {workflow_key}"
+    except workflow_compiler.WorkflowCompileError as e:
+        log.error(f"Cannot compile UI-format workflow {workflow_key}: {e}")
+        return None, f"Invalid UI-format workflow {workflow_key}: {e}"
+    except requests.exceptions.RequestException as e:
+        log.error(f"Cannot fetch /object_info to prepare {workflow_key}: {e}")
+        return None, "ComfyUI is unreachable; its node schemas are needed to check the workflow."
     except Exception as e:
         log.error(f"Error reading workflow file {workflow_key}: {e}", exc_info=True)
         return None, "Server error reading workflow file."
 
+# --- Blocking Work / 阻塞操作 ---
+def run_in_threadpool(function, *args):
+    """Runs blocking disk/CPU work (directory walks, image decoding) on gevent's native threadpool and waits for it, so the hub
+    keeps serving Socket.IO/HTTP clients meanwhile. The function runs on a real OS thread: it must not log or take locks, since
+    those are monkey-patched and belong to the hub."""
+    """在 gevent 的原生线程池中运行阻塞的磁盘/CPU 操作（目录遍历、图像解码）并等待其完成，使 hub 期间仍能服务 Socket.IO/HTTP 客户端。
+    该函数运行在真实的操作系统线程上：不得记录日志或获取锁，因为它们已被猴子补丁替换且属于 hub。"""
+    return gevent.get_hub().threadpool.apply(function, args)
+
+# --- Output Directory Watcher ---
+class OutputDirectoryWatcher:
+    """Polls ComfyUI's output/temp directories and assigns newly written images to in-flight prompts."""
+    """轮询 ComfyUI 的输出/临时目录，并将新写入的图像分配给进行中的任务。"""
+    def __init__(self, directories, interval=OUTPUT_WATCHER_INTERVAL):
+        self.directories = directories
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending_files = {} # { path: (size, mtime) } waiting for size to settle / 等待大小稳定
+        # { dir: (mtime, [subdirs], {known file paths}) } for incremental scans; known = handled or pre-existing, pruned on relisting
+        # 用于增量扫描；known 为已处理或已存在的文件，重新列出目录时清理
+        self._dir_state = {}
+        self._tracked = {} # { prompt_id: {...} }
+        self._executing_prompt_id = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="OutputDirectoryWatcher")
+            self._thread.start()
+            log.info(f"[Watcher] Watching for results in: {', '.join(self.directories)}")
+
+    def track(self, prompt_id, client_id, prefixes=(), encoder_profile=DEFAULT_ENCODER_PROFILE, stream=True):
+        """Starts correlating new files to this prompt. / 开始将新文件关联到此任务。"""
+        with self._lock:
+            self._tracked[prompt_id] = {
+                'client_id': client_id,
+                'started': time.time(),
+                'prefixes': tuple(p.replace('\\', '/') for p in prefixes if p),
+                'encoder_profile': encoder_profile,
+                'stream': stream,
+                'files': [],
+                'last_file_at': None,
+                'file_event': threading.Event(),
+            }
+
+    def untrack(self, prompt_id):
+        """Stops tracking and returns the files assigned to the prompt. / 停止跟踪并返回分配给任务的文件。"""
+        with self._lock:
+            entry = self._tracked.pop(prompt_id, None)
+        return list(entry['files']) if entry else []
+
+    def mark_executing(self, prompt_id):
+        """Records the prompt ComfyUI is executing; used to break ties between unprefixed prompts."""
+        """记录 ComfyUI 正在执行的任务，用于在无前缀的多个任务间做区分。"""
+        with self._lock:
+            self._executing_prompt_id = prompt_id
+
+    def files_for(self, prompt_id):
+        with self._lock:
+            entry = self._tracked.get(prompt_id)
+            return list(entry['files']) if entry else []
+
+    def wait_for_files(self, prompt_id, deadline, cancel_event=None, settle=OUTPUT_WATCHER_SETTLE_SECONDS):
+        """Blocks until files arrived for the prompt and no new file came for `settle` seconds.
+        Gives up with [] at `deadline` (a time.monotonic() value) or as soon as cancel_event is set."""
+        """阻塞直到任务的文件到达，且 `settle` 秒内没有新文件。
+        到达 `deadline`（time.monotonic() 时间点）或 cancel_event 被设置时立即放弃并返回 []。"""
+        with self._lock:
+            entry = self._tracked.get(prompt_id)
+        if not entry:
+            return []
+        cancelled = lambda: cancel_event is not None and cancel_event.is_set()
+        while not entry['file_event'].is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or cancelled():
+                return []
+            entry['file_event'].wait(min(remaining, 1.0)) # Short slices so a cancel is noticed / 分段等待以便及时感知取消
+        while not cancelled():
+            with self._lock:
+                quiet_for = time.time() - (entry['last_file_at'] or 0)
+            if quiet_for >= settle:
+                return self.files_for(prompt_id)
+            time.sleep(settle - quiet_for)
+        return []
+
+    def _run(self):
+        # Baseline: names already present are never results; listed once, not stat()ed / 基线：已存在的文件不会是结果；只列出一次，不调用 stat()
+        try: run_in_threadpool(self._scan_once, True)
+        except Exception as e: log.error(f"[Watcher] Baseline scan error: {e}", exc_info=True)
+        while True:
+            try:
+                with self._lock:
+                    has_tracked = bool(self._tracked)
+                if has_tracked:
+                    # Directory walks and stat() run off the hub / 目录遍历和 stat() 在 hub 之外运行
+                    new_files, unlisted = run_in_threadpool(self._scan_once)
+                    for directory in unlisted: log.warning(f"[Watcher] Cannot list {directory}")
+                    for path in new_files:
+                        self._assign(path)
+            except Exception as e:
+                log.error(f"[Watcher] Scan error: {e}", exc_info=True)
+            time.sleep(self.interval)
+
+    def _scan_once(self, baseline=False):
+        """Returns (files that are new and fully written since the last scan, directories that could not be listed).
+        With baseline=True every listed file is recorded as known instead. Runs in the threadpool: no logging, no locks."""
+        """返回 (自上次扫描以来新出现且已完整写入的文件, 无法列出的目录)。baseline=True 时将列出的文件全部记为已知。
+        在线程池中运行：不记录日志，不获取锁。"""
+        new_files = []; unlisted = []; seen = set()
+        stack = [d for d in self.directories if os.path.isdir(d)]
+        while stack:
+            directory = stack.pop()
+            try:
+                dir_mtime = os.stat(directory).st_mtime
+            except OSError:
+                continue
+            seen.add(directory)
+            cached = self._dir_state.get(directory)
+            if cached and cached[0] == dir_mtime:
+                # Directory listing unchanged, only descend into known subdirectories / 目录列表未变，仅深入已知子目录
+                stack.extend(cached[1])
+                continue
+            known = cached[2] if cached else set()
+            subdirs = []; listed = set()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.name.lower().endswith(OUTPUT_WATCHER_EXTENSIONS):
+                            listed.add(entry.path)
+            except OSError:
+                unlisted.append(directory)
+                continue
+            if baseline:
+                known = listed
+            else:
+                for path in listed - known: self._pending_files.setdefault(path, None)
+                known &= listed # Forget files that were deleted (e.g. by retention) / 遗忘已被删除的文件（如被保留策略清理）
+            self._dir_state[directory] = (dir_mtime, subdirs, known)
+            stack.extend(subdirs)
+        for directory in set(self._dir_state) - seen: del self._dir_state[directory] # Removed directories / 已删除的目录
+        if baseline:
+            return new_files, unlisted
+
+        # A file counts as fully written once its size is stable across two scans / 文件大小在两次扫描间保持不变即视为写入完成
+        for path, previous in list(self._pending_files.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending_files[path]
+                continue
+            current = (st.st_size, st.st_mtime)
+            if previous == current and st.st_size > 0:
+                del self._pending_files[path]
+                state = self._dir_state.get(os.path.dirname(path))
+                if state: state[2].add(path)
+                new_files.append((path, st.st_mtime))
+            else:
+                self._pending_files[path] = current
+        return new_files, unlisted
+
+    def _assign(self, file_info):
+        path, mtime = file_info
+        rel_name = path
+        for base in self.directories:
+            if path.startswith(base):
+                rel_name = os.path.relpath(path, base).replace('\\', '/')
+                break
+        with self._lock:
+            # Only prompts that started before the file was written can own it / 只有在文件写入前启动的任务才可能拥有它
+            candidates = {pid: e for pid, e in self._tracked.items() if mtime >= e['started'] - 1}
+            by_prefix = [pid for pid, e in candidates.items() if any(rel_name.startswith(p) for p in e['prefixes'])]
+            if len(by_prefix) == 1:
+                owner = by_prefix[0]
+            elif not by_prefix and len(candidates) == 1:
+                owner = next(iter(candidates))
+            elif not by_prefix and self._executing_prompt_id in candidates:
+                # ComfyUI executes one prompt at a time / ComfyUI 一次只执行一个任务
+                owner = self._executing_prompt_id
+            else:
+                log.debug(f"[Watcher] Could not correlate {rel_name} to a single prompt ({len(by_prefix) or len(candidates)} candidates).")
+                return
+            entry = candidates[owner]
+            entry['files'].append(path)
+            entry['last_file_at'] = time.time()
+            entry['file_event'].set()
+        log.info(f"[Watcher] [{owner}] Result file detected: {rel_name}")
+        if entry['stream']:
+            _, profile_settings = resolve_encoder_profile(entry['encoder_profile'])
+            data_url = encode_image_file(path, profile_settings)
+            if data_url:
+                emit_to_client(entry['client_id'], 'render_partial_result', {
+                    'prompt_id': owner,
+                    'images': [data_url],
+                    'filename': rel_name,
+                    'encoder_profile': entry['encoder_profile'],
+                })
+
+output_watcher = OutputDirectoryWatcher([COMFYUI_OUTPUT_PATH, COMFYUI_TEMP_PATH])
+
+
 # --- ComfyUI Main WebSocket Listener ---
-def queue_comfyui_prompt(prompt_data, client_id, prompt_id):
-    """Connects to ComfyUI main WS, sends the prompt, and listens for relevant events."""
-    """连接到 ComfyUI 主 WebSocket，发送提示，并监听相关事件。"""
+def value_digest(value):
+    """Short stable digest of a JSON-serializable value. / JSON 可序列化值的简短稳定摘要。"""
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def bridge_input_key(bridge_inputs, mode):
+    """Returns a short digest of the value a NodeBridge_Input of this mode will be answered with, or None if it is not known up front."""
+    """返回该模式的 NodeBridge_Input 将得到的值的简短摘要；若事先未知则返回 None。"""
+    if not bridge_inputs or mode not in bridge_inputs: return None
+    return value_digest(bridge_inputs[mode])
+
+def prepare_prompt_job(prompt_data, prompt_id, index=None, bridge_inputs=None):
+    """Copies a prompt, adds the NodeBridge inputs and returns the listener's job record.
+    A NodeBridge_Input whose value is sent up front (bridge_inputs) gets a digest of that value as _input_key, so it (and
+    everything below it) re-executes only when the value changes. Otherwise its value is only known when the frontend answers
+    at run time, so its _input_key is the prompt id: the node runs every time and never serves a stale cached answer.
+    Frontends should therefore send the values up front as bridge_inputs (the bundled page does)."""
+    """复制任务图，添加 NodeBridge 输入，并返回监听器使用的任务记录。
+    预先发送了值（bridge_inputs）的 NodeBridge_Input 以该值的摘要作为 _input_key，只有值变化时它（及其下游）才会重新执行。
+    否则其值要到运行时前端应答才知道，因此 _input_key 取任务 ID：该节点每次都会执行，绝不会返回过期的缓存应答。
+    因此前端应以 bridge_inputs 预先发送这些值（自带页面即如此）。"""
+    # Deep copy so variants of the same parsed workflow never share node dicts / 深拷贝，保证同一工作流的变体互不影响
+    modified_prompt = copy.deepcopy(prompt_data)
+    nodes_to_inject = ["NodeBridge_Input", "NodeBridge_Output"] # Nodes needing context / 需要上下文的节点
+    output_node_id_in_workflow = None # Track the output node ID / 跟踪输出节点 ID
+    for node_id, node_info in modified_prompt.items():
+        class_type = node_info.get("class_type")
+        if class_type in nodes_to_inject:
+            if "inputs" not in node_info: node_info["inputs"] = {}
+            if "_prompt_id" in node_info["inputs"]: # Per-run ids defeat ComfyUI's cache; keep the input, but stable / 每次运行不同的 ID 会使 ComfyUI 缓存失效；保留该输入但取固定值
+                node_info["inputs"]["_prompt_id"] = BRIDGE_CONTEXT_KEY
+            node_info["inputs"]["_node_id"] = str(node_id) # Stable across runs / 多次运行保持不变
+            if class_type == "NodeBridge_Input":
+                # Cache reuse is only safe for values known before submission / 只有提交前已知的值才能安全复用缓存
+                node_info["inputs"]["_input_key"] = bridge_input_key(bridge_inputs, node_info["inputs"].get("mode")) or prompt_id
+            if class_type == "NodeBridge_Output":
+                output_node_id_in_workflow = node_id
+    return {
+        'prompt_id': prompt_id,
+        'prompt': modified_prompt,
+        'output_node_id': output_node_id_in_workflow,
+        'index': index, # Variant index within a batch / 批次中的变体序号
+        'completed': False,
+        'cached_nodes': 0, # Nodes ComfyUI reused from its cache / ComfyUI 从缓存复用的节点数
+        # Recorded in the render history / 记录到渲染历史中
+        'input_hashes': dict({mode: bridge_input_key(bridge_inputs, mode) for mode in bridge_inputs or {}}, prompt=value_digest(modified_prompt)),
+        'queued_at': None,
+        'started_at': None,
+    }
+
+def apply_prompt_variation(prompt, variation):
+    """Applies a batch variation's seed and explicit node input overrides to an API-format prompt."""
+    """将批次变体的种子和显式节点输入覆盖应用到 API 格式的任务图。"""
+    node_overrides = variation.get('inputs') or {}
+    if not isinstance(node_overrides, dict) or not all(isinstance(overrides, dict) for overrides in node_overrides.values()):
+        raise ValueError("'inputs' must map node ids to objects of input values")
+    seed = variation.get('seed')
+    if seed is not None:
+        for node_info in prompt.values():
+            inputs = node_info.get('inputs', {})
+            for seed_key in ('seed', 'noise_seed'):
+                # Linked inputs are [node_id, slot] lists and must stay untouched / 链接输入为 [node_id, slot] 列表，不可修改
+                if seed_key in inputs and not isinstance(inputs[seed_key], list):
+                    inputs[seed_key] = int(seed)
+    for node_id, overrides in node_overrides.items():
+        if node_id in prompt:
+            prompt[node_id].setdefault('inputs', {}).update(overrides)
+
+def bridge_overrides_from_variation(variation):
+    """Maps batch variation fields to NodeBridge_Input modes answered without asking the frontend."""
+    """将批次变体字段映射为无需询问前端即可应答的 NodeBridge_Input 模式。"""
+    return {mode: variation[key] for key, mode in BATCH_VARIATION_BRIDGE_MODES.items() if variation.get(key) is not None}
+
+def parse_bridge_inputs(raw):
+    """Validates the optional 'bridge_inputs' of a trigger request. Returns (inputs or None, error message or None)."""
+    """校验触发请求中可选的 'bridge_inputs'。返回 (inputs 或 None, 错误信息或 None)。"""
+    if raw is None: return None, None
+    if not isinstance(raw, dict) or any(mode not in BRIDGE_INPUT_MODES for mode in raw):
+        return None, f"无效的桥接输入 (Invalid bridge_inputs, allowed modes: {', '.join(BRIDGE_INPUT_MODES)})."
+    return raw, None
+
+def parse_preview_frame(frame):
+    """Decodes a ComfyUI binary WS frame. Returns (mime_type, image_bytes, metadata), or None for frames that are not previews."""
+    """解码 ComfyUI 二进制 WS 帧。返回 (mime_type, image_bytes, metadata)；非预览帧返回 None。"""
+    if len(frame) < 8: return None
+    event_type = int.from_bytes(frame[:4], 'big')
+    if event_type == PREVIEW_EVENT_IMAGE:
+        mime_type = PREVIEW_IMAGE_TYPES.get(int.from_bytes(frame[4:8], 'big'))
+        return (mime_type, frame[8:], {}) if mime_type else None
+    if event_type == PREVIEW_EVENT_IMAGE_WITH_METADATA:
+        metadata_length = int.from_bytes(frame[4:8], 'big')
+        try: metadata = json.loads(frame[8:8 + metadata_length])
+        except ValueError: return None
+        return metadata.get('image_type', 'image/png'), frame[8 + metadata_length:], metadata
+    return None
+
+def scale_preview_image(mime_type, image_bytes, max_size=None):
+    """Returns (mime_type, image_bytes) with the longest side at most max_size; small previews are passed through untouched."""
+    """返回最长边不超过 max_size 的 (mime_type, image_bytes)；较小的预览原样透传。"""
+    max_size = max_size or PREVIEW_MAX_SIZE
+    with Image.open(BytesIO(image_bytes)) as img:
+        if max(img.size) <= max_size: return mime_type, image_bytes # Only the header was read / 只读取了文件头
+        img = img.convert('RGB')
+        img.thumbnail((max_size, max_size))
+        buffered = BytesIO()
+        img.save(buffered, format='JPEG', quality=PREVIEW_JPEG_QUALITY)
+    return 'image/jpeg', buffered.getvalue()
+
+def forward_preview_frame(client_id, frame, job, preview_state, batch_id=None):
+    """Forwards a sampler preview to the owning client as a binary 'preview_frame' event, at most PREVIEW_MAX_FPS per second.
+    Frames over the rate are dropped; the final result always arrives through render_result."""
+    """将采样预览以二进制 'preview_frame' 事件转发给所属客户端，每秒最多 PREVIEW_MAX_FPS 帧。
+    超出速率的帧被丢弃；最终结果总会通过 render_result 送达。"""
+    if PREVIEW_MAX_FPS <= 0 or job is None or job['completed']: return False
+    now = time.monotonic()
+    if now - preview_state['last_sent'] < 1.0 / PREVIEW_MAX_FPS: return False
+    parsed = parse_preview_frame(frame)
+    if parsed is None: return False
+    mime_type, image_bytes, metadata = parsed
+    try: mime_type, image_bytes = scale_preview_image(mime_type, image_bytes)
+    except Exception as e:
+        listener_log.warning(f"[{job['prompt_id']}] Skipping undecodable preview frame: {e}", extra={'sample_key': 'preview_error'})
+        return False
+    preview_state['last_sent'] = now
+    payload = {'prompt_id': job['prompt_id'], 'mime': mime_type, 'image': image_bytes, 'node_id': metadata.get('node_id')}
+    if batch_id: payload.update({'batch_id': batch_id, 'index': job['index']})
+    emit_to_client(client_id, 'preview_frame', payload)
+    listener_log.debug(f"[{job['prompt_id']}] Preview frame forwarded ({len(image_bytes)} bytes).", extra={'sample_key': 'preview'})
+    return True
+
+def emit_job_result(client_id, job, images, profile_name, batch_id=None, recovered=False, transport='file', files=()):
+    """Sends a finished prompt's images as render_result, or batch_result inside a batch, and records it in the render history.
+    Images are Data URLs, or {'mime', 'data'} binary attachments when they were pushed by the output node (transport='push').
+    files are the result files on disk, if known."""
+    """发送已完成任务的图像：单任务为 render_result，批次中为 batch_result，并记录到渲染历史中。
+    图像为数据 URL；若由输出节点推送（transport='push'），则为 {'mime', 'data'} 二进制附件。files 为磁盘上的结果文件（若已知）。"""
+    record_render_history(client_id, job, images, profile_name, batch_id, transport, files)
+    payload = {'images': images, 'encoder_profile': profile_name, 'cached_nodes': job['cached_nodes'], 'total_nodes': len(job['prompt']), 'transport': transport}
+    if recovered: payload['recovered'] = True
+    if files and client_id.startswith(API_JOB_CLIENT_PREFIX): payload['files'] = list(files) # Served from disk, never sent to browsers / 从磁盘提供，不会发给浏览器
+    if batch_id:
+        payload.update({'batch_id': batch_id, 'prompt_id': job['prompt_id'], 'index': job['index']})
+        emit_to_client(client_id, 'batch_result', payload)
+    else:
+        emit_to_client(client_id, 'render_result', payload)
+
+def emit_job_error(client_id, job, message, batch_id=None):
+    """Sends a prompt failure as render_error, or as an error batch_result inside a batch."""
+    """发送任务失败：单任务为 render_error，批次中为带错误的 batch_result。"""
+    if batch_id:
+        emit_to_client(client_id, 'batch_result', {'batch_id': batch_id, 'prompt_id': job['prompt_id'], 'index': job['index'], 'error': message})
+    else:
+        emit_to_client(client_id, 'render_error', {'message': message})
+
+def deliver_output_images(client_id, job, outputs, profile_name, profile_settings, batch_id=None):
+    """Encodes the images reported for the output node and emits the result (or an error)."""
+    """编码输出节点上报的图像并发送结果（或错误）。"""
+    prompt_id = job['prompt_id']; node_id = job['output_node_id']
+    pushed = pushed_output_images.pop(prompt_id, None)
+    if pushed and pushed['images']:
+        # Encoded once by the node and relayed as-is: no disk read, no decode / 节点只编码一次并原样转发：不读磁盘、不解码
+        log.info(f"[{prompt_id}] Sending {len(pushed['images'])} pushed image(s) to client {client_id} ({sum(len(i['data']) for i in pushed['images'])} bytes).")
+        emit_job_result(client_id, job, pushed['images'], profile_name, batch_id, transport='push')
+        return True
+    if 'images' not in outputs:
+        log.warning(f"[{prompt_id}] NodeBridge_Output {node_id} executed but no 'images' key in output data.")
+        emit_job_error(client_id, job, 'Output node ran, but produced no image data.', batch_id)
+        return False
+
+    log.info(f"[{prompt_id}] Output images found in node {node_id}: {len(outputs['images'])}")
+    final_images_base64 = []; image_paths = []
+    for img_info in outputs['images']:
+        img_path = resolve_output_image_path(img_info)
+        if not img_path:
+             log.warning(f"[{prompt_id}] Image info missing filename: {img_info}")
+             continue
+        log.info(f"[{prompt_id}] Attempting to process output image: {img_path}")
+        base64_data = encode_image_file(img_path, profile_settings)
+        if base64_data:
+            final_images_base64.append(base64_data); image_paths.append(img_path)
+            log.info(f"[{prompt_id}] Successfully processed and encoded image: {img_info.get('filename')}")
+        else:
+            log.error(f"[{prompt_id}] Failed to encode image to base64: {img_info.get('filename')}")
+
+    if final_images_base64:
+        log.info(f"[{prompt_id}] Sending {len(final_images_base64)} images to client {client_id} (encoder profile: {profile_name}).")
+        emit_job_result(client_id, job, final_images_base64, profile_name, batch_id, files=image_paths)
+        return True
+    log.warning(f"[{prompt_id}] NodeBridge_Output {node_id} executed but no images were successfully processed.")
+    emit_job_error(client_id, job, 'Output node ran, but failed to process result images.', batch_id)
+    return False
+
+def reconnect_comfyui_ws(ws, comfyui_ws_url, listener_id):
+    """Re-opens the ComfyUI WS with exponential backoff. Returns the new connection or None."""
+    """以指数退避重新打开 ComfyUI WS。返回新连接或 None。"""
+    if ws:
+        try: ws.close()
+        except Exception: pass
+    delay = COMFYUI_WS_RECONNECT_BASE_DELAY
+    for attempt in range(1, COMFYUI_WS_RECONNECT_ATTEMPTS + 1):
+        time.sleep(delay)
+        try:
+            new_ws = websocket.create_connection(comfyui_ws_url, timeout=10)
+            listener_log.info(f"[{listener_id}] ComfyUI Main WS reconnected (attempt {attempt}).")
+            reset_object_info() # ComfyUI may have restarted with other custom nodes / ComfyUI 可能已带着不同的自定义节点重启
+            return new_ws
+        except Exception as e:
+            listener_log.warning(f"[{listener_id}] Reconnect attempt {attempt}/{COMFYUI_WS_RECONNECT_ATTEMPTS} failed: {e}")
+        delay = min(delay * 2, COMFYUI_WS_RECONNECT_MAX_DELAY)
+    listener_log.error(f"[{listener_id}] Could not reconnect to ComfyUI Main WS.")
+    return None
+
+def resync_prompt_state(client_id, job, profile_name, profile_settings, batch_id=None, queue_ids=None):
+    """Re-syncs a prompt after a WS outage using /history and /queue.
+
+    Returns 'completed' if the result (or a final error) was delivered, 'active' if ComfyUI
+    still has the prompt queued or running, and 'lost' if its state cannot be determined.
+    """
+    """通过 /history 和 /queue 在 WS 中断后重新同步任务状态。"""
+    prompt_id = job['prompt_id']; output_node_id = job['output_node_id']
+    try:
+        history = fetch_prompt_history(prompt_id)
+        if history:
+            status = history.get('status', {})
+            if status.get('status_str') == 'error':
+                listener_log.error(f"[{prompt_id}] ComfyUI reports the prompt failed during the outage.")
+                emit_job_error(client_id, job, 'ComfyUI reported an execution error for this prompt.', batch_id)
+                return 'completed'
+            outputs = history.get('outputs', {})
+            if output_node_id is not None and output_node_id in outputs:
+                listener_log.info(f"[{prompt_id}] Prompt finished during the outage; delivering result from /history.")
+                deliver_output_images(client_id, job, outputs[output_node_id], profile_name, profile_settings, batch_id)
+                return 'completed'
+            if status.get('completed') or output_node_id is None:
+                listener_log.warning(f"[{prompt_id}] Prompt finished during the outage without NodeBridge_Output result.")
+                emit_job_error(client_id, job, 'Prompt finished, but the output node produced no result.', batch_id)
+                return 'completed'
+        running, pending = queue_ids if queue_ids is not None else fetch_queue_prompt_ids()
+        if prompt_id in running or prompt_id in pending:
+            listener_log.info(f"[{prompt_id}] Prompt still {'running' if prompt_id in running else 'queued'} in ComfyUI, resuming listener.")
+            return 'active'
+        listener_log.warning(f"[{prompt_id}] Prompt is neither in ComfyUI history nor queue.")
+    except Exception as e:
+        listener_log.error(f"[{prompt_id}] Failed to re-sync prompt state over HTTP: {e}")
+    return 'lost'
+
+def deliver_from_history(client_id, job, profile_name, profile_settings, batch_id=None):
+    """Delivers the output node's result from ComfyUI's /history once the prompt has ended. / 任务结束后从 ComfyUI 的 /history 交付输出节点的结果。"""
+    prompt_id = job['prompt_id']
+    try:
+        outputs = (fetch_prompt_history(prompt_id) or {}).get('outputs', {})
+    except Exception as e:
+        listener_log.error(f"[{prompt_id}] Failed to read /history for the output node: {e}")
+        outputs = {}
+    listener_log.info(f"[{prompt_id}] Delivering NodeBridge_Output result from /history.")
+    return deliver_output_images(client_id, job, outputs.get(job['output_node_id'], {}), profile_name, profile_settings, batch_id)
+
+def recover_from_output_directory(client_id, job, profile_name, profile_settings, batch_id=None, deadline=None, cancel_event=None):
+    """Delivers result files picked up by the output watcher after the WS listener broke.
+    Waits for them until `deadline` (time.monotonic(); default OUTPUT_WATCHER_RECOVERY_TIMEOUT from now) or a cancel."""
+    """WS 监听器中断后，交付输出监视器捕获的结果文件。
+    等待至 `deadline`（time.monotonic()；默认为从现在起 OUTPUT_WATCHER_RECOVERY_TIMEOUT 秒）或被取消为止。"""
+    prompt_id = job['prompt_id']
+    pushed = pushed_output_images.pop(prompt_id, None)
+    if pushed and pushed['images']: # The output node already handed over its images / 输出节点已交付其图像
+        listener_log.info(f"[{prompt_id}] Recovered {len(pushed['images'])} pushed images after listener failure.")
+        emit_job_result(client_id, job, pushed['images'], profile_name, batch_id, recovered=True, transport='push')
+        return
+    if not OUTPUT_WATCHER_ENABLED:
+        emit_job_error(client_id, job, 'Lost connection to ComfyUI before the result arrived.', batch_id)
+        return
+    deadline = deadline or time.monotonic() + OUTPUT_WATCHER_RECOVERY_TIMEOUT
+    listener_log.warning(f"[{prompt_id}] Listener ended without output. Waiting up to {max(deadline - time.monotonic(), 0):.0f}s for result files.")
+    emit_to_client(client_id, 'status_update', {'status': "连接中断，等待输出文件 Connection lost, waiting for output files..."})
+    recovered_files = output_watcher.wait_for_files(prompt_id, deadline, cancel_event)
+    if cancel_event is not None and cancel_event.is_set():
+        return # The listener reports the cancel / 由监听器报告取消
+    recovered_images = [data for data in (encode_image_file(path, profile_settings) for path in recovered_files) if data]
+    if recovered_images:
+        listener_log.info(f"[{prompt_id}] Recovered {len(recovered_images)} images from the output directory.")
+        emit_job_result(client_id, job, recovered_images, profile_name, batch_id, recovered=True, files=recovered_files)
+    else:
+        listener_log.error(f"[{prompt_id}] No result files recovered after listener failure.")
+        emit_job_error(client_id, job, 'Lost connection to ComfyUI and no result files were found.', batch_id)
+
+def queue_comfyui_prompt(prompt_data, client_id, prompt_id, encoder_profile=DEFAULT_ENCODER_PROFILE, bridge_inputs=None):
+    """Queues a single prompt and listens for its events. / 提交单个任务并监听其事件。"""
+    queue_comfyui_prompts(client_id, [prepare_prompt_job(prompt_data, prompt_id, bridge_inputs=bridge_inputs)], encoder_profile)
+
+def queue_comfyui_prompts(client_id, jobs, encoder_profile=DEFAULT_ENCODER_PROFILE, batch_id=None):
+    """Connects to ComfyUI main WS once, queues all prompts, and listens for their events."""
+    """只连接一次 ComfyUI 主 WebSocket，提交所有任务，并监听其事件。"""
     ws = None
+    listener_id = batch_id or jobs[0]['prompt_id'] # Log/mapping key of this listener / 此监听器的日志/映射键
+    jobs_by_id = {job['prompt_id']: job for job in jobs}
+    total_jobs = len(jobs)
+    profile_name, profile_settings = resolve_encoder_profile(encoder_profile)
     comfyui_ws_url = f"ws://{COMFYUI_API_ADDRESS}/ws?clientId={client_id}"
-    log.info(f"[{prompt_id}] Connecting to ComfyUI Main WS: {comfyui_ws_url}")
+    listener_log.info(f"[{listener_id}] Connecting to ComfyUI Main WS: {comfyui_ws_url}")
+    cancel_event = threading.Event()
+    listener_info = {'client_id': client_id, 'prompt_ids': list(jobs_by_id), 'jobs': jobs, 'cancel_event': cancel_event, 'ws': None}
+    active_listeners[listener_id] = listener_info
+    if listener_id in pending_cancels:
+        pending_cancels.discard(listener_id); cancel_event.set() # Cancelled before it got here / 在到达此处之前已被取消
+    preview_state = {'last_sent': 0.0} # Throttle for live previews / 实时预览的节流状态
+
+    def finish_job(job):
+        """Marks a prompt finished and reports aggregate batch progress. / 标记任务完成并上报批次总体进度。"""
+        job['completed'] = True
+        if executing_prompt['prompt_id'] == job['prompt_id']: executing_prompt['prompt_id'] = None
+        if batch_id:
+            completed_count = sum(1 for j in jobs if j['completed'])
+            emit_to_client(client_id, 'batch_progress', {'batch_id': batch_id, 'completed': completed_count, 'total': total_jobs,
+                                                         'percent': int(completed_count * 100 / total_jobs)})
 
     try:
         # Use short timeout for connection, maybe retry needed / 对连接使用短超时，可能需要重试
         ws = websocket.create_connection(comfyui_ws_url, timeout=10)
-        log.info(f"[{prompt_id}] ComfyUI Main WS connected successfully.")
-
-        # Inject context (_prompt_id, _node_id) into NodeBridge nodes / 将上下文（_prompt_id, _node_id）注入 NodeBridge 节点
-        modified_prompt = prompt_data.copy() # Use copy to avoid modifying original / 使用副本以避免修改原始数据
-        nodes_to_inject = ["NodeBridge_Input", "NodeBridge_Output"] # Nodes needing context / 需要上下文的节点
-        output_node_id_in_workflow = None # Track the output node ID / 跟踪输出节点 ID
-        for node_id, node_info in modified_prompt.items():
-            class_type = node_info.get("class_type")
-            if class_type in nodes_to_inject:
-                if "inputs" not in node_info: node_info["inputs"] = {}
-                # Ensure values are strings / 确保值是字符串
-                node_info["inputs"]["_prompt_id"] = str(prompt_id)
-                node_info["inputs"]["_node_id"] = str(node_id)
-                log.info(f"[{prompt_id}] Injected context into node {node_id} ({class_type})")
-                if class_type == "NodeBridge_Output":
-                    output_node_id_in_workflow = node_id
-
-        log.info(f"[{prompt_id}] Queuing prompt for client {client_id}")
-        ws.send(json.dumps({'prompt': modified_prompt, 'client_id': client_id}))
+        listener_info['ws'] = ws
+        listener_log.info(f"[{listener_id}] ComfyUI Main WS connected successfully.")
+
+        for job in jobs:
+            if cancel_event.is_set(): break # Cancelled while submitting / 提交过程中被取消
+            prompt_id = job['prompt_id']
+            # Let the output watcher correlate result files to this prompt / 让输出监视器将结果文件关联到此任务
+            if OUTPUT_WATCHER_ENABLED:
+                output_prefix = None
+                if job['output_node_id'] is not None:
+                    output_prefix = job['prompt'][job['output_node_id']].get("inputs", {}).get("filename_prefix")
+                prefixes = (output_prefix,) if isinstance(output_prefix, str) else ()
+                output_watcher.track(prompt_id, client_id, prefixes=prefixes, encoder_profile=profile_name, stream=batch_id is None)
+
+            listener_log.info(f"[{prompt_id}] Queuing prompt for client {client_id}")
+            try:
+                submit_comfyui_prompt(job['prompt'], client_id, prompt_id)
+            except Exception as e:
+                # Only this variant fails; the ones already queued are still listened for / 只有此变体失败；已入队的任务仍被监听
+                listener_log.error(f"[{prompt_id}] Failed to queue prompt: {e}")
+                emit_job_error(client_id, job, f"Failed to queue prompt: {e}", batch_id)
+                finish_job(job); continue
+            job['queued_at'] = time.time()
 
         # --- Listener Loop ---
-        execution_completed = False
-        while not execution_completed:
+        while not all(job['completed'] for job in jobs) and not cancel_event.is_set():
             message_str = None
+            connection_lost = False
             try:
                 # Set a reasonable timeout for receiving messages / 为接收消息设置合理的超时
                 message_str = ws.recv()
                 if not message_str:
-                    log.warning(f"[{prompt_id}] ComfyUI Main WS received empty message, breaking.")
-                    break
+                    listener_log.warning(f"[{listener_id}] ComfyUI Main WS received empty message.")
+                    connection_lost = True
             except websocket.WebSocketTimeoutException:
-                 log.warning(f"[{prompt_id}] ComfyUI Main WS receive timeout, checking connection.")
+                 listener_log.warning(f"[{listener_id}] ComfyUI Main WS receive timeout, checking connection.")
                  try: # Send a ping to check if connection is still alive / 发送 ping 以检查连接是否仍然活动
                      ws.ping()
                      continue # Continue listening if ping succeeds / 如果 ping 成功，则继续监听
                  except Exception as ping_err:
-                     log.error(f"[{prompt_id}] ComfyUI Main WS connection lost (ping failed: {ping_err}).")
-                     break # Break loop if ping fails / 如果 ping 失败则中断循环
+                     listener_log.error(f"[{listener_id}] ComfyUI Main WS connection lost (ping failed: {ping_err}).")
+                     connection_lost = True
             except websocket.WebSocketConnectionClosedException:
-                 log.error(f"[{prompt_id}] ComfyUI Main WS connection closed unexpectedly.")
-                 break # Break loop if connection closed / 如果连接关闭则中断循环
+                 listener_log.error(f"[{listener_id}] ComfyUI Main WS connection closed unexpectedly.")
+                 connection_lost = True
             except Exception as recv_err:
-                 log.error(f"[{prompt_id}] Error receiving from ComfyUI Main WS: {recv_err}", exc_info=True)
-                 break # Break on other receive errors / 发生其他接收错误时中断
+                 listener_log.error(f"[{listener_id}] Error receiving from ComfyUI Main WS: {recv_err}", exc_info=True)
+                 connection_lost = True
+
+            if connection_lost and cancel_event.is_set():
+                break # Socket closed by cancel_render_for_client / 套接字被取消操作关闭
+            if connection_lost:
+                # ComfyUI keeps executing without us: reconnect, then re-sync from /history and /queue
+                # ComfyUI 会继续执行：先重连，再通过 /history 和 /queue 重新同步
+                emit_to_client(client_id, 'status_update', {'status': "连接中断，正在重连 Connection lost, reconnecting..."})
+                ws = reconnect_comfyui_ws(ws, comfyui_ws_url, listener_id)
+                listener_info['ws'] = ws
+                try: queue_ids = fetch_queue_prompt_ids()
+                except Exception as e: queue_ids = None; listener_log.error(f"[{listener_id}] Failed to read ComfyUI queue: {e}")
+                any_lost = False
+                for job in jobs:
+                    if job['completed']: continue
+                    resync_state = resync_prompt_state(client_id, job, profile_name, profile_settings, batch_id, queue_ids or (set(), set()))
+                    if resync_state == 'completed': finish_job(job)
+                    elif resync_state == 'lost': any_lost = True
+                if all(job['completed'] for job in jobs):
+                    break
+                if ws is None or any_lost:
+                    break # Fall back to output directory recovery / 回退到输出目录恢复
+                emit_to_client(client_id, 'status_update', {'status': "已重新连接 Reconnected, resuming..."})
+                continue
+
+            # Binary frames carry sampler previews; they belong to the prompt ComfyUI is executing for this client
+            # 二进制帧携带采样预览；它们属于 ComfyUI 正在为此客户端执行的任务
+            if isinstance(message_str, bytes):
+                preview_job = jobs_by_id.get(executing_prompt['prompt_id']) or (jobs[0] if total_jobs == 1 else None)
+                forward_preview_frame(client_id, message_str, preview_job, preview_state, batch_id)
+                continue
 
             # --- Process Received Message ---
             try:
@@ -221,149 +1288,239 @@ def queue_comfyui_prompt(prompt_data, client_id, prompt_id):
                 exec_prompt_id = msg_data.get('prompt_id', None) # Get prompt_id where available / 在可用时获取 prompt_id
 
                 # Ignore messages for other prompts / 忽略其他提示的消息
-                if exec_prompt_id and exec_prompt_id != prompt_id:
-                    # log.debug(f"Ignoring WS message for different prompt {exec_prompt_id}")
+                if exec_prompt_id and exec_prompt_id not in jobs_by_id:
+                    # listener_log.debug(f"Ignoring WS message for different prompt {exec_prompt_id}")
                     continue
+                # Older ComfyUI omits prompt_id on some messages; only a single-prompt listener can own those
+                # 旧版 ComfyUI 的部分消息不含 prompt_id；仅单任务监听器可以认领这些消息
+                job = jobs_by_id.get(exec_prompt_id) if exec_prompt_id else (jobs[0] if total_jobs == 1 else None)
+                prompt_id = exec_prompt_id or listener_id
 
                 # --- Handle specific message types ---
                 if msg_type == 'status':
                     status_info = msg_data.get('status', {})
                     queue_remaining = status_info.get('execinfo', {}).get('queue_remaining', 0)
-                    log.info(f"[{prompt_id}] Status update: Queue remaining = {queue_remaining}")
-                    socketio.emit('status_update', {'status': f"队列 Queue: {queue_remaining}"}, room=client_id)
+                    listener_log.info(f"[{listener_id}] Status update: Queue remaining = {queue_remaining}", extra={'sample_key': 'status'})
+                    emit_to_client(client_id, 'status_update', {'status': f"队列 Queue: {queue_remaining}"})
 
                 elif msg_type == 'execution_start':
-                     if msg_data.get('prompt_id') == prompt_id:
-                         log.info(f"[{prompt_id}] Execution started.")
-                         socketio.emit('status_update', {'status': "执行开始 Execution Started..."}, room=client_id)
+                     if job:
+                         listener_log.info(f"[{prompt_id}] Execution started.")
+                         output_watcher.mark_executing(prompt_id)
+                         executing_prompt['prompt_id'] = prompt_id
+                         job['started_at'] = time.time()
+                         emit_to_client(client_id, 'status_update', {'status': "执行开始 Execution Started..."})
+
+                elif msg_type == 'execution_cached':
+                    if job:
+                        job['cached_nodes'] = len(msg_data.get('nodes') or [])
+                        listener_log.info(f"[{prompt_id}] ComfyUI reused {job['cached_nodes']}/{len(job['prompt'])} cached nodes.")
+                        if job['cached_nodes']:
+                            emit_to_client(client_id, 'status_update', {'status': f"缓存命中 Cached: {job['cached_nodes']}/{len(job['prompt'])} nodes"})
 
                 elif msg_type == 'executing':
                     exec_node_id = msg_data.get('node')
+                    if not job:
+                        continue
                     if exec_node_id is not None: # Executing a specific node / 正在执行特定节点
-                        node_title = modified_prompt.get(exec_node_id, {}).get('_meta', {}).get('title', f'Node {exec_node_id}')
-                        log.info(f"[{prompt_id}] Executing node: {node_title} ({exec_node_id})")
-                        socketio.emit('status_update', {'status': f"执行节点 Executing: {node_title}"}, room=client_id)
+                        node_title = job['prompt'].get(exec_node_id, {}).get('_meta', {}).get('title', f'Node {exec_node_id}')
+                        listener_log.info(f"[{prompt_id}] Executing node: {node_title} ({exec_node_id})", extra={'sample_key': 'executing'})
+                        emit_to_client(client_id, 'status_update', {'status': f"执行节点 Executing: {node_title}"})
                     else: # Node is None, usually means the current prompt finished execution phase / Node 为 None，通常表示当前提示已完成执行阶段
-                        log.info(f"[{prompt_id}] Execution phase finished signal.")
+                        listener_log.info(f"[{prompt_id}] Execution phase finished signal.")
                         # This signal might indicate completion if no output node exists or was missed / 如果没有输出节点存在或被错过，此信号可能表示完成
                         # If we know the output node ID, we wait specifically for its 'executed' message / 如果我们知道输出节点 ID，我们将专门等待其“executed”消息
-                        if output_node_id_in_workflow is None:
-                             log.warning(f"[{prompt_id}] Execution phase finished, but no NodeBridge_Output found in workflow. Assuming completion.")
-                             execution_completed = True # Mark as completed / 标记为已完成
-                        else:
-                             socketio.emit('status_update', {'status': "等待输出节点 Waiting for output node..."}, room=client_id)
-
+                        if job['output_node_id'] is None:
+                             listener_log.warning(f"[{prompt_id}] Execution phase finished, but no NodeBridge_Output found in workflow. Assuming completion.")
+                             finish_job(job) # Mark as completed / 标记为已完成
+                        elif not job['completed']:
+                             # The prompt ended without an 'executed' result (e.g. a cached output node on older ComfyUI) / 任务结束但没有 'executed' 结果（如旧版 ComfyUI 上被缓存的输出节点）
+                             deliver_from_history(client_id, job, profile_name, profile_settings, batch_id)
+                             finish_job(job)
 
                 elif msg_type == 'executed':
                     executed_node_id = msg_data.get('node')
-                    log.info(f"[{prompt_id}] Node {executed_node_id} executed.")
+                    if not job:
+                        continue
+                    listener_log.info(f"[{prompt_id}] Node {executed_node_id} executed.", extra={'sample_key': 'executed'})
 
                     # Check if it's the tracked NodeBridge_Output node / 检查它是否是跟踪的 NodeBridge_Output 节点
-                    if executed_node_id == output_node_id_in_workflow:
-                        log.info(f"[{prompt_id}] Detected NodeBridge_Output execution ({executed_node_id}). Processing results.")
-                        outputs = msg_data.get('outputs', {})
-                        final_images_base64 = []
-
-                        if 'images' in outputs:
-                            log.info(f"[{prompt_id}] Output images found in node {executed_node_id}: {len(outputs['images'])}")
-                            for img_info in outputs['images']:
-                                filename = img_info.get('filename')
-                                subfolder = img_info.get('subfolder', '')
-                                img_type = img_info.get('type', 'output') # 'output' or 'temp' or 'input' / 'output' 或 'temp' 或 'input'
-                                if not filename:
-                                     log.warning(f"[{prompt_id}] Image info missing filename: {img_info}")
-                                     continue
-
-                                # Determine full path based on type / 根据类型确定完整路径
-                                base_path = COMFYUI_OUTPUT_PATH
-                                if img_type == 'input': base_path = COMFYUI_INPUT_PATH
-                                # Assuming 'temp' files are also in OUTPUT for simplicity, adjust if needed / 为简单起见，假设“temp”文件也在 OUTPUT 中，如果需要请调整
-                                elif img_type == 'temp': base_path = COMFYUI_OUTPUT_PATH
-
-                                img_path = os.path.normpath(os.path.join(base_path, subfolder, filename))
-                                log.info(f"[{prompt_id}] Attempting to process output image: {img_path}")
-
-                                try:
-                                    if os.path.exists(img_path) and os.path.isfile(img_path):
-                                        with Image.open(img_path) as img:
-                                             base64_data = pil_to_base64(img, image_format=img.format or 'PNG')
-                                             if base64_data:
-                                                 final_images_base64.append(base64_data)
-                                                 log.info(f"[{prompt_id}] Successfully processed and encoded image: {filename}")
-                                             else:
-                                                 log.error(f"[{prompt_id}] Failed to encode image to base64: {filename}")
-                                    else:
-                                        log.error(f"[{prompt_id}] Output image file not found or is not a file: {img_path}")
-                                except Exception as e:
-                                    log.error(f"[{prompt_id}] Error processing output image file {filename}: {e}", exc_info=True)
-
-                            if final_images_base64:
-                                log.info(f"[{prompt_id}] Sending {len(final_images_base64)} images to client {client_id}.")
-                                socketio.emit('render_result', {'images': final_images_base64}, room=client_id)
-                            else:
-                                log.warning(f"[{prompt_id}] NodeBridge_Output {executed_node_id} executed but no images were successfully processed.")
-                                socketio.emit('render_error', {'message': 'Output node ran, but failed to process result images.'}, room=client_id)
-                        else:
-                            log.warning(f"[{prompt_id}] NodeBridge_Output {executed_node_id} executed but no 'images' key in output data.")
-                            socketio.emit('render_error', {'message': 'Output node ran, but produced no image data.'}, room=client_id)
-
-                        execution_completed = True # Mark as completed after processing output / 处理完输出后标记为已完成
-                        log.info(f"[{prompt_id}] Task marked completed. Breaking listener loop.")
-                        break # Task finished, break loop / 任务完成，中断循环
+                    if executed_node_id == job['output_node_id'] and not job['completed']:
+                        # ComfyUI reports the node's UI output as 'output', also when it replays a cached node
+                        # ComfyUI 以 'output' 上报节点的 UI 输出，复用缓存节点时也是如此
+                        node_output = msg_data.get('output') or {}
+                        if 'images' not in node_output and job['prompt_id'] not in pushed_output_images:
+                            listener_log.info(f"[{prompt_id}] NodeBridge_Output ({executed_node_id}) reported no images; reading /history when the prompt ends.")
+                            continue
+                        listener_log.info(f"[{prompt_id}] Detected NodeBridge_Output execution ({executed_node_id}). Processing results.")
+                        deliver_output_images(client_id, job, node_output, profile_name, profile_settings, batch_id)
+                        finish_job(job) # Mark as completed after processing output / 处理完输出后标记为已完成
+                        listener_log.info(f"[{prompt_id}] Task marked completed.")
+
+                elif msg_type == 'execution_error':
+                    if job and not job['completed']:
+                        error_text = msg_data.get('exception_message', 'Unknown execution error')
+                        listener_log.error(f"[{prompt_id}] ComfyUI execution error in node {msg_data.get('node_id')}: {error_text}")
+                        emit_job_error(client_id, job, f"ComfyUI execution error: {error_text}", batch_id)
+                        finish_job(job)
 
                 elif msg_type == 'progress':
                     progress = msg_data.get('value', 0)
                     total = msg_data.get('max', 0)
                     percent = int((progress / total) * 100) if total > 0 else 0
-                    # Optional: Add node title to progress if needed / 可选：如果需要，将节点标题添加到进度中
-                    # log.debug(f"[{prompt_id}] Progress: {progress}/{total} ({percent}%)")
-                    socketio.emit('progress_update', {'progress': progress, 'total': total, 'percent': percent}, room=client_id)
+                    listener_log.debug(f"[{prompt_id}] Progress: {progress}/{total} ({percent}%)", extra={'sample_key': 'progress'})
+                    progress_payload = {'progress': progress, 'total': total, 'percent': percent}
+                    if batch_id and job:
+                        progress_payload.update({'batch_id': batch_id, 'index': job['index']})
+                    emit_to_client(client_id, 'progress_update', progress_payload)
 
             except json.JSONDecodeError:
-                 log.warning(f"[{prompt_id}] ComfyUI Main WS received non-JSON message: {message_str}")
+                 listener_log.warning(f"[{listener_id}] ComfyUI Main WS received non-JSON message: {message_str}")
             except Exception as e:
-                 log.error(f"[{prompt_id}] Error processing ComfyUI Main WS message: {e}", exc_info=True)
+                 listener_log.error(f"[{listener_id}] Error processing ComfyUI Main WS message: {e}", exc_info=True)
                  # Consider notifying client of processing error / 考虑通知客户端处理错误
-                 socketio.emit('render_error', {'message': f'Error processing ComfyUI message: {e}'}, room=client_id)
+                 emit_to_client(client_id, 'render_error', {'message': f'Error processing ComfyUI message: {e}'})
+
+        # --- Recovery: listener lost ComfyUI before the output node reported / 恢复：监听器在输出节点上报前与 ComfyUI 断开 ---
+        # All unfinished prompts share one deadline (their files arrive in parallel); a cancel ends the wait
+        # 所有未完成的任务共用一个截止时间（其文件并行到达）；取消会结束等待
+        recovery_deadline = time.monotonic() + OUTPUT_WATCHER_RECOVERY_TIMEOUT
+        for job in jobs:
+            if cancel_event.is_set(): break
+            if not job['completed']:
+                recover_from_output_directory(client_id, job, profile_name, profile_settings, batch_id, recovery_deadline, cancel_event)
+                finish_job(job)
+
+        if cancel_event.is_set():
+            listener_log.info(f"[{listener_id}] Listener cancelled.")
+            emit_to_client(client_id, 'render_cancelled', {'prompt_id': listener_id, 'batch_id': batch_id})
+            return
 
     except websocket.WebSocketException as e:
-        log.error(f"[{prompt_id}] ComfyUI Main WS Error: {e}", exc_info=True)
-        socketio.emit('render_error', {'message': f'ComfyUI Connection Error: {e}'}, room=client_id)
+        listener_log.error(f"[{listener_id}] ComfyUI Main WS Error: {e}", exc_info=True)
+        emit_to_client(client_id, 'render_error', {'message': f'ComfyUI Connection Error: {e}'})
     except ConnectionRefusedError:
-        log.error(f"[{prompt_id}] Connection to ComfyUI Main WS refused.")
-        socketio.emit('render_error', {'message': 'Connection to ComfyUI refused. Is ComfyUI running?'}, room=client_id)
+        listener_log.error(f"[{listener_id}] Connection to ComfyUI Main WS refused.")
+        emit_to_client(client_id, 'render_error', {'message': 'Connection to ComfyUI refused. Is ComfyUI running?'})
     except Exception as e:
-        log.error(f"[{prompt_id}] Unexpected error in ComfyUI listener thread: {e}", exc_info=True)
-        socketio.emit('render_error', {'message': f'An unexpected server error occurred: {e}'}, room=client_id)
+        listener_log.error(f"[{listener_id}] Unexpected error in ComfyUI listener thread: {e}", exc_info=True)
+        emit_to_client(client_id, 'render_error', {'message': f'An unexpected server error occurred: {e}'})
     finally:
+        if batch_id and not cancel_event.is_set():
+            # Also after a listener error, so the frontend's batch state always closes / 监听器出错时也发送，确保前端的批次状态总能结束
+            listener_log.info(f"[{batch_id}] Batch of {total_jobs} prompts finished.")
+            emit_to_client(client_id, 'batch_complete', {'batch_id': batch_id, 'total': total_jobs})
+        active_listeners.pop(listener_id, None); pending_cancels.discard(listener_id)
+        if executing_prompt['prompt_id'] in jobs_by_id: executing_prompt['prompt_id'] = None
         if ws and ws.connected:
             try:
                 ws.close()
-                log.info(f"[{prompt_id}] ComfyUI Main WS connection closed.")
+                listener_log.info(f"[{listener_id}] ComfyUI Main WS connection closed.")
             except Exception as e:
-                log.error(f"[{prompt_id}] Error closing ComfyUI Main WS: {e}")
-        # Clean up prompt mapping after listener finishes / 监听器完成后清理提示映射
-        owner_client = prompt_client_map.pop(prompt_id, None)
+                listener_log.error(f"[{listener_id}] Error closing ComfyUI Main WS: {e}")
+        # Clean up prompt mappings after listener finishes / 监听器完成后清理提示映射
+        owner_client = None
+        for job in jobs:
+            output_watcher.untrack(job['prompt_id'])
+            prompt_bridge_overrides.pop(job['prompt_id'], None)
+            pushed_output_images.pop(job['prompt_id'], None)
+            prompt_input_hashes.pop(job['prompt_id'], None)
+            owner_client = prompt_client_map.pop(job['prompt_id'], None) or owner_client
         if owner_client and owner_client in client_prompt_map:
-            # Verify it's the correct prompt before deleting / 在删除前验证它是否是正确的提示
-            if client_prompt_map[owner_client].get('prompt_id') == prompt_id:
+            # Verify it's the correct listener before deleting / 在删除前验证它是否是正确的监听器
+            if client_prompt_map[owner_client].get('prompt_id') == listener_id:
                  del client_prompt_map[owner_client]
-        log.info(f"[{prompt_id}] Cleaned up mappings.")
+        listener_log.info(f"[{listener_id}] Cleaned up mappings.")
         # Send a final idle status / 发送最终空闲状态
         if owner_client:
-             socketio.emit('status_update', {'status': "空闲 Idle"}, room=owner_client)
+             emit_to_client(owner_client, 'status_update', {'status': "空闲 Idle"})
+
+
+# --- Render Cancellation ---
+def fail_pending_node_requests(should_fail, error_message):
+    """Answers matching pending NodeBridge requests with an error so waiting nodes stop blocking."""
+    """以错误应答匹配的待处理 NodeBridge 请求，使等待中的节点不再阻塞。"""
+    for req_id, req_info in list(pending_node_requests.items()):
+        if should_fail(req_info) and pending_node_requests.pop(req_id, None):
+            log.warning(f"[Main] Failing pending request {req_id}: {error_message}")
+            socketio.emit('data_response_for_node', {'request_id': req_id, 'error': error_message},
+                          room=req_info['node_sid'], namespace=BRIDGE_NAMESPACE) # Ensure correct namespace / 确保正确的命名空间
+
+def cancel_render_for_client(client_id, reason="Render cancelled by user."):
+    """Stops a client's prompts in ComfyUI (dequeue or interrupt), answers waiting nodes and ends the listener."""
+    """停止客户端在 ComfyUI 中的任务（出队或中断），应答等待中的节点并结束监听器。"""
+    prompt_info = client_prompt_map.get(client_id)
+    if not prompt_info:
+        return None
+    listener_id = prompt_info.get('prompt_id')
+    prompt_ids = list(prompt_info.get('prompt_ids') or [listener_id])
+    log.warning(f"[{listener_id}] Cancelling {len(prompt_ids)} prompt(s) for client {client_id}: {reason}")
+    summary = {'listener_id': listener_id, 'deleted': [], 'interrupted': []}
+
+    # Free the GPU: drop queued prompts, interrupt the running one / 释放 GPU：删除排队任务，中断运行中的任务
+    try:
+        running, pending = fetch_queue_prompt_ids()
+        to_delete = [pid for pid in prompt_ids if pid in pending]
+        if to_delete:
+            comfyui_api_post("/queue", {'delete': to_delete})
+            summary['deleted'] = to_delete
+        for pid in prompt_ids:
+            if pid in running:
+                # Newer ComfyUI only interrupts the given prompt_id; older ones interrupt the current prompt, which is ours
+                # 新版 ComfyUI 只中断指定 prompt_id；旧版中断当前任务，此处当前任务正是我们的
+                comfyui_api_post("/interrupt", {'prompt_id': pid})
+                summary['interrupted'].append(pid)
+    except Exception as e:
+        log.error(f"[{listener_id}] Failed to cancel prompts in ComfyUI: {e}")
+        summary['error'] = str(e)
+
+    # Answer bridge nodes still waiting for this client's data / 应答仍在等待此客户端数据的桥接节点
+    fail_pending_node_requests(lambda req: req.get('prompt_id') in prompt_ids, reason)
+
+    # Tear down the listener; closing its socket unblocks ws.recv() / 结束监听器；关闭其套接字以解除 ws.recv() 阻塞
+    listener_info = active_listeners.get(listener_id)
+    if not listener_info:
+        pending_cancels.add(listener_id) # Not started yet; it cancels itself when it registers / 尚未启动；注册时自行取消
+    else:
+        listener_info['cancel_event'].set()
+        if listener_info.get('ws'):
+            try: listener_info['ws'].close()
+            except Exception: pass
+    return summary
 
 
 # --- Bridge Namespace for Node Communication ---
+def resolve_bridge_prompt(data, class_type):
+    """Finds the in-flight prompt a bridge request/push came from, by its node_id (the node's _node_id) and, if sent, its
+    input_key (_input_key). Returns (prompt_id, None) or (None, error message). When the same node matches several prompts
+    (e.g. two sessions running the same workflow), only the one ComfyUI reported as executing can own it, since ComfyUI runs
+    one prompt at a time; anything else is rejected rather than guessed."""
+    """按 node_id（节点的 _node_id）及可选的 input_key（_input_key）查找桥接请求/推送所属的进行中任务。
+    返回 (prompt_id, None) 或 (None, 错误信息)。同一节点匹配多个任务时（如两个会话运行同一工作流），由于 ComfyUI 一次只执行一个任务，
+    只有 ComfyUI 报告正在执行的任务才能认领；其余情况直接拒绝，不做猜测。"""
+    node_id = str(data.get('node_id')); input_key = data.get('input_key')
+    candidates = []
+    for listener_info in list(active_listeners.values()):
+        for job in listener_info.get('jobs') or []:
+            node_info = job['prompt'].get(node_id) or {}
+            if job['completed'] or node_info.get('class_type') != class_type: continue
+            if input_key is not None and node_info.get('inputs', {}).get('_input_key') != input_key: continue
+            candidates.append(job['prompt_id'])
+    if len(candidates) > 1 and executing_prompt['prompt_id'] in candidates:
+        candidates = [executing_prompt['prompt_id']]
+    if len(candidates) == 1: return candidates[0], None
+    if not candidates: return None, f"No prompt in flight has {class_type} node {node_id}."
+    return None, f"{class_type} node {node_id} matches {len(candidates)} prompts in flight; cannot tell which one is running."
+
 class BridgeNamespace(Namespace):
     """Handles WebSocket communication specifically for NodeBridge nodes."""
     """专门处理 NodeBridge 节点的 WebSocket 通信。"""
     def on_connect(self):
         # This SID belongs to the NodeBridge node's connection / 此 SID 属于 NodeBridge 节点的连接
-        log.info(f"[Bridge] Node connected: {request.sid}")
+        bridge_log.info(f"[Bridge] Node connected: {request.sid}")
 
     def on_disconnect(self):
-        log.warning(f"[Bridge] Node disconnected: {request.sid}")
+        bridge_log.warning(f"[Bridge] Node disconnected: {request.sid}")
         # Clean up any pending requests associated with this node's sid / 清理与此节点 sid 关联的任何待处理请求
         requests_to_remove = []
         for req_id, req_info in list(pending_node_requests.items()): # Iterate over a copy / 迭代副本
@@ -371,13 +1528,12 @@ class BridgeNamespace(Namespace):
                 requests_to_remove.append(req_id)
         for req_id in requests_to_remove:
              if req_id in pending_node_requests:
-                 log.warning(f"[Bridge] Cleaning up pending request {req_id} due to node disconnect.")
+                 bridge_log.warning(f"[Bridge] Cleaning up pending request {req_id} due to node disconnect.")
                  # Notify the frontend client that the node disconnected / 通知前端客户端节点已断开连接
                  client_id_to_notify = pending_node_requests[req_id].get('client_id')
                  if client_id_to_notify:
-                     socketio.emit('render_error',
-                                   {'message': '交互节点意外断开 (Bridge node disconnected unexpectedly)'},
-                                   room=client_id_to_notify)
+                     emit_to_client(client_id_to_notify, 'render_error',
+                                    {'message': '交互节点意外断开 (Bridge node disconnected unexpectedly)'})
                  del pending_node_requests[req_id]
 
     def on_request_data_from_node(self, data):
@@ -389,10 +1545,19 @@ class BridgeNamespace(Namespace):
         node_id = data.get('node_id')
         mode = data.get('mode')
 
-        log.info(f"[Bridge] <= Received data request from node {node_sid}: req={request_id}, p={prompt_id}, n={node_id}, m={mode}")
+        bridge_log.info(f"[Bridge] <= Received data request from node {node_sid}: req={request_id}, p={prompt_id}, n={node_id}, m={mode}")
+
+        # Nodes no longer get a per-run prompt id as an input; find the in-flight prompt holding this node
+        # 节点不再通过输入获得每次运行的任务 ID；在进行中的任务里查找包含此节点的任务
+        if request_id and node_id and prompt_id not in prompt_client_map:
+            prompt_id, error_msg = resolve_bridge_prompt(data, 'NodeBridge_Input')
+            if error_msg:
+                bridge_log.error(f"[Bridge] Cannot route request {request_id} from node {node_sid}: {error_msg}")
+                emit('data_response_for_node', {'request_id': request_id, 'error': error_msg}, room=node_sid)
+                return
 
         if not all([request_id, prompt_id, node_id, mode]):
-            log.error(f"[Bridge] Incomplete data request from node {node_sid}: {data}")
+            bridge_log.error(f"[Bridge] Incomplete data request from node {node_sid}: {data}")
             # Send error back to the node immediately / 立即将错误发送回节点
             emit('data_response_for_node', {'request_id': request_id, 'error': 'Incomplete request data received by backend.'}, room=node_sid)
             return
@@ -401,10 +1566,23 @@ class BridgeNamespace(Namespace):
         client_id = prompt_client_map.get(prompt_id)
 
         if not client_id:
-            log.error(f"[Bridge] Could not find frontend client for prompt_id {prompt_id} (request {request_id} from node {node_sid}).")
+            bridge_log.error(f"[Bridge] Could not find frontend client for prompt_id {prompt_id} (request {request_id} from node {node_sid}).")
             emit('data_response_for_node', {'request_id': request_id, 'error': 'Frontend client mapping not found by backend.'}, room=node_sid)
             return
 
+        # Batch variants answer their own values without asking the frontend / 批次变体直接应答自身的值，无需询问前端
+        overrides = prompt_bridge_overrides.get(prompt_id, {})
+        if mode in overrides:
+            bridge_log.info(f"[Bridge] => Answering request {request_id} (mode: {mode}) from batch variation.")
+            emit('data_response_for_node', {'request_id': request_id, 'data': overrides[mode], 'error': None}, room=node_sid)
+            return
+
+        # REST jobs have no frontend to ask / REST 任务没有可询问的前端
+        if client_id.startswith(API_JOB_CLIENT_PREFIX):
+            bridge_log.warning(f"[Bridge] REST job {client_id} supplied no '{mode}' value for request {request_id}.")
+            emit('data_response_for_node', {'request_id': request_id, 'error': f"No '{mode}' value was supplied with the job (bridge_inputs)."}, room=node_sid)
+            return
+
         # Store the pending request, associating it with the node's SID / 存储待处理请求，并将其与节点的 SID 关联
         pending_node_requests[request_id] = {
             'request_id': request_id,
@@ -415,19 +1593,48 @@ class BridgeNamespace(Namespace):
             'node_sid': node_sid, # Node connection SID / 节点连接 SID
             'timestamp': time.time()
         }
-        log.info(f"[Bridge] Stored pending request {request_id} for node {node_sid}")
+        bridge_log.info(f"[Bridge] Stored pending request {request_id} for node {node_sid}")
 
         # Relay the request to the specific frontend client via the main namespace / 通过主命名空间将请求转发给特定的前端客户端
-        log.info(f"[Bridge] => Relaying request {request_id} (mode: {mode}) to frontend client {client_id}")
+        bridge_log.info(f"[Bridge] => Relaying request {request_id} (mode: {mode}) to frontend client {client_id}")
         socketio.emit('request_data_for_frontend', {
             'prompt_id': prompt_id,
             'node_id': node_id,
             'mode': mode,
             'request_id': request_id
-        }, room=client_id) # Emit to the specific room/SID of the frontend client / 发送到前端客户端的特定房间/SID
+        }, room=client_id) # Emit to the frontend session's room; re-sent on reconnect while pending / 发送到前端会话的房间；待处理期间重连时会重新发送
 
         # Notify user via main status / 通过主状态通知用户
-        socketio.emit('status_update', {'status': f"等待前端提供数据 Waiting for frontend: {mode}"}, room=client_id)
+        emit_to_client(client_id, 'status_update', {'status': f"等待前端提供数据 Waiting for frontend: {mode}"})
+
+    def on_push_output_images(self, data):
+        """Receives result images pushed by NodeBridge_Output as binary attachments, before the node returns.
+        Payload: {'prompt_id'?, 'node_id', 'images': [{'mime': 'image/png', 'data': <bytes>}]}. The return value is the ack:
+        {'status': 'ok'} means the images will be relayed from memory; on {'status': 'error'} the node keeps relying on the saved
+        files, which the app then reads as before."""
+        """接收 NodeBridge_Output 在返回前以二进制附件推送的结果图像。
+        载荷：{'prompt_id'?, 'node_id', 'images': [{'mime': 'image/png', 'data': <bytes>}]}。返回值即确认：
+        {'status': 'ok'} 表示图像将从内存转发；{'status': 'error'} 时节点继续依赖已保存的文件，应用照旧读取这些文件。"""
+        node_sid = request.sid
+        data = data if isinstance(data, dict) else {}
+        prompt_id = data.get('prompt_id')
+        if prompt_id not in prompt_client_map:
+            prompt_id, error_msg = resolve_bridge_prompt(data, 'NodeBridge_Output') # See on_request_data_from_node / 见 on_request_data_from_node
+            if error_msg:
+                bridge_log.warning(f"[Bridge] Pushed images from node {node_sid} not routed ({error_msg}); node should fall back to files.")
+                return {'status': 'error', 'error': error_msg}
+        images = data.get('images')
+        if not isinstance(images, list) or not images or not all(
+                isinstance(image, dict) and image.get('mime') in BRIDGE_PUSH_MIME_TYPES and isinstance(image.get('data'), (bytes, bytearray)) for image in images):
+            bridge_log.error(f"[Bridge] Malformed image push from node {node_sid} for prompt {prompt_id}.")
+            return {'status': 'error', 'error': f"Expected images as [{{'mime': one of {', '.join(BRIDGE_PUSH_MIME_TYPES)}, 'data': bytes}}]."}
+        pushed_output_images[prompt_id] = {
+            'node_id': str(data.get('node_id')),
+            'images': [{'mime': image['mime'], 'data': bytes(image['data'])} for image in images],
+            'timestamp': time.time(),
+        }
+        bridge_log.info(f"[Bridge] <= Node {node_sid} pushed {len(images)} image(s) for prompt {prompt_id} ({sum(len(image['data']) for image in images)} bytes).")
+        return {'status': 'ok', 'accepted': len(images)}
 
 # Register the namespace / 注册命名空间
 socketio.on_namespace(BridgeNamespace(BRIDGE_NAMESPACE))
@@ -435,53 +1642,77 @@ socketio.on_namespace(BridgeNamespace(BRIDGE_NAMESPACE))
 
 # --- Main SocketIO Events (Frontend Communication) ---
 @socketio.on('connect')
-def handle_connect():
-    """Handles new frontend client connections."""
-    """处理新的前端客户端连接。"""
-    client_id = request.sid
-    log.info(f"Frontend client connected: {client_id}")
-    join_room(client_id) # Join a room identified by the client_id / 加入由 client_id 标识的房间
-    log.info(f"Frontend client {client_id} joined room {client_id}")
-    # Send initial idle status / 发送初始空闲状态
-    emit('status_update', {'status': "空闲 Idle"})
+def handle_connect(auth=None):
+    """Handles new frontend client connections; a known session token reattaches the socket to its session."""
+    """处理新的前端客户端连接；已知的会话令牌会将套接字重新接入其会话。"""
+    sid = request.sid
+    token = (auth or {}).get('session') if isinstance(auth, dict) else None
+    if not isinstance(token, str) or not token or len(token) > SESSION_TOKEN_MAX_LENGTH or token.startswith(API_JOB_CLIENT_PREFIX):
+        token = str(uuid.uuid4()) # Reserved prefixes belong to REST jobs / 保留前缀属于 REST 任务
+    session = client_sessions.get(token)
+    resumed = session is not None
+    if not resumed:
+        session = client_sessions[token] = {'sids': set(), 'generation': 0, 'disconnected_at': None, 'replay': [], 'replay_bytes': 0}
+    session['sids'].add(sid); session['generation'] += 1; session['disconnected_at'] = None
+    sid_sessions[sid] = token
+    join_room(token) # Join the session's room; all client events go there / 加入会话房间；所有客户端事件都发往此处
+    log.info(f"Frontend client {sid} {'resumed' if resumed else 'started'} session {token}")
+
+    prompt_info = client_prompt_map.get(token)
+    active_render = {'prompt_id': prompt_info['prompt_id'], 'prompt_ids': prompt_info.get('prompt_ids')} if prompt_info else None
+    emit('session', {'session': token, 'resumed': resumed, 'active_render': active_render})
+    if resumed:
+        # Replay what this session may have missed, then re-ask for data the nodes are still waiting for
+        # 重放此会话可能错过的事件，然后重新请求节点仍在等待的数据
+        replay = list(session['replay'])
+        for event, payload, _ in replay:
+            emit(event, payload)
+        reset_session_replay(token) # Delivered once; later reconnects only get what they missed since / 只投递一次；之后的重连只获得此后错过的事件
+        for req_info in list(pending_node_requests.values()):
+            if req_info['client_id'] == token:
+                emit('request_data_for_frontend', {key: req_info[key] for key in ('prompt_id', 'node_id', 'mode', 'request_id')})
+        log.info(f"Replayed {len(replay)} event(s) to session {token}")
+    if not active_render:
+        # Send initial idle status / 发送初始空闲状态
+        emit('status_update', {'status': "空闲 Idle"})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    """Handles frontend client disconnections."""
-    """处理前端客户端断开连接。"""
-    client_id = request.sid
-    log.warning(f"Frontend client disconnected: {client_id}")
+    """Handles frontend client disconnections. The session (and its render) is kept for SESSION_GRACE_SECONDS."""
+    """处理前端客户端断开连接。会话（及其渲染）会保留 SESSION_GRACE_SECONDS。"""
+    sid = request.sid
+    token = sid_sessions.pop(sid, None)
+    log.warning(f"Frontend client disconnected: {sid} (session {token})")
+    session = client_sessions.get(token)
+    if session is None: return
+    leave_room(token) # Leave the session's room / 离开会话房间
+    session['sids'].discard(sid)
+    if session['sids']: return # Another tab of the same session is still connected / 同一会话的其他标签页仍在连接
+    session['disconnected_at'] = time.time()
+    if SESSION_GRACE_SECONDS <= 0:
+        release_client_session(token, 'Frontend client disconnected.')
+    else:
+        log.info(f"Session {token} keeps its render for {SESSION_GRACE_SECONDS}s awaiting reconnect.")
+        socketio.start_background_task(expire_client_session, token, session['generation'])
 
-    # Clean up prompt mappings / 清理提示映射
-    prompt_info = client_prompt_map.pop(client_id, None)
-    if prompt_info:
-        prompt_id = prompt_info.get('prompt_id')
-        if prompt_id and prompt_client_map.get(prompt_id) == client_id:
-            del prompt_client_map[prompt_id]
-            log.info(f"Cleaned up prompt mapping for disconnected client {client_id}, prompt {prompt_id}")
 
-    # Clean up pending requests initiated FOR this client / 清理为此客户端启动的待处理请求
-    reqs_to_remove = [req_id for req_id, req in list(pending_node_requests.items()) if req['client_id'] == client_id]
-    for req_id in reqs_to_remove:
-        if req_id in pending_node_requests:
-            log.warning(f"[Main] Cleaning pending request {req_id} due to frontend disconnect.")
-            node_sid = pending_node_requests[req_id]['node_sid']
-            # Send error response back to the waiting node via Bridge namespace / 通过桥接命名空间将错误响应发送回等待中的节点
-            socketio.emit('data_response_for_node', {
-                 'request_id': req_id,
-                 'error': 'Frontend client disconnected before providing data.'
-                 }, room=node_sid, namespace=BRIDGE_NAMESPACE) # Ensure correct namespace / 确保正确的命名空间
-            del pending_node_requests[req_id]
-
-    leave_room(client_id) # Leave the client's room / 离开客户端的房间
-    log.info(f"Frontend client {client_id} left room {client_id}")
+@socketio.on('cancel_render')
+def handle_cancel_render(data=None):
+    """Cancels the sender's running render or batch."""
+    """取消发送者正在进行的渲染或批量任务。"""
+    client_id = session_for_sid(request.sid)
+    summary = cancel_render_for_client(client_id)
+    if summary is None:
+        emit('status_update', {'status': "没有进行中的渲染 No active render"})
+        return
+    emit('status_update', {'status': "正在取消 Cancelling..."})
 
 
 @socketio.on('provide_data_from_frontend')
 def handle_provide_data(data):
     """Receives data from frontend and relays it back to the waiting NodeBridge node."""
     """接收来自前端的数据并将其转发回等待中的 NodeBridge 节点。"""
-    client_id = request.sid # SID of the sending frontend client / 发送前端客户端的 SID
+    client_id = session_for_sid(request.sid) # Session of the sending frontend client / 发送方前端客户端的会话
     request_id = data.get('request_id')
     provided_data = data.get('data') # Can be string, number, or base64 string / 可以是字符串、数字或 base64 字符串
     error_msg = data.get('error') # Frontend might send back an error / 前端可能会发回错误
@@ -509,6 +1740,8 @@ def handle_provide_data(data):
             }
             # Send the response back to the specific node via the bridge namespace / 通过桥接命名空间将响应发送回特定节点
             socketio.emit('data_response_for_node', response_payload, room=node_sid, namespace=BRIDGE_NAMESPACE)
+            if not error_msg and req_info.get('prompt_id') in prompt_client_map:
+                prompt_input_hashes.setdefault(req_info['prompt_id'], {})[mode] = value_digest(provided_data)
 
             # Remove the pending request entry after relaying / 转发后删除待处理请求条目
             if request_id in pending_node_requests:
@@ -519,13 +1752,13 @@ def handle_provide_data(data):
 
              # Update frontend status / 更新前端状态
             status = "数据已发送 Data Sent" if not error_msg else f"前端错误 Frontend Error: {error_msg}"
-            socketio.emit('status_update', {'status': status}, room=client_id)
+            emit_to_client(client_id, 'status_update', {'status': status})
 
         else:
             log.error(f"[Main] Found pending request {request_id} but missing node SID.")
             if request_id in pending_node_requests: del pending_node_requests[request_id]
             # Notify frontend of the internal error / 通知前端内部错误
-            socketio.emit('render_error', {'message': f'Internal error: Could not find node connection for request {request_id}.'}, room=client_id)
+            emit_to_client(client_id, 'render_error', {'message': f'Internal error: Could not find node connection for request {request_id}.'})
 
     else:
         log.warning(f"[Main] Received data for unknown or already fulfilled request (req_id: {request_id}). Might be late response.")
@@ -590,6 +1823,24 @@ def get_workflows():
         log.error(f"Error listing workflows from {workflows_base_path}: {e}", exc_info=True)
         return jsonify({"error": f"An unexpected error occurred while listing workflows."}), 500
 
+@app.route('/api/encoder_profiles', methods=['GET'])
+def get_encoder_profiles():
+    """Lists the available output encoder profiles and the default one."""
+    """列出可用的输出编码配置及默认配置。"""
+    return jsonify({"profiles": ENCODER_PROFILES, "default": DEFAULT_ENCODER_PROFILE})
+
+@app.route('/api/object_info/refresh', methods=['POST'])
+def refresh_object_info():
+    """Refetches ComfyUI's node schemas (e.g. after installing models or custom nodes); workflows are re-checked on next use."""
+    """重新获取 ComfyUI 的节点结构（例如安装模型或自定义节点之后）；工作流在下次使用时重新检查。"""
+    reset_object_info()
+    try:
+        object_info, schema_version = get_object_info()
+    except requests.exceptions.RequestException as e:
+        log.error(f"Cannot refresh /object_info: {e}")
+        return jsonify({"success": False, "message": "无法连接 ComfyUI (ComfyUI is unreachable)."}), 502
+    return jsonify({"success": True, "node_types": len(object_info), "schema_version": schema_version})
+
 
 # API endpoint to trigger workflow execution / 触发工作流执行的 API 端点
 @app.route('/api/trigger_prompt', methods=['POST'])
@@ -605,6 +1856,9 @@ def trigger_prompt():
     if not client_id:
         log.error("Trigger request missing client ID in payload.")
         return jsonify({"success": False, "message": "缺少客户端 ID (Missing client ID)"}), 400
+    if client_id not in client_sessions:
+        log.error(f"Trigger request for unknown session {client_id}.")
+        return jsonify({"success": False, "message": "会话无效，请刷新 (Unknown session, please reconnect)."}), 400
     log.info(f"API Request: Trigger prompt for client {client_id}")
 
     # Check for concurrent execution by the same client / 检查同一客户端的并发执行
@@ -624,26 +1878,40 @@ def trigger_prompt():
         status_code = 404 if "not found" in error_msg else (400 if "Invalid" in error_msg else 500)
         return jsonify({"success": False, "message": error_msg}), status_code
 
+    # Encoder profile: explicit request value, else per-workflow default / 编码配置：请求中的显式值，否则使用工作流默认值
+    requested_profile = data.get('encoder_profile')
+    if requested_profile and requested_profile not in ENCODER_PROFILES:
+        log.error(f"Trigger request from {client_id} has unknown encoder profile '{requested_profile}'.")
+        return jsonify({"success": False, "message": f"未知的编码配置 (Unknown encoder profile): {requested_profile}"}), 400
+    encoder_profile, _ = resolve_encoder_profile(requested_profile, workflow_key)
+    bridge_inputs, error_msg = parse_bridge_inputs(data.get('bridge_inputs'))
+    if error_msg:
+        return jsonify({"success": False, "message": error_msg}), 400
+
     try:
         prompt_id = str(uuid.uuid4())
-        log.info(f"Assigned prompt ID {prompt_id} to client {client_id} for workflow '{workflow_key}'")
+        log.info(f"Assigned prompt ID {prompt_id} to client {client_id} for workflow '{workflow_key}' (encoder profile: {encoder_profile})")
 
         # Store mappings before starting thread / 在启动线程之前存储映射
-        client_prompt_map[client_id] = {'prompt_id': prompt_id, 'workflow_data': workflow_data}
+        client_prompt_map[client_id] = {'prompt_id': prompt_id, 'workflow_key': workflow_key, 'workflow_data': workflow_data, 'encoder_profile': encoder_profile}
         prompt_client_map[prompt_id] = client_id
+        if bridge_inputs:
+            prompt_bridge_overrides[prompt_id] = bridge_inputs # Bridge requests are answered without a frontend round trip / 桥接请求无需前端往返即可应答
 
         # Start ComfyUI listener thread / 启动 ComfyUI 监听器线程
         log.info(f"Starting ComfyUI listener thread for prompt {prompt_id}")
-        thread = threading.Thread(target=queue_comfyui_prompt, args=(workflow_data, client_id, prompt_id), daemon=True)
+        reset_session_replay(client_id) # Replay only covers the current render / 重放只覆盖当前渲染
+        thread = threading.Thread(target=queue_comfyui_prompt, args=(workflow_data, client_id, prompt_id, encoder_profile, bridge_inputs), daemon=True)
         thread.start()
 
         # Send immediate feedback to client / 向客户端发送即时反馈
-        socketio.emit('status_update', {'status': f"任务已提交 Queued: {prompt_id[:8]}..."}, room=client_id)
+        emit_to_client(client_id, 'status_update', {'status': f"任务已提交 Queued: {prompt_id[:8]}..."})
 
         return jsonify({
             "success": True,
             "message": "工作流已触发 (Workflow triggered successfully).",
             "prompt_id": prompt_id,
+            "encoder_profile": encoder_profile,
             })
 
     except Exception as e:
@@ -651,15 +1919,520 @@ def trigger_prompt():
         # Clean up potentially inconsistent state / 清理可能不一致的状态
         if client_id in client_prompt_map: del client_prompt_map[client_id]
         if 'prompt_id' in locals() and prompt_id in prompt_client_map: del prompt_client_map[prompt_id]
+        if 'prompt_id' in locals(): prompt_bridge_overrides.pop(prompt_id, None)
         return jsonify({"success": False, "message": f"触发工作流时发生意外服务器错误 (An unexpected server error occurred during trigger)."}), 500
 
 
+@app.route('/api/cancel_prompt', methods=['POST'])
+def cancel_prompt():
+    """Cancels the active render or batch of the given client."""
+    """取消指定客户端正在进行的渲染或批量任务。"""
+    data = request.get_json(silent=True) or {}
+    client_id = data.get('clientId')
+    if not client_id:
+        return jsonify({"success": False, "message": "缺少客户端 ID (Missing client ID)"}), 400
+    summary = cancel_render_for_client(client_id)
+    if summary is None:
+        return jsonify({"success": False, "message": "没有进行中的渲染 (No active render for this client)."}), 404
+    return jsonify({"success": True, "message": "已请求取消 (Cancellation requested).", **summary})
+
+
+# API endpoint to fan out one workflow into many variant prompts / 将一个工作流扩展为多个变体任务的 API 端点
+@app.route('/api/trigger_batch', methods=['POST'])
+def trigger_batch():
+    """Expands one workflow plus a list of variations into N prompts sharing one listener."""
+    """将一个工作流及变体列表展开为 N 个共享同一监听器的任务。"""
+    data = request.get_json()
+    if not data:
+        log.error("Batch request received no JSON data.")
+        return jsonify({"success": False, "message": "无效请求格式 (Invalid request format)."}), 400
+
+    client_id = data.get('clientId')
+    if not client_id:
+        log.error("Batch request missing client ID in payload.")
+        return jsonify({"success": False, "message": "缺少客户端 ID (Missing client ID)"}), 400
+    if client_id not in client_sessions:
+        return jsonify({"success": False, "message": "会话无效，请刷新 (Unknown session, please reconnect)."}), 400
+    if client_id in client_prompt_map:
+        log.warning(f"Client {client_id} attempted batch start while busy (active: {client_prompt_map[client_id]['prompt_id']}).")
+        return jsonify({"success": False, "message": "请等待上一个渲染完成 (Please wait for the previous render to complete)."}), 409
+
+    workflow_key = data.get('workflow_key')
+    if not workflow_key:
+        return jsonify({"success": False, "message": "缺少工作流密钥 (Workflow key is required)"}), 400
+    variations = data.get('variations')
+    if not isinstance(variations, list) or not variations or not all(isinstance(v, dict) for v in variations):
+        return jsonify({"success": False, "message": "变体必须是非空对象列表 (Variations must be a non-empty list of objects)."}), 400
+    if len(variations) > BATCH_MAX_VARIANTS:
+        return jsonify({"success": False, "message": f"变体数量超过上限 (Too many variations, max {BATCH_MAX_VARIANTS})."}), 400
+
+    requested_profile = data.get('encoder_profile')
+    if requested_profile and requested_profile not in ENCODER_PROFILES:
+        return jsonify({"success": False, "message": f"未知的编码配置 (Unknown encoder profile): {requested_profile}"}), 400
+    encoder_profile, _ = resolve_encoder_profile(requested_profile, workflow_key)
+    bridge_inputs, error_msg = parse_bridge_inputs(data.get('bridge_inputs'))
+    if error_msg:
+        return jsonify({"success": False, "message": error_msg}), 400
+
+    # Parse the workflow once for all variants / 所有变体只解析一次工作流
+    workflow_data, error_msg = load_workflow_safely(workflow_key)
+    if error_msg:
+        status_code = 404 if "not found" in error_msg else (400 if "Invalid" in error_msg else 500)
+        return jsonify({"success": False, "message": error_msg}), status_code
+
+    batch_id = f"batch-{uuid.uuid4()}"
+    try:
+        jobs = []
+        for index, variation in enumerate(variations):
+            prompt_id = str(uuid.uuid4())
+            # Variation fields win over the shared form values / 变体字段优先于共享的表单值
+            overrides = dict(bridge_inputs or {}, **bridge_overrides_from_variation(variation))
+            job = prepare_prompt_job(workflow_data, prompt_id, index=index, bridge_inputs=overrides)
+            apply_prompt_variation(job['prompt'], variation)
+            job['input_hashes']['prompt'] = value_digest(job['prompt']) # Hash what is actually queued / 对实际入队的任务图计算摘要
+            jobs.append((job, overrides))
+    except (TypeError, ValueError) as e:
+        log.error(f"Invalid batch variation from client {client_id}: {e}")
+        return jsonify({"success": False, "message": f"无效的变体参数 (Invalid variation): {e}"}), 400
+    # Registered only once every variant is valid / 所有变体均有效后才登记
+    for job, overrides in jobs:
+        if overrides: prompt_bridge_overrides[job['prompt_id']] = overrides
+    jobs = [job for job, _ in jobs]
+
+    prompt_ids = [job['prompt_id'] for job in jobs]
+    log.info(f"Batch {batch_id}: {len(jobs)} prompts for client {client_id}, workflow '{workflow_key}' (encoder profile: {encoder_profile})")
+    client_prompt_map[client_id] = {'prompt_id': batch_id, 'prompt_ids': prompt_ids, 'workflow_key': workflow_key, 'workflow_data': workflow_data,
+                                    'encoder_profile': encoder_profile}
+    for prompt_id in prompt_ids:
+        prompt_client_map[prompt_id] = client_id
+
+    # One listener (one upstream WS) for the whole batch / 整个批次共用一个监听器（一个上游 WS）
+    reset_session_replay(client_id) # Replay only covers the current render / 重放只覆盖当前渲染
+    thread = threading.Thread(target=queue_comfyui_prompts, args=(client_id, jobs, encoder_profile, batch_id), daemon=True)
+    thread.start()
+    emit_to_client(client_id, 'status_update', {'status': f"批量任务已提交 Batch queued: {len(jobs)}"})
+
+    return jsonify({
+        "success": True,
+        "message": "批量任务已触发 (Batch triggered successfully).",
+        "batch_id": batch_id,
+        "prompt_ids": prompt_ids,
+        "encoder_profile": encoder_profile,
+        })
+
+# --- Render History / 渲染历史 ---
+def open_render_history(history_dir):
+    """Opens the render index in history_dir; history is disabled (None) if it cannot be opened."""
+    """打开 history_dir 中的渲染索引；无法打开时禁用历史（返回 None）。"""
+    try:
+        os.makedirs(os.path.join(history_dir, 'thumbnails'), exist_ok=True)
+        index = render_history.RenderHistory(os.path.join(history_dir, HISTORY_DB_NAME))
+        log.info(f"Render history: {index.db_path}")
+        return index
+    except Exception as e:
+        log.error(f"Cannot open the render history in {history_dir}, history is disabled: {e}")
+        return None
+
+history_index = open_render_history(HISTORY_DIR)
+
+def open_result_image(source):
+    """Opens a result image from a file path, a Data URL or a pushed {'mime', 'data'} image. / 从文件路径、数据 URL 或推送图像打开结果图像。"""
+    if isinstance(source, dict):
+        data = source['data']
+        return Image.open(BytesIO(base64.b64decode(data) if isinstance(data, str) else data))
+    if source.startswith('data:'):
+        return Image.open(BytesIO(base64.b64decode(source.partition(',')[2])))
+    return Image.open(source)
+
+def save_history_thumbnail(prompt_id, source):
+    """Writes a JPEG thumbnail of a result image; returns its file name in HISTORY_DIR/thumbnails."""
+    """写出结果图像的 JPEG 缩略图；返回其在 HISTORY_DIR/thumbnails 中的文件名。"""
+    thumbnail_name = f"{prompt_id}.jpg"
+    with open_result_image(source) as img:
+        img.draft('RGB', (HISTORY_THUMBNAIL_SIZE, HISTORY_THUMBNAIL_SIZE)) # JPEG decodes at reduced scale / JPEG 以缩小比例解码
+        thumbnail = img.convert('RGB')
+    thumbnail.thumbnail((HISTORY_THUMBNAIL_SIZE, HISTORY_THUMBNAIL_SIZE))
+    thumbnail.save(os.path.join(HISTORY_DIR, 'thumbnails', thumbnail_name), format='JPEG', quality=HISTORY_THUMBNAIL_QUALITY)
+    return thumbnail_name
+
+def read_history_outputs(prompt_id, sources):
+    """Threadpool worker: measures the result images and writes the thumbnail. Returns (outputs, thumbnail_name, problems);
+    problems are logged by the caller (see run_in_threadpool)."""
+    """线程池工作函数：读取结果图像尺寸并写出缩略图。返回 (outputs, thumbnail_name, problems)；problems 由调用方记录（见 run_in_threadpool）。"""
+    outputs = []; problems = []; thumbnail_name = None
+    for source in sources:
+        output = {'path': source if isinstance(source, str) else None, 'width': None, 'height': None}
+        try:
+            with open_result_image(source) as img: output['width'], output['height'] = img.size # Header only / 只读取文件头
+        except Exception as e:
+            problems.append(f"Cannot read result image size: {e}")
+        outputs.append(output)
+    if sources:
+        try: thumbnail_name = save_history_thumbnail(prompt_id, sources[0])
+        except Exception as e: problems.append(f"Could not write history thumbnail: {e}")
+    return outputs, thumbnail_name, problems
+
+def record_render_history(client_id, job, images, profile_name, batch_id=None, transport='file', files=()):
+    """Collects a completed prompt's history entry; image sizes and the thumbnail are written in a background task."""
+    """收集已完成任务的历史条目；图像尺寸和缩略图在后台任务中写出。"""
+    if history_index is None: return
+    prompt_info = client_prompt_map.get(client_id) or {}
+    entry = {
+        'prompt_id': job['prompt_id'], 'client_id': client_id, 'batch_id': batch_id, 'workflow_key': prompt_info.get('workflow_key'),
+        'encoder_profile': profile_name, 'input_hashes': dict(job['input_hashes'], **prompt_input_hashes.get(job['prompt_id'], {})),
+        'image_count': len(images), 'cached_nodes': job['cached_nodes'], 'total_nodes': len(job['prompt']), 'transport': transport,
+        'queued_at': job['queued_at'], 'started_at': job['started_at'], 'finished_at': time.time(),
+    }
+    # Pushed images never touch the disk; their sizes come from the images themselves / 推送的图像不落盘，尺寸取自图像本身
+    sources = list(files) if files else [image for image in images if isinstance(image, dict)]
+    socketio.start_background_task(write_render_history, entry, sources)
+
+def write_render_history(entry, sources):
+    """Background task: measures the result images and writes the thumbnail in the threadpool, then stores the entry."""
+    """后台任务：在线程池中读取结果图像尺寸并写出缩略图，然后保存条目。"""
+    entry['outputs'], entry['thumbnail'], problems = run_in_threadpool(read_history_outputs, entry['prompt_id'], sources)
+    for problem in problems: log.warning(f"[{entry['prompt_id']}] {problem}")
+    try: history_index.record(entry)
+    except Exception as e: log.error(f"[{entry['prompt_id']}] Could not record render history: {e}")
+
+def serialize_history_entry(entry):
+    """Adds thumbnail and image URLs to a history entry. / 为历史条目添加缩略图和图像 URL。"""
+    prompt_id = entry['prompt_id']
+    entry['thumbnail_url'] = f"/api/history/{prompt_id}/thumbnail" if entry.get('thumbnail') else None
+    for index, output in enumerate(entry['outputs'] or []):
+        output['url'] = f"/api/history/{prompt_id}/images/{index}" if output.get('path') else None
+    return entry
+
+@app.route('/api/history', methods=['GET'])
+def list_render_history():
+    """Gallery page of completed renders, newest first. Filters: workflow_key, client_id, batch_id, since/until (epoch seconds).
+    Pass next_cursor back as ?cursor= for the next page; limit is at most render_history.MAX_PAGE_SIZE."""
+    """已完成渲染的画廊分页，最新的在前。过滤：workflow_key、client_id、batch_id、since/until（Unix 秒）。
+    将 next_cursor 作为 ?cursor= 传回以获取下一页；limit 最大为 render_history.MAX_PAGE_SIZE。"""
+    if history_index is None:
+        return jsonify({"success": False, "message": "渲染历史不可用 (Render history is disabled)."}), 503
+    filters = {name: request.args.get(name) for name in ('workflow_key', 'client_id', 'batch_id')}
+    filters.update({name: request.args.get(name, type=float) for name in ('since', 'until')})
+    try:
+        entries, next_cursor = history_index.page(filters, request.args.get('cursor'), request.args.get('limit', 50, type=int))
+    except render_history.HistoryCursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"entries": [serialize_history_entry(entry) for entry in entries], "next_cursor": next_cursor})
+
+def history_entry_or_404(prompt_id):
+    entry = history_index.get(prompt_id) if history_index else None
+    if entry is None:
+        return None, (jsonify({"success": False, "message": "历史记录不存在 (Unknown history entry)."}), 404)
+    return entry, None
+
+@app.route('/api/history/<prompt_id>', methods=['GET'])
+def get_render_history(prompt_id):
+    """Returns one history entry. / 返回单条历史记录。"""
+    entry, error_response = history_entry_or_404(prompt_id)
+    return error_response or jsonify(serialize_history_entry(entry))
+
+@app.route('/api/history/<prompt_id>/thumbnail', methods=['GET'])
+def get_render_history_thumbnail(prompt_id):
+    """Serves the JPEG thumbnail of a history entry. / 提供历史记录的 JPEG 缩略图。"""
+    entry, error_response = history_entry_or_404(prompt_id)
+    if error_response: return error_response
+    if not entry['thumbnail']:
+        return jsonify({"success": False, "message": "没有缩略图 (No thumbnail)."}), 404
+    return send_from_directory(os.path.join(HISTORY_DIR, 'thumbnails'), entry['thumbnail'], mimetype='image/jpeg')
+
+@app.route('/api/history/<prompt_id>/images/<int:index>', methods=['GET'])
+def get_render_history_image(prompt_id, index):
+    """Serves a result file of a history entry, if it is still in a ComfyUI directory. / 提供历史记录的结果文件（若仍在 ComfyUI 目录中）。"""
+    entry, error_response = history_entry_or_404(prompt_id)
+    if error_response: return error_response
+    outputs = entry['outputs'] or []
+    path = outputs[index].get('path') if 0 <= index < len(outputs) else None
+    roots = [os.path.abspath(root) for root in (COMFYUI_OUTPUT_PATH, COMFYUI_TEMP_PATH, COMFYUI_INPUT_PATH)]
+    if not path or not any(os.path.abspath(path).startswith(root + os.sep) for root in roots) or not os.path.isfile(path):
+        return jsonify({"success": False, "message": "图像不存在 (Image is not available)."}), 404
+    return send_from_directory(os.path.dirname(path), os.path.basename(path))
+
+@app.route('/api/history/<prompt_id>/pin', methods=['POST', 'DELETE'])
+def pin_render_history(prompt_id):
+    """Pins (POST) or unpins (DELETE) a history entry; the result files of pinned entries are kept by retention sweeps."""
+    """置顶（POST）或取消置顶（DELETE）历史记录；置顶条目的结果文件不会被保留策略清理。"""
+    pinned = request.method == 'POST'
+    if history_index is None or not history_index.set_pinned(prompt_id, pinned):
+        return jsonify({"success": False, "message": "历史记录不存在 (Unknown history entry)."}), 404
+    return jsonify({"success": True, "prompt_id": prompt_id, "pinned": pinned})
+
+# --- Directory Retention / 目录保留策略 ---
+def retention_roots():
+    return {'output': COMFYUI_OUTPUT_PATH, 'input': COMFYUI_INPUT_PATH, 'temp': COMFYUI_TEMP_PATH}
+
+def prompt_file_references(prompt, roots):
+    """Returns the paths of the files an API-format prompt's string inputs name. / 返回 API 格式任务图中字符串输入所引用文件的路径。"""
+    paths = set()
+    for node_info in prompt.values():
+        for input_name, value in (node_info.get('inputs') or {}).items():
+            if not isinstance(value, str) or not value or '\n' in value: continue
+            directory = 'input'
+            for annotation, annotated_directory in RETENTION_ANNOTATIONS.items():
+                if value.endswith(annotation): value, directory = value[:-len(annotation)], annotated_directory
+            root = os.path.abspath(roots[directory]); path = os.path.abspath(os.path.join(root, value))
+            if not path.startswith(root + os.sep): continue # Text that escapes the root is not a file reference / 越出根目录的文本不是文件引用
+            if input_name in RETENTION_FILE_INPUTS or os.path.isfile(path): paths.add(path)
+    return paths
+
+def retention_protected_paths():
+    """Files no sweep may delete: inputs referenced by in-flight prompts and by REST jobs still waiting for a slot,
+    the result files of in-flight prompts so far, and pinned history outputs."""
+    """任何清理都不得删除的文件：进行中任务及仍在等待槽位的 REST 任务所引用的输入、进行中任务已产生的结果文件，以及置顶历史记录的输出。"""
+    roots = retention_roots(); protected = set()
+    for listener_info in list(active_listeners.values()):
+        for job in listener_info.get('jobs') or []:
+            protected.update(output_watcher.files_for(job['prompt_id']))
+            protected.update(prompt_file_references(job['prompt'], roots))
+    for job in list(api_jobs.values()):
+        if job['status'] not in API_JOB_TERMINAL_STATES and job.get('prompt'):
+            protected.update(prompt_file_references(job['prompt'], roots))
+    if history_index is not None: protected.update(history_index.pinned_paths())
+    return {os.path.normcase(os.path.abspath(path)) for path in protected}
+
+def run_retention_sweep():
+    """Sweeps every directory with a quota and records what was reclaimed. / 清理每个设有配额的目录并记录回收量。"""
+    roots = retention_roots()
+    protected = retention_protected_paths()
+    is_protected = lambda path: os.path.normcase(os.path.abspath(path)) in protected
+    retention_state['running'] = True
+    try:
+        for name, quota in RETENTION_QUOTAS.items():
+            if not (quota['max_bytes'] or quota['max_age']) or not roots.get(name): continue
+            index = retention_indexes.get(name)
+            if index is None or index.root != roots[name]:
+                index = retention_indexes[name] = retention.DirectoryIndex(roots[name])
+            started = time.monotonic()
+            # Walking and stat'ing the directory would block the hub / 遍历目录并 stat 会阻塞 hub
+            stats = run_in_threadpool(retention.sweep, index, quota['max_bytes'], quota['max_age'], RETENTION_MIN_AGE, is_protected)
+            stats['seconds'] = round(time.monotonic() - started, 3)
+            retention_state['directories'][name] = stats
+            log_level = logging.INFO if stats['deleted'] or stats['errors'] else logging.DEBUG
+            log.log(log_level, f"[Retention] {name}: deleted {stats['deleted']} file(s), reclaimed {stats['reclaimed_bytes'] / 1024 ** 2:.1f} MB; "
+                               f"{stats['files']} file(s) / {stats['bytes'] / 1024 ** 3:.2f} GB left, {stats['protected']} protected, {stats['errors']} error(s).")
+    finally:
+        retention_state.update(running=False, last_sweep_at=time.time())
+
+def retention_loop():
+    """Background thread: sweeps every RETENTION_INTERVAL seconds, or at once when retention_wakeup is set."""
+    """后台线程：每 RETENTION_INTERVAL 秒清理一次，retention_wakeup 被设置时立即清理。"""
+    while True:
+        retention_wakeup.wait(RETENTION_INTERVAL)
+        retention_wakeup.clear()
+        try: run_retention_sweep()
+        except Exception as e: log.error(f"[Retention] Sweep failed: {e}", exc_info=True)
+
+@app.route('/api/retention', methods=['GET'])
+def get_retention_status():
+    """Reports the quotas and the result of the last sweep per directory. / 报告各目录的配额和最近一次清理结果。"""
+    return jsonify({"quotas": RETENTION_QUOTAS, "interval": RETENTION_INTERVAL, "min_age": RETENTION_MIN_AGE, **retention_state})
+
+@app.route('/api/retention/sweep', methods=['POST'])
+def request_retention_sweep():
+    """Starts a sweep now instead of waiting for the interval. / 立即开始清理，而不是等待下一个间隔。"""
+    retention_wakeup.set()
+    return jsonify({"success": True, "message": "已请求清理 (Sweep requested)."}), 202
+
+# --- REST Job API / REST 任务 API ---
+def update_api_job(job, event, payload):
+    """Folds a client event of a REST job's render into its record. / 将 REST 任务渲染的客户端事件合并到其任务记录中。"""
+    job['updated_at'] = time.time()
+    if event == 'progress_update':
+        job['status'] = 'running'
+        job['progress'] = {key: payload.get(key) for key in ('progress', 'total', 'percent')}
+    elif event == 'status_update' and job['status'] == 'queued' and executing_prompt['prompt_id'] == job['prompt_id']:
+        job['status'] = 'running'
+    elif event == 'render_result':
+        # Keep paths, not encoded copies, of results on disk / 对磁盘上的结果只保留路径，不保留编码后的副本
+        job['images'] = [{'path': path} for path in payload['files']] if payload.get('files') else list(payload.get('images') or [])
+        job['cached_nodes'] = payload.get('cached_nodes'); job['total_nodes'] = payload.get('total_nodes')
+        finish_api_job(job, 'completed')
+    elif event == 'render_error':
+        finish_api_job(job, 'failed', payload.get('message'))
+    elif event == 'render_cancelled':
+        finish_api_job(job, 'cancelled')
+
+def finish_api_job(job, status, error=None):
+    """Moves a REST job to a terminal state, wakes long-polls and fires its webhook (once)."""
+    """将 REST 任务置为结束状态，唤醒长轮询并触发其回调（仅一次）。"""
+    if job['status'] in API_JOB_TERMINAL_STATES: return
+    job.update(status=status, error=error, finished_at=time.time())
+    job.pop('prompt', None) # Only needed until it ran / 只在运行前需要
+    job['done'].set()
+    log.info(f"[Jobs] Job {job['job_id']} {status}" + (f": {error}" if error else ""))
+    if job.get('webhook_url'): socketio.start_background_task(post_api_job_webhook, job)
+    # Forget the oldest finished jobs beyond API_JOB_HISTORY, or while their in-memory images exceed API_JOB_MAX_IMAGE_BYTES
+    # 遗忘超出 API_JOB_HISTORY 的最旧已结束任务，或在其内存中图像超过 API_JOB_MAX_IMAGE_BYTES 时持续遗忘
+    finished = [job_id for job_id, other in api_jobs.items() if other['status'] in API_JOB_TERMINAL_STATES]
+    image_bytes = sum(api_job_image_bytes(api_jobs[job_id]) for job_id in finished)
+    for index, job_id in enumerate(finished):
+        if len(finished) - index <= API_JOB_HISTORY and image_bytes <= API_JOB_MAX_IMAGE_BYTES: break
+        image_bytes -= api_job_image_bytes(api_jobs.pop(job_id))
+
+def api_job_image_bytes(job):
+    """Bytes of a job's result images held in memory (file results only hold a path). / 任务在内存中持有的结果图像字节数（文件结果只持有路径）。"""
+    return sum(len(image) if isinstance(image, str) else len(image.get('data') or b'') for image in job['images'])
+
+def serialize_api_job(job):
+    """Returns the public JSON view of a REST job. / 返回 REST 任务的公开 JSON 视图。"""
+    view = {key: job.get(key) for key in ('job_id', 'status', 'workflow_key', 'prompt_id', 'created_at', 'started_at', 'finished_at',
+                                          'progress', 'cached_nodes', 'total_nodes', 'error')}
+    view['images'] = [{'url': f"/api/jobs/{job['job_id']}/images/{index}", 'mime': api_job_image_mime(image)} for index, image in enumerate(job['images'])]
+    return view
+
+def api_job_image_mime(image):
+    if isinstance(image, str): return image.partition(',')[0][len('data:'):].split(';')[0] or 'application/octet-stream'
+    if 'path' in image: return mimetypes.guess_type(image['path'])[0] or 'application/octet-stream'
+    return image['mime']
+
+def api_job_image(job, index):
+    """Returns (mime_type, bytes) of a result image: result files are read from disk, Data URLs are decoded here, pushed images
+    are returned as-is. Raises OSError if the file is gone (e.g. removed by retention)."""
+    """返回结果图像的 (mime_type, bytes)：结果文件从磁盘读取，数据 URL 在此解码，推送的图像原样返回。
+    文件已不存在（如被保留策略清理）时抛出 OSError。"""
+    image = job['images'][index]
+    if isinstance(image, str): return api_job_image_mime(image), base64.b64decode(image.partition(',')[2])
+    if 'path' in image:
+        with open(image['path'], 'rb') as f: return api_job_image_mime(image), f.read()
+    return image['mime'], image['data']
+
+def post_api_job_webhook(job):
+    """POSTs the finished job to its webhook URL. / 将已结束的任务 POST 到其回调 URL。"""
+    try:
+        response = requests.post(job['webhook_url'], json=serialize_api_job(job), timeout=API_WEBHOOK_TIMEOUT)
+        log.info(f"[Jobs] Webhook for job {job['job_id']} answered {response.status_code}.")
+    except requests.exceptions.RequestException as e:
+        log.warning(f"[Jobs] Webhook for job {job['job_id']} failed: {e}")
+
+def run_api_job(job, encoder_profile, bridge_inputs):
+    """Waits for a free slot (at most API_JOB_MAX_ACTIVE jobs are handed to ComfyUI at once), then runs the job's render."""
+    """等待空闲槽位（同时最多 API_JOB_MAX_ACTIVE 个任务交给 ComfyUI），然后执行任务的渲染。"""
+    with api_job_slots:
+        while api_job_slots_active['count'] >= API_JOB_MAX_ACTIVE and not job['cancel_requested']:
+            api_job_slots.wait(timeout=1.0) # Also re-reads a hot-reloaded limit / 同时读取热重载后的上限
+        api_job_slots_active['count'] += 1
+    try:
+        if job['cancel_requested']:
+            finish_api_job(job, 'cancelled'); return
+        job.update(status='queued', started_at=time.time())
+        if job['cancel_requested']: # Cancelled while it was still pending / 仍在等待时被取消
+            finish_api_job(job, 'cancelled'); return
+        queue_comfyui_prompt(job['prompt'], job['client_id'], job['prompt_id'], encoder_profile, bridge_inputs)
+    finally:
+        with api_job_slots:
+            api_job_slots_active['count'] -= 1
+            api_job_slots.notify()
+        client_prompt_map.pop(job['client_id'], None); prompt_client_map.pop(job['prompt_id'], None)
+        prompt_bridge_overrides.pop(job['prompt_id'], None); pending_cancels.discard(job['prompt_id'])
+        finish_api_job(job, 'failed', 'Render ended without a result.') # No-op if it already finished / 若已结束则无操作
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_api_job():
+    """Submits a workflow as a REST job. Body: {workflow_key, bridge_inputs?, seed?, inputs?: {node_id: {input: value}},
+    encoder_profile?, webhook_url?}. Returns 202 with the job id; poll GET /api/jobs/<job_id>."""
+    """以 REST 任务提交工作流。请求体：{workflow_key, bridge_inputs?, seed?, inputs?: {node_id: {input: value}},
+    encoder_profile?, webhook_url?}。返回 202 及任务 ID；通过 GET /api/jobs/<job_id> 轮询。"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "无效请求格式 (Invalid request format)."}), 400
+    workflow_key = data.get('workflow_key')
+    workflow_data, error_msg = load_workflow_safely(workflow_key)
+    if error_msg:
+        status_code = 404 if "not found" in error_msg else (400 if "Invalid" in error_msg else 500)
+        return jsonify({"success": False, "message": error_msg}), status_code
+    requested_profile = data.get('encoder_profile')
+    if requested_profile and requested_profile not in ENCODER_PROFILES:
+        return jsonify({"success": False, "message": f"未知的编码配置 (Unknown encoder profile): {requested_profile}"}), 400
+    encoder_profile, _ = resolve_encoder_profile(requested_profile, workflow_key)
+    bridge_inputs, error_msg = parse_bridge_inputs(data.get('bridge_inputs'))
+    if error_msg:
+        return jsonify({"success": False, "message": error_msg}), 400
+    webhook_url = data.get('webhook_url')
+    if webhook_url:
+        parsed_url = requests.utils.urlparse(webhook_url)
+        if parsed_url.scheme not in ('http', 'https') or parsed_url.hostname not in API_WEBHOOK_HOSTS:
+            return jsonify({"success": False, "message": f"回调地址不被允许 (webhook_url must be http(s) on: {', '.join(API_WEBHOOK_HOSTS)})."}), 400
+    try:
+        prompt = copy.deepcopy(workflow_data)
+        apply_prompt_variation(prompt, {'seed': data.get('seed'), 'inputs': data.get('inputs')})
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "message": f"无效的输入参数 (Invalid inputs): {e}"}), 400
+
+    job_id = uuid.uuid4().hex
+    job = {'job_id': job_id, 'client_id': f"{API_JOB_CLIENT_PREFIX}{job_id}", 'prompt_id': str(uuid.uuid4()), 'workflow_key': workflow_key,
+           'status': 'pending', 'created_at': time.time(), 'started_at': None, 'finished_at': None, 'updated_at': time.time(),
+           'progress': None, 'cached_nodes': None, 'total_nodes': None, 'error': None, 'images': [], 'webhook_url': webhook_url,
+           'cancel_requested': False, 'done': threading.Event(),
+           'prompt': prompt} # Varied prompt, kept until it ran so retention protects its inputs / 变体后的任务图，运行前保留以便保留策略保护其输入
+    api_jobs[job_id] = job
+    client_prompt_map[job['client_id']] = {'prompt_id': job['prompt_id'], 'workflow_key': workflow_key, 'workflow_data': workflow_data,
+                                           'encoder_profile': encoder_profile}
+    prompt_client_map[job['prompt_id']] = job['client_id']
+    if bridge_inputs: prompt_bridge_overrides[job['prompt_id']] = bridge_inputs
+    threading.Thread(target=run_api_job, args=(job, encoder_profile, bridge_inputs), daemon=True).start()
+    log.info(f"[Jobs] Job {job_id} submitted for workflow '{workflow_key}' (prompt {job['prompt_id']}).")
+    return jsonify({"success": True, "job_id": job_id, "status": job['status'], "url": f"/api/jobs/{job_id}"}), 202
+
+@app.route('/api/jobs', methods=['GET'])
+def list_api_jobs():
+    """Lists known REST jobs, newest first. / 列出已知的 REST 任务，最新的在前。"""
+    return jsonify({"jobs": [serialize_api_job(job) for job in reversed(list(api_jobs.values()))]})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_api_job(job_id):
+    """Returns a REST job's status; ?wait=N long-polls up to N seconds (max API_JOB_MAX_WAIT) for it to finish."""
+    """返回 REST 任务状态；?wait=N 最多长轮询 N 秒（上限 API_JOB_MAX_WAIT）等待其结束。"""
+    job = api_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "任务不存在 (Unknown job)."}), 404
+    wait = min(max(request.args.get('wait', 0, type=float), 0), API_JOB_MAX_WAIT)
+    if wait and job['status'] not in API_JOB_TERMINAL_STATES:
+        job['done'].wait(wait)
+    return jsonify(serialize_api_job(job))
+
+@app.route('/api/jobs/<job_id>/images/<int:index>', methods=['GET'])
+def get_api_job_image(job_id, index):
+    """Downloads a result image of a completed REST job. / 下载已完成 REST 任务的结果图像。"""
+    job = api_jobs.get(job_id)
+    if job is None or not 0 <= index < len(job['images']):
+        return jsonify({"success": False, "message": "图像不存在 (Unknown job or image)."}), 404
+    try:
+        mime_type, image_data = api_job_image(job, index)
+    except OSError:
+        return jsonify({"success": False, "message": "结果文件已不存在 (The result file is no longer available)."}), 410
+    if isinstance(image_data, str): image_data = base64.b64decode(image_data)
+    return app.response_class(image_data, mimetype=mime_type)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_api_job(job_id):
+    """Cancels a pending or running REST job. / 取消等待中或运行中的 REST 任务。"""
+    job = api_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "任务不存在 (Unknown job)."}), 404
+    if job['status'] in API_JOB_TERMINAL_STATES:
+        return jsonify({"success": False, "message": f"任务已结束 (Job already {job['status']})."}), 409
+    job['cancel_requested'] = True
+    if job['status'] != 'pending': cancel_render_for_client(job['client_id'], 'Job cancelled through the REST API.')
+    with api_job_slots: api_job_slots.notify_all() # Let a waiting job notice / 让等待中的任务感知取消
+    return jsonify({"success": True, "message": "已请求取消 (Cancellation requested).", "job_id": job_id}), 202
+
 if __name__ == '__main__':
     log.info(f"Starting ComfyFlow Flask server (v4.0.0)...")
+    log.info(f"Config: {shared_config.CONFIG_FILE}" + ("" if _shared_config_loaded else " (not found, using defaults)"))
+    for problem in _shared_config_problems: log.warning(f"[Config] Invalid value {problem}")
+    if not SHARED_CONFIG.get('comfyui_dir'): log.warning("comfyui_dir is not set in the config; ComfyUI paths are unknown. / 配置中未设置 comfyui_dir。")
     log.info(f"Workflow Path: {COMFYUI_WORKFLOWS_PATH}")
     log.info(f"ComfyUI API Target: {COMFYUI_API_ADDRESS}")
     log.info(f"Bridge Namespace: {BRIDGE_NAMESPACE}")
+    if OUTPUT_WATCHER_ENABLED:
+        output_watcher.start()
+    config_watcher.start()
+    threading.Thread(target=retention_loop, daemon=True, name="RetentionSweeper").start()
     # Run with gevent server / 使用 gevent 服务器运行
     # Use host='0.0.0.0' to be accessible on the network / 使用 host='0.0.0.0' 以便在网络上访问
     # Use debug=False for production or stable testing / 在生产或稳定测试中使用 debug=False
-    socketio.run(app, host='0.0.0.0', port=5000, debug=False) # Changed debug to False / 将调试更改为 False
\ No newline at end of file
+    socketio.run(app, host='0.0.0.0', port=5000, debug=False) # Changed debug to False / 将调试更改为 False
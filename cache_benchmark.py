@@ -0,0 +1,60 @@
+# File: cache_benchmark.py
+# Measures repeated renders against a running app.py through the REST job API / 通过 REST 任务 API 对运行中的 app.py 测量重复渲染
+# Submits the same workflow with the same inputs several times and reports latency and ComfyUI cache hits per run.
+# Every run after the first should be a full cache hit that still returns its images; the script exits non-zero otherwise,
+# so it doubles as the regression check for fully cached repeats. NodeBridge_Input values must be passed with --bridge-inputs:
+# values the frontend would only answer at run time make their node (and everything below it) run every time.
+# 以相同输入多次提交同一工作流，报告每次运行的耗时和 ComfyUI 缓存命中数。
+# 首次之后的每次运行都应完全命中缓存且仍返回图像；否则脚本以非零状态退出，因此也可用作完全缓存重复渲染的回归检查。NodeBridge_Input 的值必须通过 --bridge-inputs 传入：
+# 只在运行时由前端应答的值会使其节点（及其下游）每次都执行。
+#
+# Usage / 用法: python cache_benchmark.py <workflow_key> [--runs 5] [--url http://127.0.0.1:5000] [--bridge-inputs '{"Text": "..."}']
+
+import sys
+import json
+import time
+import argparse
+import requests
+
+POLL_WAIT = 30 # Long-poll seconds per request / 每次请求的长轮询秒数
+JOB_TIMEOUT = 900
+
+def run_job(base_url, workflow_key, bridge_inputs):
+    """Submits one job and waits for it. Returns (seconds, job). / 提交一个任务并等待其结束。返回 (秒数, 任务)。"""
+    started = time.perf_counter()
+    response = requests.post(f"{base_url}/api/jobs", json={'workflow_key': workflow_key, 'bridge_inputs': bridge_inputs}, timeout=30)
+    response.raise_for_status()
+    job_url = f"{base_url}{response.json()['url']}"
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        job = requests.get(job_url, params={'wait': POLL_WAIT}, timeout=POLL_WAIT + 10).json()
+        if job['status'] in ('completed', 'failed', 'cancelled'):
+            return time.perf_counter() - started, job
+    raise TimeoutError(f"Job did not finish within {JOB_TIMEOUT}s: {job_url}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark repeated renders and check that repeats are served from ComfyUI's cache.")
+    parser.add_argument('workflow_key')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--bridge-inputs', type=json.loads, default=None, help="JSON object of NodeBridge values, e.g. '{\"Text\": \"a cat\"}'")
+    args = parser.parse_args(argv)
+
+    failures = []; timings = []
+    for run in range(1, args.runs + 1):
+        seconds, job = run_job(args.url.rstrip('/'), args.workflow_key, args.bridge_inputs)
+        cached, total = job.get('cached_nodes') or 0, job.get('total_nodes') or 0
+        print(f"run {run}: {job['status']:<9} {seconds:7.2f}s  cached {cached}/{total} nodes  {len(job['images'])} image(s)")
+        timings.append(seconds)
+        if job['status'] != 'completed' or not job['images']:
+            failures.append(f"run {run} {job['status']} without images: {job.get('error')}")
+        elif run > 1 and total and cached < total:
+            failures.append(f"run {run} re-executed {total - cached} node(s) with unchanged inputs")
+    if len(timings) > 1:
+        repeats = timings[1:]
+        print(f"first run {timings[0]:.2f}s, repeats mean {sum(repeats) / len(repeats):.2f}s, min {min(repeats):.2f}s")
+    for failure in failures: print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,30 @@
 # -*- coding: utf-8 -*-
-import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, font as tkfont, filedialog
+import time
+_STARTUP_T0 = time.perf_counter() # Before the heavy imports, for --profile-startup / 位于重量级导入之前，供 --profile-startup 使用
+try:
+    import tkinter as tk
+    from tkinter import ttk, scrolledtext, messagebox
+except ImportError: # Headless render boxes may lack Tk; --headless does not need it / 无头渲染机可能没有 Tk；--headless 不需要它
+    tk = None
 import subprocess
 import os
+import sys
+import signal
+import argparse
 import threading
 import queue
-import time
+import collections
 import json
-import webbrowser
-import requests # Added for port check / 添加用于端口检查
-import socket # Fallback or additional checks / 后备或其他检查
+import urllib.error
+import socket # Readiness probes / 就绪探测
+from urllib.parse import urlparse, parse_qs
+import shared_config # launcher_config.json schema shared with app.py / 与 app.py 共用的 launcher_config.json 结构
+# webbrowser, uuid, urllib.request, http.server, tkinter.filedialog and psutil are imported on first use to keep startup fast
+# webbrowser、uuid、urllib.request、http.server、tkinter.filedialog 和 psutil 在首次使用时导入，以加快启动
 
 # --- Configuration File ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(BASE_DIR, "launcher_config.json")
+CONFIG_FILE = shared_config.CONFIG_FILE
 
 # --- Default Values ---
 DEFAULT_COMFYUI_INSTALL_DIR = ""
@@ -24,6 +35,11 @@ DEFAULT_FP8_UNET = False
 DEFAULT_FP8_TEXTENC = False
 DEFAULT_DISABLE_CUDA_MALLOC = False
 DEFAULT_VRAM_MODE = "default"
+DEFAULT_LOG_MAX_LINES = 5000 # Lines kept per output widget / 每个输出窗口保留的行数
+DEFAULT_RESOURCE_SAMPLE_INTERVAL = 2.0 # Seconds between resource samples / 资源采样间隔（秒）
+DEFAULT_WARMUP_ENABLED = False
+DEFAULT_WARMUP_TIMEOUT = 300 # Seconds per warm-up workflow / 每个预热工作流的超时（秒）
+DEFAULT_RSS_ALERT_MB = 0 # 0 = alert at RSS_ALERT_FRACTION of system RAM / 0 表示按系统内存比例告警
 
 # --- Constants for Styling ---
 UPDATE_INTERVAL_MS = 100
@@ -54,11 +70,907 @@ VERSION_INFO = "Kerry, Ver. 1.6.1" # Incremented version / 增加版本号
 # Special marker for queue
 _COMFYUI_READY_MARKER_ = "_COMFYUI_IS_READY_FOR_BROWSER_\n"
 
+# --- Startup Profiling ---
+_STARTUP_MARKS = [("start", _STARTUP_T0)]
+
+def startup_mark(label):
+    """Records a --profile-startup checkpoint; each step is timed from the previous mark."""
+    _STARTUP_MARKS.append((label, time.perf_counter()))
+
+def startup_report():
+    """Returns the --profile-startup breakdown as printable text."""
+    lines = ["--- Startup profile / 启动耗时 ---"]
+    for (_, previous), (label, current) in zip(_STARTUP_MARKS, _STARTUP_MARKS[1:]):
+        lines.append(f"{label:<28}{(current - previous) * 1000:9.1f} ms  (t={(current - _STARTUP_T0) * 1000:8.1f} ms)")
+    return "\n".join(lines)
+
+# --- Readiness Probing ---
+FLASK_PORT = "5000"
+READINESS_PROBE_TIMEOUT = 1.0 # Per HTTP probe / 每次 HTTP 探测
+READINESS_INITIAL_DELAY = 0.2 # First backoff step / 第一次退避间隔
+READINESS_MAX_DELAY = 2.0 # Backoff cap / 退避上限
+COMFYUI_READY_TIMEOUT = 180 # Model-heavy custom nodes can take minutes / 大量自定义节点可能需要数分钟
+FLASK_READY_TIMEOUT = 60
+
+def probe_http_ready(url, timeout=READINESS_PROBE_TIMEOUT):
+    """Returns True if the URL answers 200 OK. Plain socket GET; only the status line is read."""
+    parsed = urlparse(url)
+    try:
+        with socket.create_connection((parsed.hostname or "127.0.0.1", parsed.port or 80), timeout=timeout) as sock:
+            sock.sendall(f"GET {parsed.path or '/'} HTTP/1.0\r\nHost: {parsed.netloc}\r\nConnection: close\r\n\r\n".encode('ascii'))
+            status_line = sock.makefile('rb').readline(256).split()
+        return len(status_line) >= 2 and status_line[1] == b"200"
+    except (OSError, ValueError): return False
+
+def wait_for_service_ready(probe_url, is_alive, ready_event=None, timeout=60, stop_event=None):
+    """Waits until the service is ready, its process exits, or the timeout passes.
+    Readiness is the stdout ready marker (ready_event) or a successful HTTP probe, polled with exponential backoff.
+    Returns (ready, elapsed_seconds, reason)."""
+    start = time.monotonic(); delay = READINESS_INITIAL_DELAY
+    while True:
+        elapsed = time.monotonic() - start
+        if ready_event is not None and ready_event.is_set(): return True, elapsed, "marker"
+        if probe_http_ready(probe_url): return True, time.monotonic() - start, "probe"
+        if not is_alive(): return False, time.monotonic() - start, "exited"
+        if stop_event is not None and stop_event.is_set(): return False, time.monotonic() - start, "stopped"
+        if elapsed >= timeout: return False, elapsed, "timeout"
+        # Wake early if the ready marker arrives / 若就绪标记到达则提前唤醒
+        wait_for = min(delay, max(0.0, timeout - elapsed))
+        if ready_event is not None: ready_event.wait(wait_for)
+        else: time.sleep(wait_for)
+        delay = min(delay * 2, READINESS_MAX_DELAY)
+
+# --- Persistent Service Logs ---
+LOG_DIR = os.path.join(BASE_DIR, "logs")
+LOG_FILE_MAX_BYTES = 50 * 1024 * 1024 # Rotate after 50 MB / 超过 50 MB 轮转
+LOG_FILE_BACKUP_COUNT = 5 # Keep <name>.log.1 .. .5 / 保留 <name>.log.1 .. .5
+LOG_WRITE_BUFFER_BYTES = 256 * 1024
+LOG_FLUSH_INTERVAL = 1.0 # Seconds between flushes while output is idle or busy / 刷新间隔（秒）
+LOG_INDEX_MAX_ENTRIES = 20000 # Error/warning offsets kept in memory / 内存中保留的错误/警告偏移数
+LOG_INDEX_PREVIEW_CHARS = 200
+LOG_CONTEXT_BYTES = 16 * 1024 # Read window around an indexed line / 索引行周围的读取窗口
+
+def classify_log_level(line):
+    """Returns 'error', 'warning' or None by content (ComfyUI logs everything to stderr, so the stream is no hint)."""
+    upper = line.upper()
+    if "ERROR" in upper or "TRACEBACK" in upper or "EXCEPTION" in upper: return "error"
+    if "WARN" in upper: return "warning"
+    return None
+
+class RotatingLogWriter:
+    """Tees service output to size-rotated log files from a background thread and indexes error/warning line offsets.
+    Index entries are (generation, offset, level, preview); the generation maps to <name>.log or a rotated <name>.log.N."""
+    def __init__(self, log_dir, name, max_bytes=LOG_FILE_MAX_BYTES, backup_count=LOG_FILE_BACKUP_COUNT):
+        self.name = name; self.max_bytes = max_bytes; self.backup_count = backup_count
+        self.path = os.path.join(log_dir, f"{name}.log")
+        self._queue = queue.Queue(); self._lock = threading.Lock(); self._index = collections.deque(maxlen=LOG_INDEX_MAX_ENTRIES)
+        self._generation = backup_count # Current file; older files are generation - N / 当前文件；更早的文件为 generation - N
+        self._file = None; self._index_file = None; self._offset = 0; self._last_flush = time.monotonic(); self._failed = False
+        self._load_index()
+        self._thread = threading.Thread(target=self._run, name=f"LogWriter-{name}", daemon=True); self._thread.start()
+
+    def write(self, source, line):
+        """Queues a line for writing; never blocks the caller."""
+        if not self._failed: self._queue.put((time.time(), source, line))
+
+    def close(self):
+        """Writes out everything queued and closes the files."""
+        self._queue.put(None); self._thread.join(timeout=5)
+
+    def flush(self):
+        with self._lock: self._flush_locked()
+
+    def path_for(self, generation):
+        """Returns the file holding the given generation, or None if it was rotated away."""
+        age = self._generation - generation
+        if age == 0: return self.path
+        return f"{self.path}.{age}" if 0 < age <= self.backup_count else None
+
+    def entries(self, level=None, text_filter=None):
+        """Returns indexed entries, optionally filtered by level and case-insensitive substring."""
+        with self._lock: snapshot = list(self._index)
+        if level: snapshot = [e for e in snapshot if e[2] == level]
+        if text_filter: needle = text_filter.lower(); snapshot = [e for e in snapshot if needle in e[3].lower()]
+        return snapshot
+
+    def read_context(self, entry, context_lines=20):
+        """Reads the lines around an indexed entry by seeking, without loading the log. Returns (before, from_entry) or None."""
+        generation, offset = entry[0], entry[1]
+        self.flush()
+        with self._lock: path = self.path_for(generation)
+        if not path or not os.path.isfile(path): return None
+        start = max(0, offset - LOG_CONTEXT_BYTES)
+        with open(path, 'rb') as f: f.seek(start); chunk = f.read(offset - start + LOG_CONTEXT_BYTES)
+        before = chunk[:offset - start].decode('utf-8', errors='replace').splitlines()
+        if start > 0: before = before[1:] # First line is cut / 第一行不完整
+        after = chunk[offset - start:].decode('utf-8', errors='replace').splitlines()
+        return before[-context_lines:], after[:context_lines + 1]
+
+    def _run(self):
+        while True:
+            try: item = self._queue.get(timeout=LOG_FLUSH_INTERVAL)
+            except queue.Empty: self.flush(); continue
+            batch = [item]
+            try:
+                while len(batch) < 1000: batch.append(self._queue.get_nowait())
+            except queue.Empty: pass
+            with self._lock:
+                try:
+                    if self._file is None and not self._failed: self._open()
+                    for entry in batch:
+                        if entry is None: self._close_files(); return
+                        if not self._failed: self._write_locked(*entry)
+                    if time.monotonic() - self._last_flush >= LOG_FLUSH_INTERVAL: self._flush_locked()
+                except OSError as e:
+                    print(f"Log writer '{self.name}' disabled after error: {e}"); self._failed = True; self._close_files()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._offset = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        self._file = open(self.path, 'ab', buffering=LOG_WRITE_BUFFER_BYTES)
+        self._index_file = open(self.path + ".idx", 'a', encoding='utf-8', buffering=LOG_WRITE_BUFFER_BYTES)
+
+    def _load_index(self):
+        """Restores the index of existing files from their .idx sidecars (offset, level, preview per line)."""
+        for age in range(self.backup_count, -1, -1):
+            log_path = self.path_for(self._generation - age)
+            try:
+                with open(log_path + ".idx", 'r', encoding='utf-8', errors='replace') as f:
+                    for idx_line in f:
+                        parts = idx_line.rstrip("\n").split("\t", 2)
+                        if len(parts) == 3 and parts[0].isdigit(): self._index.append((self._generation - age, int(parts[0]), parts[1], parts[2]))
+            except OSError: continue
+
+    def _write_locked(self, timestamp, source, line):
+        text = f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))} {source} " + line.rstrip("\r\n") + "\n"
+        level = classify_log_level(line)
+        if level:
+            preview = line.strip().replace("\t", " ")[:LOG_INDEX_PREVIEW_CHARS]
+            self._index.append((self._generation, self._offset, level, preview))
+            self._index_file.write(f"{self._offset}\t{level}\t{preview}\n")
+        data = text.encode('utf-8', errors='replace'); self._file.write(data); self._offset += len(data)
+        if self._offset >= self.max_bytes: self._rotate()
+
+    def _rotate(self):
+        self._close_files()
+        for age in range(self.backup_count, 0, -1):
+            src = self.path if age == 1 else f"{self.path}.{age - 1}"; dst = f"{self.path}.{age}"
+            for suffix in ("", ".idx"):
+                if os.path.exists(src + suffix): os.replace(src + suffix, dst + suffix)
+        for suffix in ("", ".idx"):
+            if self.backup_count == 0 and os.path.exists(self.path + suffix): os.remove(self.path + suffix)
+        self._generation += 1
+        while self._index and self._generation - self._index[0][0] > self.backup_count: self._index.popleft()
+        self._open()
+
+    def _flush_locked(self):
+        try:
+            if self._file: self._file.flush()
+            if self._index_file: self._index_file.flush()
+        except (OSError, ValueError): pass
+        self._last_flush = time.monotonic()
+
+    def _close_files(self):
+        for f in (self._file, self._index_file):
+            try:
+                if f: f.close()
+            except OSError: pass
+        self._file = None; self._index_file = None
+
+# --- Launcher Configuration ---
+VALID_VRAM_MODES = shared_config.VALID_VRAM_MODES
+
+def load_launcher_config():
+    """Loads launcher_config.json through shared_config, which validates it and fills in defaults. Returns (config, loaded_from_file).
+    Keys the launcher does not know are kept so saving does not drop them."""
+    config, loaded_from_file, problems = shared_config.load_config(CONFIG_FILE)
+    print(f"Configuration loaded from {CONFIG_FILE}" if loaded_from_file else "Config file not found or unreadable, using defaults...")
+    for problem in problems: print(f"Warning: Invalid config value {problem}")
+    return config, loaded_from_file
+
+# --- Service Management Core ---
+SERVICE_LABELS = {"ComfyUI": ("Backend_ComfyUI", "后端"), "Flask": ("Frontend_Web", "前端")}
+SERVICE_STOP_TIMEOUTS = {"ComfyUI": 3, "Flask": 2}
+
+# --- Model Warm-up ---
+WARMUP_CLIENT_ID = "comfyflow-launcher-warmup"
+WARMUP_STEP_LIMIT = 1 # Sampler steps are cut down; model weights load all the same / 采样步数被削减；模型权重照常加载
+WARMUP_POLL_INITIAL_DELAY = 0.5
+WARMUP_POLL_MAX_DELAY = 3.0
+
+def comfyui_http_json(port, path, payload=None, timeout=10):
+    """GETs (or POSTs payload as JSON to) a local ComfyUI endpoint and returns the decoded JSON response."""
+    import urllib.request
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=data, headers={"Content-Type": "application/json"} if data else {})
+    with urllib.request.urlopen(req, timeout=timeout) as response: return json.loads(response.read().decode('utf-8') or "{}")
+
+def prepare_warmup_prompt(workflow):
+    """Returns a lightened copy of an API-format workflow (steps and batch size cut to the minimum), or None for UI-format files."""
+    if not isinstance(workflow, dict) or not workflow or "nodes" in workflow: return None
+    if not all(isinstance(node, dict) and "class_type" in node for node in workflow.values()): return None
+    prompt = json.loads(json.dumps(workflow))
+    for node in prompt.values():
+        inputs = node.get("inputs", {})
+        if isinstance(inputs.get("steps"), int): inputs["steps"] = min(inputs["steps"], WARMUP_STEP_LIMIT)
+        if isinstance(inputs.get("batch_size"), int): inputs["batch_size"] = 1
+    return prompt
+
+# --- Resource Monitor ---
+RESOURCE_HISTORY_SIZE = 150 # Samples kept per service (5 min at 2s) / 每个服务保留的样本数（2 秒间隔约 5 分钟）
+RSS_ALERT_FRACTION = 0.8 # Default RSS alert threshold as a share of system RAM / 默认 RSS 告警阈值占系统内存的比例
+RSS_ALERT_CLEAR_RATIO = 0.9 # Alert re-arms once RSS drops below 90% of the threshold / RSS 降至阈值 90% 以下后重新告警
+SPARKLINE_CHARS = "▁▂▃▄▅▆▇█"
+
+def sparkline(values):
+    """Renders values as a unicode block sparkline."""
+    if not values: return ""
+    low = min(values); span = (max(values) - low) or 1
+    return "".join(SPARKLINE_CHARS[int((v - low) / span * (len(SPARKLINE_CHARS) - 1))] for v in values)
+
+class ResourceMonitor:
+    """Samples CPU%, RSS, thread and handle counts of each managed service's process tree into a bounded time series.
+    Uses psutil when installed; without it the monitor reports itself unavailable and does nothing."""
+    def __init__(self, manager, interval=DEFAULT_RESOURCE_SAMPLE_INTERVAL, rss_alert_mb=DEFAULT_RSS_ALERT_MB, on_alert=None):
+        self.manager = manager; self.interval = max(0.5, float(interval or DEFAULT_RESOURCE_SAMPLE_INTERVAL))
+        self.on_alert = on_alert or (lambda service, sample, threshold_mb: None)
+        self.history = {service: collections.deque(maxlen=RESOURCE_HISTORY_SIZE) for service in manager.SERVICES}
+        self.alerting = {service: False for service in manager.SERVICES}
+        self._rss_alert_mb = float(rss_alert_mb or 0); self._psutil = None; self._procs = {}; self._thread = None
+        self.available = False
+
+    def start(self):
+        if self._thread and self._thread.is_alive(): return
+        try: import psutil # Optional; imported only when monitoring starts / 可选依赖；仅在监控启动时导入
+        except ImportError: print("psutil not installed; resource monitor disabled."); return
+        self._psutil = psutil; self.available = True
+        if not self._rss_alert_mb: self._rss_alert_mb = psutil.virtual_memory().total * RSS_ALERT_FRACTION / (1024 * 1024)
+        self._thread = threading.Thread(target=self._run, name="ResourceMonitor", daemon=True); self._thread.start()
+
+    @property
+    def rss_alert_mb(self): return round(self._rss_alert_mb)
+
+    def _run(self):
+        while True:
+            for service in self.manager.SERVICES:
+                process = self.manager.processes.get(service)
+                try:
+                    if process is not None and process.poll() is None: self._sample(service, process.pid)
+                except Exception as e: print(f"Resource monitor error ({service}): {e}")
+            time.sleep(self.interval)
+
+    def _sample(self, service, pid):
+        psutil = self._psutil
+        try: tree = [self._process(pid)] + self._process(pid).children(recursive=True)
+        except psutil.Error: return
+        sample = {"time": time.time(), "cpu": 0.0, "rss_mb": 0.0, "threads": 0, "handles": 0, "processes": 0}
+        for proc in tree:
+            proc = self._process(proc.pid) # Reuse objects so cpu_percent measures since the last sample / 复用对象以便 cpu_percent 计算自上次采样以来的值
+            try:
+                with proc.oneshot():
+                    sample["cpu"] += proc.cpu_percent(None); sample["rss_mb"] += proc.memory_info().rss / (1024 * 1024)
+                    sample["threads"] += proc.num_threads(); sample["handles"] += proc.num_handles() if os.name == 'nt' else proc.num_fds()
+                    sample["processes"] += 1
+            except psutil.Error: continue
+        live_pids = {proc.pid for proc in tree}
+        for stale_pid in [p for p in self._procs if p not in live_pids and not self._psutil.pid_exists(p)]: self._procs.pop(stale_pid, None)
+        sample["cpu"] = round(sample["cpu"], 1); sample["rss_mb"] = round(sample["rss_mb"], 1)
+        self.history[service].append(sample)
+        if not self.alerting[service] and sample["rss_mb"] >= self._rss_alert_mb:
+            self.alerting[service] = True; self.on_alert(service, sample, self.rss_alert_mb)
+        elif self.alerting[service] and sample["rss_mb"] < self._rss_alert_mb * RSS_ALERT_CLEAR_RATIO:
+            self.alerting[service] = False
+
+    def _process(self, pid):
+        if pid not in self._procs: self._procs[pid] = self._psutil.Process(pid)
+        return self._procs[pid]
+
+    def latest(self, service):
+        history = self.history[service]
+        return history[-1] if history and self.manager.is_running(service) else None
+
+    def series(self, service, key, count=30):
+        return [sample[key] for sample in list(self.history[service])[-count:]]
+
+    def snapshot(self, include_history=False):
+        """Returns a JSON-serializable view for the status API."""
+        result = {"available": self.available, "interval": self.interval, "rss_alert_mb": self.rss_alert_mb if self.available else None, "services": {}}
+        for service in self.manager.SERVICES:
+            entry = {"latest": self.latest(service), "rss_alert": self.alerting[service]}
+            if include_history: entry["history"] = list(self.history[service])
+            result["services"][service] = entry
+        return result
+
+# --- Crash Supervision ---
+SUPERVISE_INTERVAL = 1.0 # Seconds between process checks / 进程检查间隔（秒）
+RESTART_BACKOFF_BASE = 2.0 # First restart delay, doubled per recent crash / 首次重启延迟，每次近期崩溃翻倍
+RESTART_BACKOFF_MAX = 60.0
+CRASH_LOOP_WINDOW = 300 # Seconds in which crashes count as a loop / 计为崩溃循环的时间窗口（秒）
+CRASH_LOOP_MAX_RESTARTS = 5 # More crashes than this inside the window stops restarting / 窗口内超过此次数则停止重启
+CRASH_STDERR_LINES = 50 # stderr lines kept per crash record / 每条崩溃记录保留的 stderr 行数
+CRASH_HISTORY_SIZE = 20
+
+# --- Pre-flight Checks ---
+PREFLIGHT_MIN_FREE_MB = 2048 # Below this the output drive is reported as full / 低于此值视为输出磁盘已满
+PREFLIGHT_PORT_TIMEOUT = 0.3
+PREFLIGHT_INTERPRETER_TIMEOUT = 60 # First probe imports torch; later launches hit the cache / 首次探测会导入 torch，之后命中缓存
+PREFLIGHT_CACHE_FILE = os.path.join(BASE_DIR, ".preflight_cache.json")
+PREFLIGHT_MODULES = {"ComfyUI": ("torch",), "Flask": ("flask", "flask_socketio")}
+# Run by the probed interpreter; prints one JSON line / 由被探测的解释器运行；输出一行 JSON
+_INTERPRETER_PROBE = """import sys, os, json, importlib
+result = {"version": sys.version.split()[0], "modules": {}}
+for name in sys.argv[1:]:
+    try:
+        module = importlib.import_module(name)
+        info = {"ok": True, "version": getattr(module, "__version__", None), "site_dir": os.path.dirname(os.path.dirname(os.path.abspath(module.__file__)))}
+        if name == "torch": info["cuda"] = bool(module.cuda.is_available())
+    except Exception as e: info = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    result["modules"][name] = info
+print(json.dumps(result))
+"""
+_preflight_cache_lock = threading.Lock()
+
+def _nearest_existing_dir(path):
+    while path and not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path: return None
+        path = parent
+    return path or None
+
+def check_port_in_use(port, host="127.0.0.1"):
+    """Returns True if something already accepts connections on host:port."""
+    try:
+        with socket.create_connection((host, int(port)), timeout=PREFLIGHT_PORT_TIMEOUT): return True
+    except OSError: return False
+
+def check_dir_writable(path):
+    """Returns (ok, message). A missing directory is fine if the service can create it inside a writable parent."""
+    if os.path.isdir(path):
+        import tempfile
+        try:
+            with tempfile.TemporaryFile(dir=path): pass
+            return True, f"{path} 可写 / writable"
+        except OSError as e: return False, f"{path} 不可写 / not writable: {e}"
+    parent = _nearest_existing_dir(os.path.dirname(path))
+    if parent and os.access(parent, os.W_OK): return True, f"{path} 将被创建 / will be created"
+    return False, f"{path} 不存在且无法创建 / missing and cannot be created"
+
+def check_free_disk(path, min_free_mb=PREFLIGHT_MIN_FREE_MB):
+    """Returns (ok, message) for the free space on the drive holding path."""
+    import shutil
+    existing = _nearest_existing_dir(path)
+    if not existing: return False, f"{path} 所在磁盘不可用 / drive not available"
+    free_mb = shutil.disk_usage(existing).free / (1024 * 1024)
+    if free_mb < min_free_mb: return False, f"{existing} 剩余空间不足 / low disk space: {free_mb:.0f} MB (< {min_free_mb} MB)"
+    return True, f"{free_mb / 1024:.1f} GB free"
+
+def probe_interpreter(python_exe, modules, cwd=None):
+    """Runs python_exe with a version/import probe for modules and returns its result dict.
+    Successful results are cached in PREFLIGHT_CACHE_FILE until the interpreter or a probed site-packages directory changes (mtime)."""
+    key = f"{os.path.normcase(os.path.abspath(python_exe))}|{','.join(modules)}"
+    exe_mtime = os.path.getmtime(python_exe)
+    with _preflight_cache_lock:
+        try:
+            with open(PREFLIGHT_CACHE_FILE, 'r', encoding='utf-8') as f: cache = json.load(f)
+        except (OSError, ValueError): cache = {}
+    entry = cache.get(key)
+    if entry and entry.get("mtime") == exe_mtime:
+        try:
+            if all(os.path.getmtime(site_dir) == mtime for site_dir, mtime in entry["site_dirs"].items()): return dict(entry["result"], cached=True)
+        except (OSError, KeyError, AttributeError): pass
+    creationflags = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+    completed = subprocess.run([python_exe, "-c", _INTERPRETER_PROBE, *modules], cwd=cwd or None, capture_output=True, text=True, timeout=PREFLIGHT_INTERPRETER_TIMEOUT, creationflags=creationflags)
+    if completed.returncode != 0: raise RuntimeError(f"exit code {completed.returncode}: {completed.stderr.strip()[-300:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    if all(info.get("ok") for info in result["modules"].values()):
+        site_dirs = {info["site_dir"]: os.path.getmtime(info["site_dir"]) for info in result["modules"].values()}
+        with _preflight_cache_lock:
+            try:
+                try:
+                    with open(PREFLIGHT_CACHE_FILE, 'r', encoding='utf-8') as f: cache = json.load(f)
+                except (OSError, ValueError): cache = {}
+                cache[key] = {"mtime": exe_mtime, "site_dirs": site_dirs, "result": result}
+                with open(PREFLIGHT_CACHE_FILE, 'w', encoding='utf-8') as f: json.dump(cache, f, indent=1)
+            except OSError as e: print(f"Could not write pre-flight cache: {e}")
+    return dict(result, cached=False)
+
+class ServiceManager:
+    """UI-independent core shared by the Tk launcher and headless mode: builds the service commands, starts/stops
+    ComfyUI and the Flask app, streams their output and waits for readiness.
+    Output goes to on_output(service, source, line); notifications ("state_changed", "ready", "output_ready_marker") to on_event(event, service)."""
+    SERVICES = ("ComfyUI", "Flask")
+
+    def __init__(self, config, on_output=None, on_event=None):
+        self.config = config
+        self.on_output = on_output or (lambda service, source, line: None)
+        self.on_event = on_event or (lambda event, service: None)
+        self.processes = {service: None for service in self.SERVICES}
+        self.stop_events = {service: threading.Event() for service in self.SERVICES}
+        self.started_at = {}
+        self.last_error = {} # Latest hard start failure per service / 每个服务最近一次启动失败
+        self.comfyui_ready_event = threading.Event() # Set by the stdout ready line or a probe / 由 stdout 就绪行或探测设置
+        self.comfyui_externally_detected = False
+        self.warming_up = False
+        self.last_preflight = [] # Results of the latest pre-flight run / 最近一次预检结果
+        self._action_lock = threading.Lock()
+        self.start_cancelled = {service: False for service in self.SERVICES} # Set by a stop that arrives while a start is in flight / 启动进行中收到停止时设置
+        # Supervision state / 监督状态
+        self.supervised = {service: False for service in self.SERVICES} # Started by us and expected to keep running / 由我们启动且应保持运行
+        self.stderr_tails = {service: collections.deque(maxlen=CRASH_STDERR_LINES) for service in self.SERVICES}
+        self.crashes = {service: collections.deque(maxlen=CRASH_HISTORY_SIZE) for service in self.SERVICES}
+        self.restart_counts = {service: 0 for service in self.SERVICES}
+        self.crash_loop_tripped = {service: False for service in self.SERVICES}
+        self.pending_restarts = {} # service -> monotonic time of the scheduled restart / 服务 -> 计划重启的 monotonic 时间
+        self._supervisor_thread = None
+        self.monitor = ResourceMonitor(self, interval=config.get("resource_sample_interval"), rss_alert_mb=config.get("rss_alert_mb"), on_alert=self._on_rss_alert)
+        # Persistent, rotated copies of service output / 服务输出的持久化轮转副本
+        self.log_writers = {"ComfyUI": RotatingLogWriter(LOG_DIR, "comfyui"), "Flask": RotatingLogWriter(LOG_DIR, "frontend")}
+        self.update_derived_paths()
+
+    def update_derived_paths(self):
+        """Updates internal path variables and base arguments based on current config."""
+        self.base_project_dir = BASE_DIR
+        self.comfyui_install_dir = self.config.get("comfyui_dir", "")
+        self.comfyui_portable_python = self.config.get("python_exe", "")
+        venv_python = ("Scripts", "python.exe") if os.name == 'nt' else ("bin", "python")
+        self.venv_python_exe = os.path.join(self.base_project_dir, "venv", *venv_python)
+        self.app_script = os.path.join(self.base_project_dir, "app.py")
+        self.comfyui_main_script = os.path.join(self.comfyui_install_dir, "main.py") if self.comfyui_install_dir and os.path.isdir(self.comfyui_install_dir) else ""
+        self.flask_working_dir = self.base_project_dir
+        self.comfyui_api_port = self.config.get("comfyui_api_port", DEFAULT_COMFYUI_API_PORT)
+        self.comfyui_base_args = [
+            "--listen", "127.0.0.1", f"--port={self.comfyui_api_port}",
+            f"--enable-cors-header=http://127.0.0.1:{FLASK_PORT}",
+            f"--enable-cors-header=http://localhost:{FLASK_PORT}"
+        ]
+        print(f"--- Paths Updated ---")
+        print(f" ComfyUI Port: {self.comfyui_api_port}")
+        print(f" ComfyUI Base Args: {self.comfyui_base_args}")
+
+    def missing_paths(self, check_comfyui=True, check_flask=True):
+        """Returns the names of required files/directories that do not exist."""
+        missing = []
+        if check_comfyui:
+            if not self.comfyui_portable_python or not os.path.isfile(self.comfyui_portable_python): missing.append(f"后端 Python")
+            if not self.comfyui_main_script or not os.path.isfile(self.comfyui_main_script): missing.append(f"后端主脚本")
+            if not self.comfyui_install_dir or not os.path.isdir(self.comfyui_install_dir): missing.append(f"后端 ComfyUI 目录")
+        if check_flask:
+            if not self.venv_python_exe or not os.path.isfile(self.venv_python_exe): missing.append(f"前端 Venv Python")
+            if not self.app_script or not os.path.isfile(self.app_script): missing.append(f"前端 App 脚本")
+        return missing
+
+    def preflight(self, services):
+        """Runs the pre-flight checks for the given services concurrently: ports, interpreter probe, free disk and writable
+        input/output directories. Returns a list of {"service", "check", "ok", "message"}; nothing is spawned."""
+        from concurrent.futures import ThreadPoolExecutor
+        tasks = []
+        if "ComfyUI" in services:
+            comfyui_paths = shared_config.comfyui_paths(self.config); output_dir = comfyui_paths["output"]; input_dir = comfyui_paths["input"]
+            tasks += [("ComfyUI", "port", self._check_comfyui_port),
+                      ("ComfyUI", "interpreter", lambda: self._check_interpreter("ComfyUI", self.comfyui_portable_python, self.comfyui_install_dir)),
+                      ("ComfyUI", "disk", lambda: check_free_disk(output_dir)),
+                      ("ComfyUI", "output dir", lambda: check_dir_writable(output_dir)),
+                      ("ComfyUI", "input dir", lambda: check_dir_writable(input_dir))]
+        if "Flask" in services:
+            tasks += [("Flask", "port", lambda: (False, f"端口 {FLASK_PORT} 已被占用 / Port {FLASK_PORT} is already in use") if check_port_in_use(FLASK_PORT) else (True, f"port {FLASK_PORT} free")),
+                      ("Flask", "interpreter", lambda: self._check_interpreter("Flask", self.venv_python_exe, self.flask_working_dir))]
+        results = []
+        if not tasks: return results
+        with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="Preflight") as pool:
+            futures = [(service, check, pool.submit(func)) for service, check, func in tasks]
+            for service, check, future in futures:
+                try: ok, message = future.result()
+                except Exception as e: ok, message = False, f"{type(e).__name__}: {e}"
+                results.append({"service": service, "check": check, "ok": ok, "message": message})
+        self.last_preflight = results
+        return results
+
+    def run_preflight(self, services):
+        """Runs and reports the pre-flight checks. Failures are logged and stored in last_error; returns True if all passed."""
+        start = time.monotonic(); results = self.preflight(services); elapsed = time.monotonic() - start
+        all_ok = True
+        for service in services:
+            service_results = [result for result in results if result["service"] == service]
+            failures = [result for result in service_results if not result["ok"]]
+            if failures:
+                all_ok = False
+                for result in failures: self.log(service, f"预检失败 / Pre-flight failed [{result['check']}]: {result['message']}", "stderr")
+                self.last_error[service] = "\n".join(f"[{result['check']}] {result['message']}" for result in failures)
+                self.on_event("state_changed", service)
+            else: self.log(service, f"预检通过 / Pre-flight OK ({elapsed:.2f}s): " + "; ".join(result["message"] for result in service_results if result["check"] in ("interpreter", "disk")))
+        return all_ok
+
+    def _check_comfyui_port(self):
+        if not check_port_in_use(self.comfyui_api_port): return True, f"port {self.comfyui_api_port} free"
+        # An existing ComfyUI is adopted by start_comfyui; anything else would make ours exit / 已有的 ComfyUI 会被接管；其他程序会导致启动失败
+        if probe_http_ready(f"http://127.0.0.1:{self.comfyui_api_port}/queue"): return True, f"ComfyUI already serving port {self.comfyui_api_port}"
+        return False, f"端口 {self.comfyui_api_port} 已被其他程序占用 / Port {self.comfyui_api_port} is in use by another program"
+
+    def _check_interpreter(self, service, python_exe, cwd):
+        try: result = probe_interpreter(python_exe, PREFLIGHT_MODULES[service], cwd=cwd)
+        except subprocess.TimeoutExpired: return False, f"{python_exe} 在 {PREFLIGHT_INTERPRETER_TIMEOUT}s 内无响应 / did not answer in time"
+        except (OSError, RuntimeError, ValueError, IndexError) as e: return False, f"{python_exe} 无法运行 / cannot run: {e}"
+        broken = [f"{name}: {info['error']}" for name, info in result["modules"].items() if not info.get("ok")]
+        if broken: return False, f"{python_exe} 无法导入 / import failed: " + "; ".join(broken)
+        details = [f"Python {result['version']}"]
+        for name, info in result["modules"].items():
+            details.append(f"{name} {info.get('version') or '?'}" + ((" (CUDA)" if info["cuda"] else " (CPU only)") if "cuda" in info else ""))
+        return True, ", ".join(details) + (" [cached]" if result.get("cached") else "")
+
+    def is_running(self, service):
+        process = self.processes.get(service)
+        return process is not None and process.poll() is None
+
+    def comfyui_available(self): return self.is_running("ComfyUI") or self.comfyui_externally_detected
+
+    def log(self, service, message, tag="info"):
+        """Reports a launcher message for a service to the output sink and its log file."""
+        source = f"[Launcher {tag.upper()}]"
+        self.on_output(service, source, message); self.log_writers[service].write(source, message)
+
+    def comfyui_command(self, launch_options=None):
+        """Builds the ComfyUI command line; launch_options overrides the saved performance flags. Returns (command, args)."""
+        options = launch_options or self.config
+        base_cmd = [self.comfyui_portable_python, "-s", "-u", self.comfyui_main_script]; current_args = list(self.comfyui_base_args)
+        if options.get("fp16_vae"): current_args.append("--fp16-vae")
+        if options.get("fp8_unet"): current_args.append("--fp8_e4m3fn-unet")
+        if options.get("fp8_textenc"): current_args.append("--fp8_e4m3fn-text-enc")
+        if options.get("disable_cuda_malloc"): current_args.append("--disable-cuda-malloc")
+        vram_mode = options.get("vram_mode")
+        if vram_mode == "high": current_args.append("--highvram")
+        elif vram_mode == "low": current_args.append("--lowvram")
+        preview_method = options.get("preview_method")
+        if preview_method and preview_method != "none": current_args.extend(["--preview-method", preview_method]) # Live previews in the frontend / 前端实时预览
+        return base_cmd + current_args, current_args
+
+    def _spawn(self, service, cmd_list, cwd, stream_names, env=None):
+        """Starts a service process and its stdout/stderr reader threads."""
+        creationflags = 0; startupinfo = None
+        if os.name == 'nt': creationflags = subprocess.CREATE_NO_WINDOW
+        if not self.start_cancelled[service]: self.stop_events[service].clear() # A cancel racing the spawn still applies / 与启动竞争的取消依然生效
+        self.stderr_tails[service].clear()
+        process = subprocess.Popen(cmd_list, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0, creationflags=creationflags, startupinfo=startupinfo, env=env)
+        self.processes[service] = process; self.started_at[service] = time.time()
+        threading.Thread(target=self.stream_output, args=(process.stdout, service, stream_names[0]), daemon=True).start()
+        threading.Thread(target=self.stream_output, args=(process.stderr, service, stream_names[1]), daemon=True).start()
+        return process
+
+    def stream_output(self, process_stream, service, stream_name):
+        marker_sent = False; api_port = self.comfyui_api_port
+        ready_str1 = f"Set up connection listening on: ::{api_port}"; ready_str2 = f"To see the GUI go to: http://127.0.0.1:{api_port}"
+        log_writer = self.log_writers[service]; stop_event = self.stop_events[service]
+        try:
+            for line_bytes in iter(process_stream.readline, b''):
+                if stop_event.is_set(): break
+                line = line_bytes.decode('utf-8', errors='replace')
+                if line:
+                    self.on_output(service, stream_name, line); log_writer.write(stream_name, line)
+                    if stream_name.endswith("ERR]"): self.stderr_tails[service].append(line.rstrip("\r\n"))
+                    if service == "ComfyUI" and not marker_sent and (ready_str1 in line or ready_str2 in line):
+                        print(f"DEBUG STREAM: Found ComfyUI ready string."); marker_sent = True; self.comfyui_ready_event.set(); self.on_event("output_ready_marker", service)
+        except ValueError: print(f"{stream_name} stream closed (ValueError).")
+        except Exception as e: print(f"Error reading {stream_name}: {e}")
+        finally:
+            print(f"{stream_name} stream reader thread finished.")
+            try: process_stream.close()
+            except Exception: pass
+
+    def start_comfyui(self, launch_options=None, preflight=True):
+        """Starts ComfyUI, or adopts one already serving the configured port, and blocks until it is ready.
+        Runs the pre-flight checks first unless the caller already did. Returns True if ComfyUI is ready; hard failures are stored in last_error["ComfyUI"]."""
+        if self.is_running("ComfyUI"): return self.comfyui_ready_event.is_set() # Already managed by this launcher / 已由此启动器管理
+        self.last_error.pop("ComfyUI", None)
+
+        # --- Check if ComfyUI API is already running on the configured port ---
+        # --- 检查 ComfyUI API 是否已在配置的端口上运行 ---
+        port_to_check = int(self.comfyui_api_port)
+        check_url = f"http://127.0.0.1:{port_to_check}/queue" # Use a lightweight endpoint / 使用轻量级端点
+        print(f"Checking if ComfyUI is running on {check_url} before launch...")
+        if probe_http_ready(check_url, timeout=2): # Short timeout / 短超时
+            self.log("ComfyUI", f"检测到 ComfyUI 已在端口 {port_to_check} 运行，跳过启动。", "info")
+            print(f"ComfyUI detected running on port {port_to_check}. Skipping launch.")
+            # We do not manage an external process / 我们不管理外部进程
+            self.comfyui_externally_detected = True; self.comfyui_ready_event.set(); self.processes["ComfyUI"] = None
+            self.on_event("state_changed", "ComfyUI")
+            return True
+        print(f"Port {port_to_check} not serving ComfyUI. Proceeding with launch.")
+        if preflight and not self.run_preflight(["ComfyUI"]): return False
+        if self.start_cancelled["ComfyUI"]: return False # Stopped during pre-flight / 预检期间被停止
+
+        self.comfyui_ready_event.clear()
+        self.comfyui_externally_detected = False # Ensure flag is false if we launch / 确保如果我们启动，标志为 false
+        try:
+            self.log("ComfyUI", f"启动 Backend_ComfyUI 于 {self.comfyui_install_dir}...")
+            comfyui_cmd_list, current_args = self.comfyui_command(launch_options)
+            self.log("ComfyUI", f"最终参数: {' '.join(current_args)}")
+            self.log("ComfyUI", f"完整命令: {' '.join(comfyui_cmd_list)}")
+            process = self._spawn("ComfyUI", comfyui_cmd_list, self.comfyui_install_dir, ("[ComfyUI]", "[ComfyUI ERR]"))
+            self.log("ComfyUI", f"Backend PID: {process.pid}")
+            # Proceed the moment ComfyUI serves /queue or prints its ready line / ComfyUI 可响应 /queue 或输出就绪行时立即继续
+            self.log("ComfyUI", f"等待后端就绪 (最长 {COMFYUI_READY_TIMEOUT}s)...")
+            ready, elapsed, reason = wait_for_service_ready(check_url, lambda: self.is_running("ComfyUI"), ready_event=self.comfyui_ready_event, timeout=COMFYUI_READY_TIMEOUT, stop_event=self.stop_events["ComfyUI"])
+            if reason == "stopped": return False
+            if not self.is_running("ComfyUI"):
+                exit_code = process.poll()
+                # Check if the reason might be port conflict (common issue) / 检查原因是否可能是端口冲突（常见问题）
+                error_reason = f"后端进程意外终止，代码 {exit_code}。"
+                if port_to_check and exit_code: # Simplified check for common exit codes on port conflict / 简化对端口冲突常见退出代码的检查
+                     error_reason += f"\n可能原因：端口 {port_to_check} 已被占用？\nPossible reason: Port {port_to_check} already in use?"
+                raise Exception(error_reason)
+            self.supervised["ComfyUI"] = True
+            if not ready:
+                self.log("ComfyUI", f"后端在 {elapsed:.1f}s 内未就绪 ({reason})", "warn"); self.on_event("state_changed", "ComfyUI")
+                return False
+            self.comfyui_ready_event.set()
+            self.log("ComfyUI", f"后端服务已就绪，用时 {elapsed:.1f}s ({reason})")
+            self.warm_up_comfyui() # Ready is only reported once weights are resident / 仅在权重加载后才报告就绪
+            if self.start_cancelled["ComfyUI"]: return False # Stopped during warm-up / 预热期间被停止
+            self.on_event("ready", "ComfyUI"); self.on_event("state_changed", "ComfyUI")
+            return True
+        except Exception as e:
+            error_msg = f"启动 Backend 失败: {e}"
+            print(error_msg)
+            self.log("ComfyUI", error_msg, "stderr")
+            self.last_error["ComfyUI"] = str(e)
+            self.processes["ComfyUI"] = None # Ensure process is None on failure / 确保失败时进程为 None
+            self.on_event("state_changed", "ComfyUI")
+            return False
+
+    def warm_up_comfyui(self):
+        """Runs the configured warm-up workflows one by one so checkpoint/VAE/ControlNet weights are loaded before the first real render."""
+        names = self.config.get("warmup_workflows") or []
+        if not self.config.get("warmup_enabled") or not names: return
+        import uuid
+        workflow_dir = shared_config.comfyui_paths(self.config)["workflows"]
+        timeout = float(self.config.get("warmup_timeout") or DEFAULT_WARMUP_TIMEOUT)
+        self.warming_up = True; self.on_event("state_changed", "ComfyUI")
+        self.log("ComfyUI", f"开始模型预热 / Warming up with {len(names)} workflow(s)...")
+        total_start = time.monotonic()
+        try:
+            for name in names:
+                if not self.is_running("ComfyUI"): break
+                try:
+                    with open(os.path.join(workflow_dir, name), 'r', encoding='utf-8') as f: workflow = json.load(f)
+                except (OSError, ValueError) as e: self.log("ComfyUI", f"预热跳过 / Warm-up skipped {name}: {e}", "warn"); continue
+                prompt = prepare_warmup_prompt(workflow)
+                if prompt is None: self.log("ComfyUI", f"预热跳过 / Warm-up skipped {name}: 不是 API 格式 (not API format)", "warn"); continue
+                start = time.monotonic()
+                try:
+                    response = comfyui_http_json(self.comfyui_api_port, "/prompt", {"prompt": prompt, "client_id": WARMUP_CLIENT_ID, "prompt_id": str(uuid.uuid4())})
+                    outcome = self._wait_for_warmup_prompt(response.get("prompt_id"), timeout)
+                except urllib.error.HTTPError as e: outcome = f"rejected ({e.code}: {e.read().decode('utf-8', errors='replace')[:200]})"
+                except (urllib.error.URLError, OSError, ValueError) as e: outcome = f"failed ({e})"
+                self.log("ComfyUI", f"预热 / Warm-up {name}: {outcome}, {time.monotonic() - start:.1f}s", "info" if outcome == "success" else "warn")
+        finally:
+            self.warming_up = False
+        self.log("ComfyUI", f"模型预热完成 / Warm-up finished in {time.monotonic() - total_start:.1f}s")
+
+    def _wait_for_warmup_prompt(self, prompt_id, timeout):
+        """Polls /history with backoff until the prompt finishes. Returns its status string, 'timeout' or 'stopped'."""
+        deadline = time.monotonic() + timeout; delay = WARMUP_POLL_INITIAL_DELAY
+        while time.monotonic() < deadline:
+            if self.stop_events["ComfyUI"].wait(delay) or not self.is_running("ComfyUI"): return "stopped"
+            history = comfyui_http_json(self.comfyui_api_port, f"/history/{prompt_id}")
+            if prompt_id in history: return history[prompt_id].get("status", {}).get("status_str", "success")
+            delay = min(delay * 2, WARMUP_POLL_MAX_DELAY)
+        return "timeout"
+
+    def start_flask(self, preflight=True):
+        """Starts the Flask app and blocks until it answers HTTP. Returns True if the frontend is ready."""
+        if self.is_running("Flask"): return True
+        self.last_error.pop("Flask", None)
+        if preflight and not self.run_preflight(["Flask"]): return False
+        if self.start_cancelled["Flask"]: return False # Stopped during pre-flight / 预检期间被停止
+        try:
+            self.log("Flask", f"启动 Frontend_Web 于 {self.flask_working_dir}...")
+            flask_cmd_list = [self.venv_python_exe, "-u", self.app_script]
+            self.log("Flask", f"命令: {' '.join(flask_cmd_list)}")
+            flask_env = os.environ.copy()
+            flask_env['COMFYUI_HOST'] = "127.0.0.1" # Flask connects to localhost
+            flask_env['COMFYUI_API_PORT'] = str(self.comfyui_api_port)
+            flask_env['COMFYFLOW_CONFIG'] = CONFIG_FILE # Same shared config file / 同一共享配置文件
+            process = self._spawn("Flask", flask_cmd_list, self.flask_working_dir, ("[Flask]", "[Flask ERR]"), env=flask_env)
+            self.log("Flask", f"Frontend PID: {process.pid}")
+            ready, elapsed, reason = wait_for_service_ready(f"http://127.0.0.1:{FLASK_PORT}/", lambda: self.is_running("Flask"), timeout=FLASK_READY_TIMEOUT, stop_event=self.stop_events["Flask"])
+            if reason == "stopped": return False
+            if not self.is_running("Flask"): raise Exception(f"前端进程意外终止，代码 {process.poll()}。")
+            self.supervised["Flask"] = True
+            if not ready: self.log("Flask", f"前端在 {elapsed:.1f}s 内未就绪 ({reason})", "warn"); self.on_event("state_changed", "Flask"); return False
+            self.log("Flask", f"前端服务已就绪，用时 {elapsed:.1f}s"); self.on_event("ready", "Flask"); self.on_event("state_changed", "Flask")
+            return True
+        except Exception as e:
+            error_msg = f"启动 Frontend 失败: {e}"; print(error_msg); self.log("Flask", error_msg, "stderr")
+            self.last_error["Flask"] = str(e); self.processes["Flask"] = None; self.on_event("state_changed", "Flask")
+            return False
+
+    def start_all(self, launch_options=None):
+        """Starts ComfyUI (or adopts an external one) and then Flask, each as soon as the previous stage is ready. Returns True if both are up."""
+        run_start = time.monotonic(); comfy_elapsed = 0.0; flask_elapsed = 0.0
+
+        # --- Pre-flight for both services at once, before anything is spawned / 在启动任何进程前同时预检两个服务 ---
+        for service in self.SERVICES: self.last_error.pop(service, None)
+        pending = [service for service, needed in (("ComfyUI", not self.comfyui_available()), ("Flask", not self.is_running("Flask"))) if needed]
+        if not self.run_preflight(pending): return False
+
+        # --- Start/Check ComfyUI Section ---
+        if not self.comfyui_available():
+            # Blocks until ComfyUI is ready, exits, or times out; also covers the external check
+            # 阻塞直到 ComfyUI 就绪、退出或超时；同时包含外部检查
+            if not self.start_comfyui(launch_options, preflight=False):
+                self.log("ComfyUI", "启动后端失败，中止启动", "stderr")
+                return False
+            comfy_elapsed = time.monotonic() - run_start
+        else:
+            # Already running (internally or externally detected before clicking 'Run All')
+            # 已在运行（内部或在点击“全部运行”之前检测到外部）
+            self.log("ComfyUI", "后端已运行或已被检测到，跳过")
+
+        # --- Start Flask Section ---
+        if self.is_running("Flask"):
+            self.log("Flask", "前端已运行，跳过")
+        else:
+            flask_start = time.monotonic()
+            if not self.start_flask(preflight=False):
+                self.log("Flask", "启动前端失败", "stderr")
+                return False
+            flask_elapsed = time.monotonic() - flask_start
+
+        timing = f"启动耗时 / Startup timing: 后端 {comfy_elapsed:.1f}s, 前端 {flask_elapsed:.1f}s, 总计 {time.monotonic() - run_start:.1f}s"
+        print(timing); self.log("Flask", timing)
+        return True
+
+    def stop_service(self, service):
+        """Terminates a managed service, killing it if it does not exit in time. Returns False if it was not running."""
+        if service == "ComfyUI": self.comfyui_externally_detected = False # Cannot stop an external ComfyUI / 无法停止外部 ComfyUI
+        self.supervised[service] = False; self.pending_restarts.pop(service, None) # Intentional stop, not a crash / 主动停止，不是崩溃
+        process = self.processes.get(service)
+        if not self.is_running(service): self.processes[service] = None; return False
+        name, label = SERVICE_LABELS[service]
+        self.log(service, f"停止 {name}...")
+        try:
+            self.stop_events[service].set(); process.terminate()
+            try: process.wait(timeout=SERVICE_STOP_TIMEOUTS[service]); self.log(service, f"{label}已终止")
+            except subprocess.TimeoutExpired: print(f"Killing {service}"); self.log(service, f"强制终止{label}...", "warn"); process.kill(); self.log(service, f"{label}已强制终止")
+        except Exception as e: error_msg = f"停止{label}出错: {e}"; print(error_msg); self.log(service, error_msg, "stderr")
+        finally:
+            self.processes[service] = None
+            if service == "ComfyUI": self.comfyui_ready_event.clear()
+            self.on_event("state_changed", service)
+        return True
+
+    def stop_all(self):
+        """Stops Flask, then ComfyUI if this launcher manages it; also cancels pending auto-restarts."""
+        for service in ("Flask", "ComfyUI"): self.stop_service(service)
+        self.comfyui_externally_detected = False
+
+    def cancel_start(self, services):
+        """Makes an in-flight start of these services give up: signals its readiness/warm-up waits and terminates the process.
+        Takes no lock, so a stop never waits for a start to finish."""
+        for service in services:
+            self.start_cancelled[service] = True; self.stop_events[service].set()
+            process = self.processes.get(service)
+            if process is not None and process.poll() is None:
+                try: process.terminate()
+                except Exception as e: print(f"Terminate {service} failed: {e}")
+
+    def perform(self, action, service=None):
+        """Runs start/stop/restart for one service, or for all when service is None. Serialized so control requests cannot interleave;
+        a stop first cancels any start in flight (cancel_start), so it only waits for the state change, not for startup or warm-up."""
+        services = [service] if service else list(self.SERVICES)
+        if action in ("stop", "restart"): self.cancel_start(services)
+        with self._action_lock:
+            if action in ("stop", "restart"):
+                if service is None: self.stop_all()
+                else: self.stop_service(service)
+                for name in services: self.start_cancelled[name] = False # Any cancelled start has returned by now / 被取消的启动此时已返回
+            if action in ("start", "restart"):
+                for name in ([service] if service else self.SERVICES):
+                    if self.crash_loop_tripped[name]: self.reset_crash_loop(name)
+                if service is None: return self.start_all()
+                return self.start_comfyui() if service == "ComfyUI" else self.start_flask()
+            return True
+
+    def reap_exited(self):
+        """Forgets processes that have exited on their own; supervised ones are left for the supervisor to record."""
+        for service, process in self.processes.items():
+            if process is not None and process.poll() is not None and not self.supervised[service]: self.processes[service] = None
+
+    # --- Crash Supervision ---
+    def start_supervisor(self):
+        """Starts the background loop that restarts crashed services."""
+        if self._supervisor_thread and self._supervisor_thread.is_alive(): return
+        self._supervisor_thread = threading.Thread(target=self._supervise, name="ServiceSupervisor", daemon=True); self._supervisor_thread.start()
+
+    def _supervise(self):
+        while True:
+            time.sleep(SUPERVISE_INTERVAL)
+            try:
+                for service in self.SERVICES:
+                    process = self.processes.get(service)
+                    if self.supervised[service] and process is not None and process.poll() is not None and service not in self.pending_restarts:
+                        self.processes[service] = None
+                        self._record_crash(service, process.poll())
+                now = time.monotonic()
+                for service, due in list(self.pending_restarts.items()):
+                    if now >= due:
+                        self.pending_restarts.pop(service, None)
+                        threading.Thread(target=self._restart_crashed, args=(service,), daemon=True).start()
+            except Exception as e: print(f"Supervisor error: {e}")
+
+    def _record_crash(self, service, exit_code, reason=None):
+        """Records a crash with its stderr tail and schedules a restart with backoff, or trips the crash-loop breaker."""
+        now = time.time()
+        self.crashes[service].append({"time": now, "exit_code": exit_code, "reason": reason,
+                                      "uptime": round(now - self.started_at[service], 1) if service in self.started_at else None,
+                                      "stderr_tail": list(self.stderr_tails[service])})
+        if service == "ComfyUI": self.comfyui_ready_event.clear()
+        name, label = SERVICE_LABELS[service]
+        self.log(service, f"{label}意外退出 / {name} crashed (exit code {exit_code}){': ' + reason if reason else ''}", "stderr")
+        recent = [c for c in self.crashes[service] if now - c["time"] <= CRASH_LOOP_WINDOW]
+        if len(recent) > CRASH_LOOP_MAX_RESTARTS:
+            self.supervised[service] = False; self.crash_loop_tripped[service] = True
+            self.log(service, f"{label}在 {CRASH_LOOP_WINDOW}s 内崩溃 {len(recent)} 次，停止自动重启 / crash loop, auto-restart disabled", "stderr")
+            self.on_event("crash_loop", service); self.on_event("state_changed", service)
+            return
+        delay = min(RESTART_BACKOFF_BASE * 2 ** (len(recent) - 1), RESTART_BACKOFF_MAX)
+        self.pending_restarts[service] = time.monotonic() + delay
+        self.log(service, f"{delay:.1f}s 后自动重启{label} / restarting in {delay:.1f}s", "warn")
+        self.on_event("crashed", service); self.on_event("state_changed", service)
+
+    def _restart_crashed(self, service):
+        if not self.supervised[service]: return # Stopped by the user meanwhile / 期间已被用户停止
+        self.restart_counts[service] += 1
+        if self.perform("start", service) or not self.supervised[service]: return
+        if self.is_running(service):
+            # Alive but not ready within the timeout: slow, not crashed; the supervisor still records it if it exits later
+            # 进程存活但未在超时内就绪：只是慢，并未崩溃；若之后退出，监督器仍会记录
+            name, label = SERVICE_LABELS[service]
+            self.log(service, f"{label}已重启但尚未就绪，继续监督 / {name} restarted but is not ready yet; still supervised", "warn")
+            return
+        # The restart itself failed; that counts as another crash / 重启本身失败，计为又一次崩溃
+        self._record_crash(service, None, reason=self.last_error.get(service) or "restart failed")
+
+    def reset_crash_loop(self, service):
+        """Clears the crash-loop breaker so a manual start is supervised again."""
+        self.crash_loop_tripped[service] = False; self.crashes[service].clear()
+
+    def status(self):
+        """Returns a JSON-serializable snapshot of both services."""
+        services = {}
+        for service in self.SERVICES:
+            process = self.processes.get(service); running = self.is_running(service)
+            services[service] = {
+                "running": running,
+                "pid": process.pid if running else None,
+                "exit_code": process.poll() if process is not None and not running else None,
+                "uptime": round(time.time() - self.started_at[service], 1) if running and service in self.started_at else None,
+                "last_error": self.last_error.get(service),
+                "log_file": self.log_writers[service].path,
+                "supervised": self.supervised[service],
+                "restarts": self.restart_counts[service],
+                "crash_loop": self.crash_loop_tripped[service],
+                "restart_in": round(max(0.0, self.pending_restarts[service] - time.monotonic()), 1) if service in self.pending_restarts else None,
+                "crashes": list(self.crashes[service]),
+            }
+        services["ComfyUI"].update({"external": self.comfyui_externally_detected, "ready": self.comfyui_ready_event.is_set() and not self.warming_up, "warming_up": self.warming_up, "port": self.comfyui_api_port})
+        services["Flask"]["port"] = FLASK_PORT
+        return {"services": services, "resources": self.monitor.snapshot(), "preflight": self.last_preflight, "time": time.time()}
+
+    def _on_rss_alert(self, service, sample, threshold_mb):
+        self.log(service, f"内存告警 / RSS alert: {sample['rss_mb']:.0f} MB >= {threshold_mb} MB ({sample['processes']} 进程 / processes)", "warn")
+        self.on_event("resource_alert", service)
+
+    def close(self):
+        """Flushes and closes the log files."""
+        for writer in self.log_writers.values(): writer.close()
+
 class ConfigurableServiceRunnerApp:
     """Main class for the Tkinter application."""
-    def __init__(self, root):
-        """Initializes the application."""
+    def __init__(self, root, profile_startup=False):
+        """Initializes the application. Only the control bar and the settings tab are built before the window first appears;
+        the output panels, queue polling and resource monitor follow once it is on screen (_finish_startup)."""
         self.root = root
+        self.profile_startup = profile_startup
         self.root.title("服务运行与配置 / Service Runner & Config")
         self.root.geometry("950x700")
         self.root.configure(bg=BG_COLOR)
@@ -66,17 +978,11 @@ class ConfigurableServiceRunnerApp:
         self.root.columnconfigure(0, weight=1)
         self.root.rowconfigure(1, weight=1)
 
-        # Process and state variables
-        self.comfyui_process = None
-        self.flask_process = None
+        # Output and state variables (processes live in self.services) / 输出与状态变量（进程由 self.services 管理）
         self.comfyui_output_queue = queue.Queue()
         self.flask_output_queue = queue.Queue()
-        self.stop_event = threading.Event()
         self.backend_browser_triggered_for_session = False
-        self.comfyui_ready_marker_sent = False
-        # --- NEW state variable for external detection ---
-        # --- 用于外部检测的新状态变量 ---
-        self.comfyui_externally_detected = False
+        self.progress_tail = {} # Widget name -> last inserted line was a progress line / 窗口名 -> 最后插入的是否为进度行
 
         # Configuration variables
         self.comfyui_dir_var = tk.StringVar()
@@ -86,48 +992,40 @@ class ConfigurableServiceRunnerApp:
         self.fp8_unet_var = tk.BooleanVar()
         self.fp8_textenc_var = tk.BooleanVar()
         self.disable_cuda_malloc_var = tk.BooleanVar()
+        self.warmup_enabled_var = tk.BooleanVar()
         self.vram_mode_var = tk.StringVar()
+        self.preview_method_var = tk.StringVar()
 
         self.config = {}
 
         # Initialize
-        self.load_config()
-        self.update_derived_paths()
-        self.setup_styles()
-        self.setup_ui()
-
-        # Start background tasks
-        self.root.after(UPDATE_INTERVAL_MS, self.process_output_queues)
+        self.load_config(); startup_mark("config")
+        # Service core shared with headless mode / 与无头模式共享的服务核心
+        self.services = ServiceManager(self.config, on_output=self._on_service_output, on_event=self._on_service_event)
+        self.services.start_supervisor(); startup_mark("service core")
+        self.setup_styles(); startup_mark("styles")
+        self.setup_ui(); startup_mark("main window")
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
         # Set initial UI state
         self._update_ui_state()
+        # Secondary panels and background tasks after the first paint / 首次绘制后再构建次要面板与启动后台任务
+        self.root.after_idle(self._finish_startup)
+
+    def _finish_startup(self):
+        """Runs once the window is on screen: builds the output panels, then starts queue polling and resource monitoring."""
+        self.root.update_idletasks(); startup_mark("first paint")
+        self.build_output_panels(); startup_mark("output panels")
+        self.services.monitor.start(); startup_mark("resource monitor")
+        self.root.after(UPDATE_INTERVAL_MS, self.process_output_queues)
+        self.root.after(1000, self.update_resource_display)
+        self._update_ui_state()
+        if self.profile_startup: print(startup_report())
 
     # --- Configuration Handling ---
     def load_config(self):
         """Loads configuration from JSON file or uses defaults."""
-        loaded_config = {}
-        try:
-            if os.path.exists(CONFIG_FILE):
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    loaded_config = json.load(f)
-                print(f"Configuration loaded from {CONFIG_FILE}")
-            else:
-                print("Config file not found, using defaults...")
-        except (json.JSONDecodeError, IOError, OSError) as e:
-            print(f"Error loading config file '{CONFIG_FILE}': {e}. Using defaults.")
-            loaded_config = {}
-
-        self.config = {
-            "comfyui_dir": loaded_config.get("comfyui_dir", DEFAULT_COMFYUI_INSTALL_DIR),
-            "python_exe": loaded_config.get("python_exe", DEFAULT_COMFYUI_PORTABLE_PYTHON),
-            "comfyui_api_port": loaded_config.get("comfyui_api_port", DEFAULT_COMFYUI_API_PORT),
-            "fp16_vae": loaded_config.get("fp16_vae", DEFAULT_FP16_VAE),
-            "fp8_unet": loaded_config.get("fp8_unet", DEFAULT_FP8_UNET),
-            "fp8_textenc": loaded_config.get("fp8_textenc", DEFAULT_FP8_TEXTENC),
-            "disable_cuda_malloc": loaded_config.get("disable_cuda_malloc", DEFAULT_DISABLE_CUDA_MALLOC),
-            "vram_mode": loaded_config.get("vram_mode", DEFAULT_VRAM_MODE)
-        }
+        self.config, loaded_from_file = load_launcher_config()
         self.comfyui_dir_var.set(self.config.get("comfyui_dir"))
         self.python_exe_var.set(self.config.get("python_exe"))
         self.comfyui_api_port_var.set(self.config.get("comfyui_api_port"))
@@ -135,14 +1033,10 @@ class ConfigurableServiceRunnerApp:
         self.fp8_unet_var.set(self.config.get("fp8_unet"))
         self.fp8_textenc_var.set(self.config.get("fp8_textenc"))
         self.disable_cuda_malloc_var.set(self.config.get("disable_cuda_malloc"))
-        vram_mode = self.config.get("vram_mode")
-        valid_vram_modes = ["default", "high", "low"]
-        if vram_mode not in valid_vram_modes:
-            print(f"Warning: Invalid vram_mode '{vram_mode}' found in config. Resetting to 'default'.")
-            vram_mode = "default"
-            self.config["vram_mode"] = vram_mode
-        self.vram_mode_var.set(vram_mode)
-        if not os.path.exists(CONFIG_FILE) or not loaded_config:
+        self.warmup_enabled_var.set(self.config.get("warmup_enabled"))
+        self.vram_mode_var.set(self.config.get("vram_mode"))
+        self.preview_method_var.set(self.config.get("preview_method"))
+        if not os.path.exists(CONFIG_FILE) or not loaded_from_file:
             print("Attempting to save default configuration...")
             try: self.save_config_to_file(show_success=False)
             except Exception as e: print(f"Initial default config save failed: {e}")
@@ -160,7 +1054,9 @@ class ConfigurableServiceRunnerApp:
         self.config["fp8_unet"] = self.fp8_unet_var.get()
         self.config["fp8_textenc"] = self.fp8_textenc_var.get()
         self.config["disable_cuda_malloc"] = self.disable_cuda_malloc_var.get()
+        self.config["warmup_enabled"] = self.warmup_enabled_var.get()
         self.config["vram_mode"] = self.vram_mode_var.get()
+        self.config["preview_method"] = self.preview_method_var.get()
         port_valid = True
         try:
             port_num = int(self.config["comfyui_api_port"])
@@ -168,9 +1064,8 @@ class ConfigurableServiceRunnerApp:
         except ValueError:
             port_valid = False; messagebox.showerror("端口错误 / Invalid Port", "后端 API 端口号必须是 1-65535 之间的数字。", parent=self.root)
         if port_valid:
-             valid_vram_modes = ["default", "high", "low"]
              mode = self.config["vram_mode"]
-             if mode not in valid_vram_modes:
+             if mode not in VALID_VRAM_MODES:
                  messagebox.showwarning("设置警告 / Settings Warning", f"无效的 VRAM 优化模式 '{mode}'。将重置为 'default'。", parent=self.root)
                  self.config["vram_mode"] = "default"; self.vram_mode_var.set("default")
              self.save_config_to_file(show_success=True)
@@ -187,32 +1082,18 @@ class ConfigurableServiceRunnerApp:
             if self.root and self.root.winfo_exists(): messagebox.showerror("配置保存错误 / Config Save Error", f"无法将配置保存到文件：\n{e}", parent=self.root)
 
     def update_derived_paths(self):
-        """Updates internal path variables and base arguments based on current config."""
-        self.base_project_dir = os.path.dirname(os.path.abspath(__file__))
-        self.comfyui_install_dir = self.config.get("comfyui_dir", "")
-        self.comfyui_portable_python = self.config.get("python_exe", "")
-        self.venv_python_exe = os.path.join(self.base_project_dir, "venv", "Scripts", "python.exe")
-        self.app_script = os.path.join(self.base_project_dir, "app.py")
-        self.comfyui_main_script = os.path.join(self.comfyui_install_dir, "main.py") if self.comfyui_install_dir and os.path.isdir(self.comfyui_install_dir) else ""
-        self.flask_working_dir = self.base_project_dir
-        self.comfyui_api_port = self.config.get("comfyui_api_port", DEFAULT_COMFYUI_API_PORT)
-        fixed_flask_port_for_cors = "5000"
-        self.comfyui_base_args = [
-            "--listen", "127.0.0.1", f"--port={self.comfyui_api_port}",
-            f"--enable-cors-header=http://127.0.0.1:{fixed_flask_port_for_cors}",
-            f"--enable-cors-header=http://localhost:{fixed_flask_port_for_cors}"
-        ]
-        print(f"--- Paths Updated ---")
-        print(f" ComfyUI Port: {self.comfyui_api_port}")
-        print(f" ComfyUI Base Args: {self.comfyui_base_args}")
+        """Re-derives the service paths and arguments from the current config."""
+        self.services.update_derived_paths()
 
     def browse_directory(self, var_to_set):
         """Opens a directory selection dialog."""
+        from tkinter import filedialog
         directory = filedialog.askdirectory(title="选择目录 / Select Directory", parent=self.root)
         if directory: var_to_set.set(os.path.normpath(directory))
 
     def browse_file(self, var_to_set, filetypes):
         """Opens a file selection dialog."""
+        from tkinter import filedialog
         filepath = filedialog.askopenfilename(title="选择文件 / Select File", filetypes=filetypes, parent=self.root)
         if filepath: var_to_set.set(os.path.normpath(filepath))
 
@@ -250,7 +1131,7 @@ class ConfigurableServiceRunnerApp:
         # Top Control Frame
         control_frame = ttk.Frame(self.root, padding=(10, 10, 10, 5), style='Control.TFrame'); control_frame.grid(row=0, column=0, sticky="ew"); control_frame.columnconfigure(1, weight=1)
         self.status_label = ttk.Label(control_frame, text="状态: 未知", style='Status.TLabel', anchor=tk.W); self.status_label.grid(row=0, column=0, sticky="w", padx=(0, 10))
-        ttk.Label(control_frame, text="", style='Status.TLabel').grid(row=0, column=1, sticky="ew") # Spacer
+        self.resource_label = ttk.Label(control_frame, text="", style='Status.TLabel', anchor=tk.E, font=(FONT_FAMILY_MONO, FONT_SIZE_MONO)); self.resource_label.grid(row=0, column=1, sticky="ew") # Resource sparkline; also the spacer / 资源迷你图；同时作为间隔
         self.progress_bar = ttk.Progressbar(control_frame, mode='indeterminate', length=350, style='Horizontal.TProgressbar'); self.progress_bar.grid(row=0, column=2, padx=10); self.progress_bar.stop()
         self.stop_all_button = ttk.Button(control_frame, text="停止", command=self.stop_all_services, style="Stop.TButton", width=12); self.stop_all_button.grid(row=0, column=3, padx=(0, 5))
         self.run_all_button = ttk.Button(control_frame, text="运行", command=self.start_all_services_thread, style="Accent.TButton", width=12); self.run_all_button.grid(row=0, column=4, padx=(0, 0))
@@ -269,205 +1150,170 @@ class ConfigurableServiceRunnerApp:
         # Performance Group
         perf_group = ttk.LabelFrame(self.settings_frame, text=" 性能与显存优化 ", padding=(10, 5)); perf_group.grid(row=current_row, column=0, sticky="ew", padx=frame_padx, pady=frame_pady); perf_row = 0
         ttk.Label(perf_group, text="显存优化模式:", width=label_min_width, anchor=tk.W).grid(row=perf_row, column=0, sticky=tk.W, pady=widget_pady, padx=widget_padx); vram_mode_combo = ttk.Combobox(perf_group, textvariable=self.vram_mode_var, values=["default", "high", "low"], state="readonly", width=15); vram_mode_combo.grid(row=perf_row, column=1, sticky=tk.W, pady=widget_pady, padx=widget_padx); perf_row += 1
+        ttk.Label(perf_group, text="采样预览方式:", width=label_min_width, anchor=tk.W).grid(row=perf_row, column=0, sticky=tk.W, pady=widget_pady, padx=widget_padx); preview_method_combo = ttk.Combobox(perf_group, textvariable=self.preview_method_var, values=shared_config.VALID_PREVIEW_METHODS, state="readonly", width=15); preview_method_combo.grid(row=perf_row, column=1, sticky=tk.W, pady=widget_pady, padx=widget_padx); perf_row += 1
         fp16_vae_check = ttk.Checkbutton(perf_group, text="启用 VAE 半精度 (--fp16-vae)", variable=self.fp16_vae_var); fp16_vae_check.grid(row=perf_row, column=0, columnspan=3, sticky=tk.W, pady=widget_pady, padx=widget_padx); perf_row += 1
         fp8_unet_check = ttk.Checkbutton(perf_group, text="启用 UNet FP8 (实验性, 需新GPU)", variable=self.fp8_unet_var); fp8_unet_check.grid(row=perf_row, column=0, columnspan=3, sticky=tk.W, pady=widget_pady, padx=widget_padx); perf_row += 1
         fp8_textenc_check = ttk.Checkbutton(perf_group, text="启用 Text Encoder FP8 (实验性, 需新GPU)", variable=self.fp8_textenc_var); fp8_textenc_check.grid(row=perf_row, column=0, columnspan=3, sticky=tk.W, pady=widget_pady, padx=widget_padx); perf_row += 1
-        disable_cuda_check = ttk.Checkbutton(perf_group, text="禁用 CUDA 内存分配器 (调试)", variable=self.disable_cuda_malloc_var); disable_cuda_check.grid(row=perf_row, column=0, columnspan=3, sticky=tk.W, pady=widget_pady, padx=widget_padx); current_row += 1
+        disable_cuda_check = ttk.Checkbutton(perf_group, text="禁用 CUDA 内存分配器 (调试)", variable=self.disable_cuda_malloc_var); disable_cuda_check.grid(row=perf_row, column=0, columnspan=3, sticky=tk.W, pady=widget_pady, padx=widget_padx); perf_row += 1
+        warmup_check = ttk.Checkbutton(perf_group, text="启动后预热模型 (warmup_workflows)", variable=self.warmup_enabled_var); warmup_check.grid(row=perf_row, column=0, columnspan=3, sticky=tk.W, pady=widget_pady, padx=widget_padx); current_row += 1
         # Spacer and Bottom Row
         self.settings_frame.rowconfigure(current_row, weight=1); current_row += 1
         bottom_frame = ttk.Frame(self.settings_frame, style='Settings.TFrame'); bottom_frame.grid(row=current_row, column=0, sticky="sew", pady=(15, 0)); bottom_frame.columnconfigure(1, weight=1)
         save_btn = ttk.Button(bottom_frame, text="保存设置", style="TButton", command=self.save_settings); save_btn.grid(row=0, column=0, sticky="sw", padx=(frame_padx, 0))
         version_label = ttk.Label(bottom_frame, text=VERSION_INFO, style="Version.TLabel"); version_label.grid(row=0, column=2, sticky="se", padx=(0, frame_padx))
-        # Output Tabs
+        # Output Tabs (contents built by build_output_panels) / 输出标签页（内容由 build_output_panels 构建）
         self.app_frame = ttk.Frame(self.notebook, style='TFrame', padding=0); self.notebook.add(self.app_frame, text=' 前端_网页 / Frontend '); self.app_frame.columnconfigure(0, weight=1); self.app_frame.rowconfigure(1, weight=1)
+        self.main_frame = ttk.Frame(self.notebook, style='TFrame', padding=0); self.notebook.add(self.main_frame, text=' 后端_ComfyUI / Backend '); self.main_frame.columnconfigure(0, weight=1); self.main_frame.rowconfigure(1, weight=1)
+        self.notebook.select(self.settings_frame)
+
+    def build_output_panels(self):
+        """Builds the Frontend/Backend tab contents (service controls and output areas); output waits in the queues until then."""
         flask_control_frame = ttk.Frame(self.app_frame, style='TabControl.TFrame', padding=(5, 5)); flask_control_frame.grid(row=0, column=0, sticky="ew", pady=(0, 2))
         self.flask_run_button = ttk.Button(flask_control_frame, text="运行前端", style="TabAccent.TButton", command=self.start_flask_service_thread); self.flask_run_button.pack(side=tk.LEFT, padx=5)
         self.flask_stop_button = ttk.Button(flask_control_frame, text="停止前端", style="TabStop.TButton", command=self._stop_flask_service); self.flask_stop_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(flask_control_frame, text="错误日志 / Log Index", style="TabAccent.TButton", command=lambda: self.open_log_viewer("Flask")).pack(side=tk.RIGHT, padx=5)
         self.app_output_text = scrolledtext.ScrolledText(self.app_frame, wrap=tk.WORD, state=tk.DISABLED, font=(FONT_FAMILY_MONO, FONT_SIZE_MONO), bg=TEXT_AREA_BG, fg=FG_STDOUT, relief=tk.FLAT, borderwidth=1, bd=1, highlightthickness=1, highlightbackground=BORDER_COLOR, insertbackground="white"); self.app_output_text.grid(row=1, column=0, sticky="nsew", padx=1, pady=1); self.setup_text_tags(self.app_output_text)
-        self.main_frame = ttk.Frame(self.notebook, style='TFrame', padding=0); self.notebook.add(self.main_frame, text=' 后端_ComfyUI / Backend '); self.main_frame.columnconfigure(0, weight=1); self.main_frame.rowconfigure(1, weight=1)
         comfy_control_frame = ttk.Frame(self.main_frame, style='TabControl.TFrame', padding=(5, 5)); comfy_control_frame.grid(row=0, column=0, sticky="ew", pady=(0, 2))
         self.comfy_run_button = ttk.Button(comfy_control_frame, text="运行后端", style="TabAccent.TButton", command=self.start_comfyui_service_thread); self.comfy_run_button.pack(side=tk.LEFT, padx=5)
         self.comfy_stop_button = ttk.Button(comfy_control_frame, text="停止后端", style="TabStop.TButton", command=self._stop_comfyui_service); self.comfy_stop_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(comfy_control_frame, text="错误日志 / Log Index", style="TabAccent.TButton", command=lambda: self.open_log_viewer("ComfyUI")).pack(side=tk.RIGHT, padx=5)
         self.main_output_text = scrolledtext.ScrolledText(self.main_frame, wrap=tk.WORD, state=tk.DISABLED, font=(FONT_FAMILY_MONO, FONT_SIZE_MONO), bg=TEXT_AREA_BG, fg=FG_STDOUT, relief=tk.FLAT, borderwidth=1, bd=1, highlightthickness=1, highlightbackground=BORDER_COLOR, insertbackground="white"); self.main_output_text.grid(row=1, column=0, sticky="nsew", padx=1, pady=1); self.setup_text_tags(self.main_output_text)
-        self.notebook.select(self.settings_frame)
 
     # --- Text/Output Methods ---
     def setup_text_tags(self, text_widget): text_widget.tag_config("stdout", foreground=FG_STDOUT); text_widget.tag_config("stderr", foreground=FG_STDERR); text_widget.tag_config("info", foreground=FG_INFO, font=(FONT_FAMILY_MONO, FONT_SIZE_MONO, 'italic')); text_widget.tag_config("warn", foreground="#ffd700")
-    def insert_output(self, text_widget, line, source_tag="stdout"):
-        if not text_widget or not text_widget.winfo_exists(): return
-        text_widget.config(state=tk.NORMAL); tag = "stdout"
-        if "[Launcher]" in source_tag: tag = "info"
-        elif "ERR" in source_tag.upper() or "ERROR" in line.upper() or "Traceback" in line or "Failed" in line: tag = "stderr"
-        elif "WARN" in source_tag.upper() or "WARNING" in line.upper(): tag = "warn"
-        text_widget.insert(tk.END, line, (tag,));
-        if text_widget.yview()[1] > 0.95: text_widget.see(tk.END)
+    def classify_output_line(self, line, source_tag):
+        """Returns the text tag for a line: info, stderr, warn or stdout."""
+        if source_tag == "[Launcher INFO]": return "info"
+        if "ERR" in source_tag.upper() or "ERROR" in line.upper() or "Traceback" in line or "Failed" in line: return "stderr"
+        if "WARN" in source_tag.upper() or "WARNING" in line.upper(): return "warn"
+        return "stdout"
+    def render_output_batch(self, text_widget, items):
+        """Inserts (source, line) items as one block per tag run, coalesces carriage-return progress lines and caps the widget."""
+        if not items or not text_widget or not text_widget.winfo_exists(): return
+        max_lines = self._log_max_lines(); widget_key = str(text_widget)
+        pending = []; replace_tail = False
+        for source, line in items[-max_lines:]: # Older lines would be trimmed anyway / 更早的行反正会被裁掉
+            line = line.replace("\r\n", "\n"); is_progress = "\r" in line
+            if is_progress:
+                # tqdm redraws with \r; only the latest frame is worth showing / tqdm 用 \r 重绘，仅显示最新一帧
+                segments = [seg for seg in line.rstrip("\n").split("\r") if seg.strip()]; line = (segments[-1] if segments else "") + "\n"
+            tag = self.classify_output_line(line, source)
+            if is_progress and pending and pending[-1][2]: pending[-1] = (tag, line, True); continue
+            if is_progress and not pending and self.progress_tail.get(widget_key): replace_tail = True
+            pending.append((tag, line, is_progress))
+        insert_args = []
+        for tag, line, _ in pending:
+            if insert_args and insert_args[-1] == (tag,): insert_args[-2] += line
+            else: insert_args.extend([line, (tag,)])
+        follow = text_widget.yview()[1] > 0.95
+        text_widget.config(state=tk.NORMAL)
+        if replace_tail: text_widget.delete("end-2c linestart", "end-1c")
+        text_widget.insert(tk.END, *insert_args)
+        excess = int(text_widget.index("end-1c").split(".")[0]) - 1 - max_lines
+        if excess > 0: text_widget.delete("1.0", f"{excess + 1}.0")
         text_widget.config(state=tk.DISABLED)
-    def log_to_gui(self, target, message, tag="info"): queue = self.comfyui_output_queue if target == "ComfyUI" else self.flask_output_queue; queue.put((f"[Launcher {tag.upper()}]", message))
-    def process_output_queues(self):
-        processed_comfy = 0; processed_flask = 0; max_lines = 50
+        if follow: text_widget.see(tk.END)
+        self.progress_tail[widget_key] = pending[-1][2]
+    def _log_max_lines(self):
+        try: return max(100, int(self.config.get("log_max_lines", DEFAULT_LOG_MAX_LINES)))
+        except (TypeError, ValueError): return DEFAULT_LOG_MAX_LINES
+    def log_to_gui(self, target, message, tag="info"): self.services.log("ComfyUI" if target == "ComfyUI" else "Flask", message, tag)
+    def drain_output_queue(self, output_queue):
+        """Takes everything queued so far without blocking; lines arriving meanwhile wait for the next tick."""
+        items = []
         try:
-            while not self.comfyui_output_queue.empty() and processed_comfy < max_lines:
-                source, line = self.comfyui_output_queue.get_nowait()
-                if line.strip() == _COMFYUI_READY_MARKER_.strip(): self._trigger_backend_browser_opening()
-                else: self.insert_output(self.main_output_text, line, source)
-                processed_comfy += 1
+            for _ in range(output_queue.qsize()): items.append(output_queue.get_nowait())
         except queue.Empty: pass
-        except Exception as e: print(f"Error processing ComfyUI queue: {e}")
+        return items
+    def process_output_queues(self):
         try:
-            while not self.flask_output_queue.empty() and processed_flask < max_lines:
-                source, line = self.flask_output_queue.get_nowait()
-                self.insert_output(self.app_output_text, line, source)
-                processed_flask += 1
-        except queue.Empty: pass
+            comfy_items = self.drain_output_queue(self.comfyui_output_queue)
+            if any(line.strip() == _COMFYUI_READY_MARKER_.strip() for _, line in comfy_items): self._trigger_backend_browser_opening()
+            self.render_output_batch(self.main_output_text, [item for item in comfy_items if item[1].strip() != _COMFYUI_READY_MARKER_.strip()])
+        except Exception as e: print(f"Error processing ComfyUI queue: {e}")
+        try: self.render_output_batch(self.app_output_text, self.drain_output_queue(self.flask_output_queue))
         except Exception as e: print(f"Error processing Flask queue: {e}")
         self.root.after(UPDATE_INTERVAL_MS, self.process_output_queues)
 
-    def stream_output(self, process_stream, output_queue, stream_name):
-        marker_sent = False; api_port = self.config.get("comfyui_api_port", DEFAULT_COMFYUI_API_PORT)
-        ready_str1 = f"Set up connection listening on: ::{api_port}"; ready_str2 = f"To see the GUI go to: http://127.0.0.1:{api_port}"
-        try:
-            for line_bytes in iter(process_stream.readline, b''):
-                if self.stop_event.is_set(): break
-                line = line_bytes.decode('utf-8', errors='replace')
-                if line:
-                    output_queue.put((stream_name, line))
-                    if stream_name == "[ComfyUI]" and not marker_sent and (ready_str1 in line or ready_str2 in line):
-                        print(f"DEBUG STREAM: Found ComfyUI ready string. Queuing marker."); output_queue.put((stream_name, _COMFYUI_READY_MARKER_)); marker_sent = True; self.comfyui_ready_marker_sent = True
-        except ValueError: print(f"{stream_name} stream closed (ValueError).")
-        except Exception as e: print(f"Error reading {stream_name}: {e}")
-        finally:
-            print(f"{stream_name} stream reader thread finished.")
-            try: process_stream.close()
-            except Exception: pass
+    def open_log_viewer(self, service):
+        """Lists indexed errors/warnings of a service log with level/text filters; selecting one shows its surrounding lines read from disk."""
+        writer = self.services.log_writers[service]; shown = []
+        win = tk.Toplevel(self.root); win.title(f"{service} 日志索引 / Log Index - {writer.path}"); win.geometry("900x600"); win.configure(bg=BG_COLOR); win.columnconfigure(0, weight=1); win.rowconfigure(1, weight=1); win.rowconfigure(2, weight=2)
+        bar = ttk.Frame(win, style='TabControl.TFrame', padding=(5, 5)); bar.grid(row=0, column=0, sticky="ew")
+        level_var = tk.StringVar(value="all"); filter_var = tk.StringVar()
+        level_combo = ttk.Combobox(bar, textvariable=level_var, values=["all", "error", "warning"], state="readonly", width=10); level_combo.pack(side=tk.LEFT, padx=5)
+        filter_entry = ttk.Entry(bar, textvariable=filter_var, width=40); filter_entry.pack(side=tk.LEFT, padx=5)
+        count_label = ttk.Label(bar, text="", style='Status.TLabel'); count_label.pack(side=tk.RIGHT, padx=5)
+        entry_list = tk.Listbox(win, bg=TEXT_AREA_BG, fg=FG_STDOUT, font=(FONT_FAMILY_MONO, FONT_SIZE_MONO), selectbackground=ACCENT_ACTIVE, activestyle='none', relief=tk.FLAT, highlightthickness=1, highlightbackground=BORDER_COLOR); entry_list.grid(row=1, column=0, sticky="nsew", padx=1, pady=1)
+        context_text = scrolledtext.ScrolledText(win, wrap=tk.NONE, state=tk.DISABLED, font=(FONT_FAMILY_MONO, FONT_SIZE_MONO), bg=TEXT_AREA_BG, fg=FG_STDOUT, relief=tk.FLAT, highlightthickness=1, highlightbackground=BORDER_COLOR); context_text.grid(row=2, column=0, sticky="nsew", padx=1, pady=1); self.setup_text_tags(context_text)
+        def refresh(_event=None):
+            shown[:] = writer.entries(level=None if level_var.get() == "all" else level_var.get(), text_filter=filter_var.get().strip() or None)
+            entry_list.delete(0, tk.END)
+            for i, (_, _, level, preview) in enumerate(shown):
+                entry_list.insert(tk.END, f"[{level.upper():7}] {preview}"); entry_list.itemconfig(i, fg=FG_STDERR if level == "error" else "#ffd700")
+            entry_list.see(tk.END); count_label.config(text=f"{len(shown)} 条 / entries")
+        def show_context(_event=None):
+            selection = entry_list.curselection()
+            if not selection: return
+            context = writer.read_context(shown[selection[0]])
+            context_text.config(state=tk.NORMAL); context_text.delete('1.0', tk.END)
+            if context is None: context_text.insert(tk.END, "日志文件已被轮转删除 / Log file was rotated away\n", ("warn",))
+            else:
+                before, after = context
+                if before: context_text.insert(tk.END, "\n".join(before) + "\n", ("stdout",))
+                target_line = int(context_text.index("end-1c").split(".")[0])
+                if after: context_text.insert(tk.END, after[0] + "\n", ("stderr",)); context_text.insert(tk.END, "\n".join(after[1:]) + "\n", ("stdout",))
+                context_text.see(f"{target_line}.0")
+            context_text.config(state=tk.DISABLED)
+        level_combo.bind("<<ComboboxSelected>>", refresh); filter_entry.bind("<Return>", refresh); entry_list.bind("<<ListboxSelect>>", show_context)
+        ttk.Button(bar, text="刷新 / Refresh", style="TabAccent.TButton", command=refresh).pack(side=tk.LEFT, padx=5)
+        refresh()
 
     # --- Service Management ---
-    def _is_comfyui_running(self): return self.comfyui_process and self.comfyui_process.poll() is None
-    def _is_flask_running(self): return self.flask_process and self.flask_process.poll() is None
+    def _on_service_output(self, service, source, line): (self.comfyui_output_queue if service == "ComfyUI" else self.flask_output_queue).put((source, line))
+    def _on_service_event(self, event, service):
+        if event == "output_ready_marker": self.comfyui_output_queue.put((f"[{service}]", _COMFYUI_READY_MARKER_)) # Browser opens from the GUI thread / 在 GUI 线程中打开浏览器
+        elif event == "ready" and service == "Flask": self.root.after(0, self._open_frontend_browser)
+        elif event == "crash_loop": self.root.after(0, lambda: messagebox.showwarning("崩溃循环 / Crash Loop", f"{service} 反复崩溃，已停止自动重启。\n{service} keeps crashing; auto-restart was disabled.\n请查看错误日志 / See the Log Index.", parent=self.root))
+        elif event in ("state_changed", "crashed"): self.root.after(0, self._update_ui_state)
+    def _launch_options(self): return {"fp16_vae": self.fp16_vae_var.get(), "fp8_unet": self.fp8_unet_var.get(), "fp8_textenc": self.fp8_textenc_var.get(), "disable_cuda_malloc": self.disable_cuda_malloc_var.get(), "vram_mode": self.vram_mode_var.get(), "preview_method": self.preview_method_var.get()}
+    def _report_start_failure(self, service, title, prefix):
+        error = self.services.last_error.get(service)
+        if error: self.root.after(0, lambda: messagebox.showerror(title, f"{prefix}:\n{error}", parent=self.root)); self.root.after(0, self.reset_ui_on_error)
+    def _is_comfyui_running(self): return self.services.is_running("ComfyUI")
+    def _is_flask_running(self): return self.services.is_running("Flask")
     def _validate_paths_for_execution(self, check_comfyui=True, check_flask=True, show_error=True):
-        paths_ok = True; missing = []
-        if check_comfyui:
-            if not self.comfyui_portable_python or not os.path.isfile(self.comfyui_portable_python): missing.append(f"后端 Python"); paths_ok = False
-            if not self.comfyui_main_script or not os.path.isfile(self.comfyui_main_script): missing.append(f"后端主脚本"); paths_ok = False
-            if not self.comfyui_install_dir or not os.path.isdir(self.comfyui_install_dir): missing.append(f"后端 ComfyUI 目录"); paths_ok = False
-        if check_flask:
-            if not self.venv_python_exe or not os.path.isfile(self.venv_python_exe): missing.append(f"前端 Venv Python"); paths_ok = False
-            if not self.app_script or not os.path.isfile(self.app_script): missing.append(f"前端 App 脚本"); paths_ok = False
-        if not paths_ok and show_error: messagebox.showerror("路径错误", "缺少以下文件或目录：\n" + "\n".join(missing) + "\n\n请检查设置。", parent=self.root)
-        return paths_ok
+        missing = self.services.missing_paths(check_comfyui=check_comfyui, check_flask=check_flask)
+        if missing and show_error: messagebox.showerror("路径错误", "缺少以下文件或目录：\n" + "\n".join(missing) + "\n\n请检查设置。", parent=self.root)
+        return not missing
 
-    def start_comfyui_service_thread(self):
+    def start_comfyui_service_thread(self, on_ready=None):
         if self._is_comfyui_running(): self.log_to_gui("ComfyUI", "后端已在运行", "warn"); return
         # No need to validate flask paths here / 此处无需验证 flask 路径
         if not self._validate_paths_for_execution(check_comfyui=True, check_flask=False): return
-        self.stop_event.clear()
-        # Reset external detection flag on new start attempt / 在新的启动尝试中重置外部检测标志
-        self.comfyui_externally_detected = False
         if hasattr(self, 'comfy_run_button'): self.comfy_run_button.config(state=tk.DISABLED)
         self.progress_bar.start(10); self.status_label.config(text="状态: 启动后端..."); self.notebook.select(self.main_frame)
-        thread = threading.Thread(target=self._start_comfyui_service, daemon=True); thread.start()
+        def run_comfyui():
+            self._start_comfyui_service()
+            if on_ready: self.root.after(0, on_ready) # Caller re-checks service state / 调用方自行复查服务状态
+        thread = threading.Thread(target=run_comfyui, daemon=True); thread.start()
 
-    # --- MODIFIED: Added port check before launching ---
-    # --- 修改：在启动前添加端口检查 ---
     def _start_comfyui_service(self):
-        if self._is_comfyui_running(): return # Already managed by this launcher / 已由此启动器管理
-
-        # --- Check if ComfyUI API is already running on the configured port ---
-        # --- 检查 ComfyUI API 是否已在配置的端口上运行 ---
-        port_to_check = int(self.config.get("comfyui_api_port", DEFAULT_COMFYUI_API_PORT))
-        check_url = f"http://127.0.0.1:{port_to_check}/queue" # Use a lightweight endpoint / 使用轻量级端点
-        is_already_running = False
-        try:
-            print(f"Checking if ComfyUI is running on {check_url} before launch...")
-            response = requests.get(check_url, timeout=2) # Short timeout / 短超时
-            if response.status_code == 200:
-                is_already_running = True
-                self.log_to_gui("ComfyUI", f"检测到 ComfyUI 已在端口 {port_to_check} 运行，跳过启动。", "info")
-                print(f"ComfyUI detected running on port {port_to_check}. Skipping launch.")
-                self.comfyui_externally_detected = True # Set the flag / 设置标志
-                # Update UI immediately to reflect this state / 立即更新 UI 以反映此状态
-                self.root.after(0, self._update_ui_state)
-                # Explicitly set comfyui_process to None as we are not managing it
-                # 显式将 comfyui_process 设置为 None，因为我们不管理它
-                self.comfyui_process = None
-                return # Exit the function, do not proceed with Popen / 退出函数，不继续执行 Popen
-            else:
-                # Received a response, but not 200 OK (unexpected) / 收到响应，但不是 200 OK（意外）
-                 print(f"Port check received unexpected status {response.status_code}. Proceeding with launch.")
-        except requests.exceptions.Timeout:
-            print(f"Port check timed out. Port {port_to_check} likely free. Proceeding with launch.")
-            # Port is likely free / 端口可能空闲
-            pass
-        except requests.exceptions.ConnectionError:
-            print(f"Port check connection refused. Port {port_to_check} likely free. Proceeding with launch.")
-            # Port is likely free / 端口可能空闲
-            pass
-        except Exception as e:
-            print(f"Port check failed unexpectedly: {e}. Proceeding with launch.")
-            # Other errors, proceed cautiously / 其他错误，谨慎进行
-            pass
-        # --- End Port Check ---
-
-        # If we reached here, the port check did not detect a running ComfyUI
-        # 如果我们到达这里，端口检查未检测到正在运行的 ComfyUI
-        self.backend_browser_triggered_for_session = False
-        self.comfyui_ready_marker_sent = False
-        self.comfyui_externally_detected = False # Ensure flag is false if we launch / 确保如果我们启动，标志为 false
-
-        try:
-            self.log_to_gui("ComfyUI", f"启动 Backend_ComfyUI 于 {self.comfyui_install_dir}...")
-            base_cmd = [self.comfyui_portable_python, "-s", "-u", self.comfyui_main_script]; current_args = list(self.comfyui_base_args)
-            if self.fp16_vae_var.get(): current_args.append("--fp16-vae")
-            if self.fp8_unet_var.get(): current_args.append("--fp8_e4m3fn-unet")
-            if self.fp8_textenc_var.get(): current_args.append("--fp8_e4m3fn-text-enc")
-            if self.disable_cuda_malloc_var.get(): current_args.append("--disable-cuda-malloc")
-            vram_mode = self.vram_mode_var.get()
-            if vram_mode == "high": current_args.append("--highvram")
-            elif vram_mode == "low": current_args.append("--lowvram")
-            comfyui_cmd_list = base_cmd + current_args
-            self.log_to_gui("ComfyUI", f"最终参数: {' '.join(current_args)}")
-            self.log_to_gui("ComfyUI", f"完整命令: {' '.join(comfyui_cmd_list)}")
-            creationflags = 0; startupinfo = None
-            if os.name == 'nt': creationflags = subprocess.CREATE_NO_WINDOW
-            self.comfyui_process = subprocess.Popen(comfyui_cmd_list, cwd=self.comfyui_install_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0, creationflags=creationflags, startupinfo=startupinfo)
-            self.log_to_gui("ComfyUI", f"Backend PID: {self.comfyui_process.pid}")
-            self.comfyui_reader_thread_stdout = threading.Thread(target=self.stream_output, args=(self.comfyui_process.stdout, self.comfyui_output_queue, "[ComfyUI]"), daemon=True); self.comfyui_reader_thread_stdout.start()
-            self.comfyui_reader_thread_stderr = threading.Thread(target=self.stream_output, args=(self.comfyui_process.stderr, self.comfyui_output_queue, "[ComfyUI ERR]"), daemon=True); self.comfyui_reader_thread_stderr.start()
-            time.sleep(2) # Give process time to potentially fail early / 给进程时间可能提前失败
-            if not self._is_comfyui_running():
-                # Check again if it failed immediately / 再次检查是否立即失败
-                exit_code = self.comfyui_process.poll() if self.comfyui_process else 'N/A'
-                # Check if the reason might be port conflict (common issue) / 检查原因是否可能是端口冲突（常见问题）
-                error_reason = f"后端进程意外终止，代码 {exit_code}。"
-                if port_to_check and exit_code: # Simplified check for common exit codes on port conflict / 简化对端口冲突常见退出代码的检查
-                     error_reason += f"\n可能原因：端口 {port_to_check} 已被占用？\nPossible reason: Port {port_to_check} already in use?"
-                raise Exception(error_reason)
-            self.log_to_gui("ComfyUI", "后端服务已启动"); self.root.after(0, self._update_ui_state)
-        except Exception as e:
-            error_msg = f"启动 Backend 失败: {e}"
-            print(error_msg)
-            self.log_to_gui("ComfyUI", error_msg, "stderr")
-            # Schedule error message display / 安排错误消息显示
-            self.root.after(0, lambda msg=str(e): messagebox.showerror("后端错误", f"启动 Backend 失败:\n{msg}", parent=self.root))
-            self.comfyui_process = None # Ensure process is None on failure / 确保失败时进程为 None
-            self.root.after(0, self.reset_ui_on_error) # Reset UI state / 重置 UI 状态
-
+        """Starts ComfyUI via the service core (blocking until ready) and reports failures in the UI."""
+        self.backend_browser_triggered_for_session = False; self.services.reset_crash_loop("ComfyUI") # Manual start re-arms supervision / 手动启动重新启用监督
+        ready = self.services.start_comfyui(self._launch_options())
+        if not ready: self._report_start_failure("ComfyUI", "后端错误", "启动 Backend 失败")
+        return ready
 
     def _stop_comfyui_service(self):
-        # Reset external detection flag when stopping / 停止时重置外部检测标志
-        self.comfyui_externally_detected = False
         if not self._is_comfyui_running():
+            self.services.stop_service("ComfyUI") # Resets external detection and cancels a pending auto-restart / 重置外部检测并取消待定的自动重启
             self.log_to_gui("ComfyUI", "后端未由此启动器管理或未运行", "warn")
             self._update_ui_state()
             return
-        self.log_to_gui("ComfyUI", "停止 Backend_ComfyUI...")
         if hasattr(self, 'comfy_stop_button'): self.comfy_stop_button.config(state=tk.DISABLED)
         self.status_label.config(text="状态: 停止后端..."); self.progress_bar.start(10)
-        try:
-            self.stop_event.set(); time.sleep(0.1); self.comfyui_process.terminate()
-            try: self.comfyui_process.wait(timeout=3); self.log_to_gui("ComfyUI", "后端已终止")
-            except subprocess.TimeoutExpired: print("Killing ComfyUI"); self.log_to_gui("ComfyUI", "强制终止后端...", "warn"); self.comfyui_process.kill(); self.log_to_gui("ComfyUI", "后端已强制终止")
-        except Exception as e: error_msg = f"停止后端出错: {e}"; print(error_msg); self.log_to_gui("ComfyUI", error_msg, "stderr")
-        finally: self.comfyui_process = None; self.stop_event.clear(); self.backend_browser_triggered_for_session = False; self.comfyui_ready_marker_sent = False; self.root.after(0, self._update_ui_state)
+        self.services.stop_service("ComfyUI"); self.backend_browser_triggered_for_session = False; self.root.after(0, self._update_ui_state)
 
     def start_flask_service_thread(self):
         if self._is_flask_running(): self.log_to_gui("Flask", "前端已在运行", "warn"); return
@@ -476,13 +1322,12 @@ class ConfigurableServiceRunnerApp:
         # --- MODIFIED: Check external ComfyUI state as well ---
         # --- 修改：同时检查外部 ComfyUI 状态 ---
         comfy_running_internally = self._is_comfyui_running()
-        comfy_detected_externally = self.comfyui_externally_detected
+        comfy_detected_externally = self.services.comfyui_externally_detected
 
         if not comfy_running_internally and not comfy_detected_externally:
             self.log_to_gui("Flask", "后端未运行，尝试启动...")
-            self.start_comfyui_service_thread() # This now handles external detection / 现在处理外部检测
-            self.log_to_gui("Flask", "等待后端就绪(10s)...")
-            self.root.after(10000, self._proceed_with_flask_start)
+            self.log_to_gui("Flask", "等待后端就绪...")
+            self.start_comfyui_service_thread(on_ready=self._proceed_with_flask_start) # This now handles external detection / 现在处理外部检测
         else:
              if comfy_detected_externally:
                  self.log_to_gui("Flask", "检测到外部 ComfyUI，尝试启动前端...")
@@ -493,7 +1338,7 @@ class ConfigurableServiceRunnerApp:
     def _proceed_with_flask_start(self):
         # --- MODIFIED: Check external ComfyUI state again ---
         # --- 修改：再次检查外部 ComfyUI 状态 ---
-        if not self._is_comfyui_running() and not self.comfyui_externally_detected:
+        if not self.services.comfyui_available():
              self.log_to_gui("Flask", "无法启动或检测到后端服务，前端中止", "stderr")
              messagebox.showerror("依赖错误 / Dependency Error", "无法启动或检测到 ComfyUI 后端服务，前端无法启动。\nCould not start or detect ComfyUI backend service, frontend cannot start.", parent=self.root)
              self.root.after(0, self._update_ui_state)
@@ -507,40 +1352,21 @@ class ConfigurableServiceRunnerApp:
         thread.start()
 
     def _start_flask_service(self):
-        if self._is_flask_running(): return
-        try:
-            self.log_to_gui("Flask", f"启动 Frontend_Web 于 {self.flask_working_dir}...")
-            flask_cmd_list = [self.venv_python_exe, "-u", self.app_script]
-            self.log_to_gui("Flask", f"命令: {' '.join(flask_cmd_list)}")
-            creationflags = 0; startupinfo = None
-            if os.name == 'nt': creationflags = subprocess.CREATE_NO_WINDOW
-            flask_env = os.environ.copy()
-            flask_env['COMFYUI_HOST'] = "127.0.0.1" # Flask connects to localhost
-            flask_env['COMFYUI_API_PORT'] = self.comfyui_api_port
-            self.flask_process = subprocess.Popen( flask_cmd_list, cwd=self.flask_working_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0, creationflags=creationflags, startupinfo=startupinfo, env=flask_env )
-            self.log_to_gui("Flask", f"Frontend PID: {self.flask_process.pid}")
-            self.flask_reader_thread_stdout = threading.Thread(target=self.stream_output, args=(self.flask_process.stdout, self.flask_output_queue, "[Flask]"), daemon=True); self.flask_reader_thread_stdout.start()
-            self.flask_reader_thread_stderr = threading.Thread(target=self.stream_output, args=(self.flask_process.stderr, self.flask_output_queue, "[Flask ERR]"), daemon=True); self.flask_reader_thread_stderr.start()
-            time.sleep(2)
-            if not self._is_flask_running(): exit_code = self.flask_process.poll() if self.flask_process else 'N/A'; raise Exception(f"前端进程意外终止，代码 {exit_code}。")
-            self.log_to_gui("Flask", "前端服务已启动"); self.root.after(1000, self._open_frontend_browser); self.root.after(0, self._update_ui_state)
-        except Exception as e: error_msg = f"启动 Frontend 失败: {e}"; print(error_msg); self.log_to_gui("Flask", error_msg, "stderr"); self.root.after(0, lambda: messagebox.showerror("前端错误", error_msg, parent=self.root)); self.flask_process = None; self.root.after(0, self.reset_ui_on_error)
+        """Starts Flask via the service core (blocking until it answers HTTP) and reports failures in the UI."""
+        self.services.reset_crash_loop("Flask")
+        ready = self.services.start_flask()
+        if not ready: self._report_start_failure("Flask", "前端错误", "启动 Frontend 失败")
+        return ready
 
     def _stop_flask_service(self):
-        if not self._is_flask_running(): self.log_to_gui("Flask", "前端未运行", "warn"); self._update_ui_state(); return
-        self.log_to_gui("Flask", "停止 Frontend_Web...")
+        if not self._is_flask_running(): self.services.stop_service("Flask"); self.log_to_gui("Flask", "前端未运行", "warn"); self._update_ui_state(); return
         if hasattr(self, 'flask_stop_button'): self.flask_stop_button.config(state=tk.DISABLED)
         self.status_label.config(text="状态: 停止前端..."); self.progress_bar.start(10)
-        try:
-            self.stop_event.set(); time.sleep(0.1); self.flask_process.terminate()
-            try: self.flask_process.wait(timeout=2); self.log_to_gui("Flask", "前端已终止")
-            except subprocess.TimeoutExpired: print("Killing Flask"); self.log_to_gui("Flask", "强制终止前端...", "warn"); self.flask_process.kill(); self.log_to_gui("Flask", "前端已强制终止")
-        except Exception as e: error_msg = f"停止前端出错: {e}"; print(error_msg); self.log_to_gui("Flask", error_msg, "stderr")
-        finally: self.flask_process = None; self.stop_event.clear(); self.root.after(0, self._update_ui_state)
+        self.services.stop_service("Flask"); self.root.after(0, self._update_ui_state)
 
     def start_all_services_thread(self):
         # Check external state as well / 同时检查外部状态
-        if (self._is_comfyui_running() or self.comfyui_externally_detected) and self._is_flask_running():
+        if self.services.comfyui_available() and self._is_flask_running():
             messagebox.showinfo("服务已运行", "所有必需的服务已在运行或已被检测到。", parent=self.root); return
         # Validation needs to check ComfyUI paths even if starting externally detected / 即使启动外部检测到的 ComfyUI，验证也需要检查其路径
         if not self._validate_paths_for_execution(check_comfyui=True, check_flask=True): return
@@ -549,55 +1375,20 @@ class ConfigurableServiceRunnerApp:
         thread = threading.Thread(target=self._run_all_services, daemon=True); thread.start()
 
     def _run_all_services(self):
-        comfy_started = False # Tracks if ComfyUI is running (internally or externally) / 跟踪 ComfyUI 是否正在运行（内部或外部）
-        flask_started = False
-
-        # --- Start/Check ComfyUI Section ---
-        if not self._is_comfyui_running() and not self.comfyui_externally_detected:
-            self._start_comfyui_service() # This now includes the external check / 现在包括外部检查
-            # If external was detected inside _start_..., comfyui_externally_detected will be True
-            # 如果在 _start_... 内部检测到外部，comfyui_externally_detected 将为 True
-            if self.comfyui_externally_detected:
-                comfy_started = True # Mark as started (externally) / 标记为已启动（外部）
-            else:
-                # If not external, wait and check if internal process started
-                # 如果不是外部的，等待并检查内部进程是否已启动
-                time.sleep(10)
-                if self._is_comfyui_running():
-                    comfy_started = True
-                else:
-                    self.log_to_gui("ComfyUI", "启动后端失败，中止启动", "stderr")
-                    self.root.after(0, self.reset_ui_on_error)
-                    return
-        else:
-             # Already running (internally or externally detected before clicking 'Run All')
-             # 已在运行（内部或在点击“全部运行”之前检测到外部）
-            self.log_to_gui("ComfyUI", "后端已运行或已被检测到，跳过")
-            comfy_started = True
-
-        # --- Start Flask Section ---
-        if comfy_started and not self._is_flask_running():
-            self._start_flask_service()
-            time.sleep(3)
-            if self._is_flask_running():
-                flask_started = True
-            else:
-                self.log_to_gui("Flask", "启动前端失败", "stderr")
-                self.root.after(0, self.reset_ui_on_error)
-                return
-        elif comfy_started and self._is_flask_running():
-            self.log_to_gui("Flask", "前端已运行，跳过")
-            flask_started = True
-
-        self.root.after(0, self._update_ui_state)
+        if not self.services.comfyui_available(): self.backend_browser_triggered_for_session = False
+        if self.services.start_all(self._launch_options()):
+            self.root.after(0, self._update_ui_state)
+            return
+        self._report_start_failure("ComfyUI", "后端错误", "启动 Backend 失败"); self._report_start_failure("Flask", "前端错误", "启动 Frontend 失败")
+        self.root.after(0, self.reset_ui_on_error)
 
     def stop_all_services(self):
         """Stops both ComfyUI and Flask services if they are running."""
         # Check external detection too - we cannot stop external process
         # 同时检查外部检测 - 我们无法停止外部进程
-        if not self._is_comfyui_running() and not self._is_flask_running() and not self.comfyui_externally_detected:
+        if not self._is_comfyui_running() and not self._is_flask_running() and not self.services.comfyui_externally_detected:
             print("Stop all: No processes active or detected.")
-            self._update_ui_state(); return
+            self.services.stop_all(); self._update_ui_state(); return # Still cancels pending auto-restarts / 仍取消待定的自动重启
 
         self.log_to_gui("Launcher", "停止所有服务...", "info")
         self.status_label.config(text="状态: 停止所有服务...")
@@ -607,17 +1398,23 @@ class ConfigurableServiceRunnerApp:
         if hasattr(self, 'comfy_stop_button'): self.comfy_stop_button.config(state=tk.DISABLED)
         if hasattr(self, 'flask_stop_button'): self.flask_stop_button.config(state=tk.DISABLED)
 
-        if self._is_flask_running(): self._stop_flask_service()
-        # Only stop ComfyUI if we are managing it (not external)
-        # 仅当我们管理 ComfyUI 时才停止它（非外部）
-        if self._is_comfyui_running(): self._stop_comfyui_service()
-        else:
-            # If only external was detected, just reset the flag
-            # 如果仅检测到外部，则仅重置标志
-            self.comfyui_externally_detected = False
+        # Only stops ComfyUI if we are managing it (not external) / 仅当我们管理 ComfyUI 时才停止它（非外部）
+        self.services.stop_all(); self.backend_browser_triggered_for_session = False
 
         self.root.after(1000, self._update_ui_state)
 
+    def update_resource_display(self):
+        """Refreshes the compact CPU/RSS sparkline in the control bar."""
+        monitor = self.services.monitor; parts = []
+        if monitor.available:
+            for service in ServiceManager.SERVICES:
+                latest = monitor.latest(service)
+                if latest: parts.append(f"{service} CPU {latest['cpu']:.0f}% RSS {latest['rss_mb'] / 1024:.1f}G T{latest['threads']} {sparkline(monitor.series(service, 'rss_mb', 20))}")
+        try:
+            if self.resource_label.winfo_exists(): self.resource_label.config(text="  |  ".join(parts), foreground=FG_STDERR if any(monitor.alerting.values()) else FG_MUTED)
+        except tk.TclError: pass
+        self.root.after(int(monitor.interval * 1000), self.update_resource_display)
+
     # --- UI State and Helpers ---
     # --- MODIFIED: Added check for comfyui_externally_detected ---
     # --- 修改：添加了对 comfyui_externally_detected 的检查 ---
@@ -625,13 +1422,13 @@ class ConfigurableServiceRunnerApp:
         """Central function to update all button states and status label."""
         comfy_running_internally = self._is_comfyui_running()
         flask_running = self._is_flask_running()
-        comfy_detected_externally = getattr(self, 'comfyui_externally_detected', False) # Safely check flag / 安全地检查标志
+        comfy_detected_externally = self.services.comfyui_externally_detected
 
         status_text = ""; main_stop_style = ""; main_run_enabled = tk.NORMAL; main_stop_enabled = tk.NORMAL; should_stop_progress = True
 
         if comfy_detected_externally and not comfy_running_internally:
              # Special state: Detected externally, but not managed by us / 特殊状态：外部检测到，但不由我们管理
-             status_text = f"状态: 外部 ComfyUI 运行中 (端口 {self.comfyui_api_port})"
+             status_text = f"状态: 外部 ComfyUI 运行中 (端口 {self.services.comfyui_api_port})"
              main_stop_style = "Stop.TButton" # Can't stop external process / 无法停止外部进程
              main_run_enabled = tk.DISABLED # Don't allow starting over it / 不允许在其上启动
              main_stop_enabled = tk.DISABLED # Cannot stop external / 无法停止外部
@@ -674,11 +1471,18 @@ class ConfigurableServiceRunnerApp:
              main_run_enabled = tk.NORMAL
              main_stop_enabled = tk.DISABLED
 
+        if self.services.warming_up: status_text = "状态: 模型预热中 / Status: Warming up models..."; should_stop_progress = False
+
         if should_stop_progress:
             try:
                 if hasattr(self, 'progress_bar') and self.progress_bar.winfo_exists() and self.progress_bar.winfo_ismapped(): self.progress_bar.stop()
             except tk.TclError: pass
 
+        # Supervision info / 监督信息
+        restart_info = ", ".join(f"{service}×{count}" for service, count in self.services.restart_counts.items() if count)
+        if restart_info: status_text += f" | 自动重启 / Restarts: {restart_info}"
+        if self.services.pending_restarts: status_text += " | 等待重启 / Restart pending..."
+
         # Update main controls safely
         try:
             if hasattr(self, 'status_label') and self.status_label.winfo_exists(): self.status_label.config(text=status_text)
@@ -713,10 +1517,7 @@ class ConfigurableServiceRunnerApp:
         try:
             if hasattr(self, 'progress_bar') and self.progress_bar.winfo_exists() and self.progress_bar.winfo_ismapped(): self.progress_bar.stop()
         except tk.TclError: pass
-        comfy_crashed = self.comfyui_process and self.comfyui_process.poll() is not None
-        flask_crashed = self.flask_process and self.flask_process.poll() is not None
-        if comfy_crashed: self.comfyui_process = None
-        if flask_crashed: self.flask_process = None
+        self.services.reap_exited()
         # Status update handled by _update_ui_state which is called after this
         # 状态更新由之后调用的 _update_ui_state 处理
         self._update_ui_state() # Call update state to reflect crashed processes / 调用更新状态以反映崩溃的进程
@@ -725,6 +1526,7 @@ class ConfigurableServiceRunnerApp:
         if self._is_flask_running():
             flask_url = f"http://127.0.0.1:5000"
             print(f"DEBUG: Opening Frontend URL: {flask_url}")
+            import webbrowser
             try: webbrowser.open_new_tab(flask_url)
             except Exception as e: print(f"Error opening frontend browser tab: {e}")
         else: print(f"DEBUG: Skip frontend browser open - Flask not running.")
@@ -732,40 +1534,120 @@ class ConfigurableServiceRunnerApp:
     def _trigger_backend_browser_opening(self):
         # Trigger only if running internally OR detected externally, and not already triggered
         # 仅当内部运行或外部检测到，并且尚未触发时才触发
-        comfy_is_active = self._is_comfyui_running() or self.comfyui_externally_detected
+        comfy_is_active = self.services.comfyui_available()
         if comfy_is_active and not self.backend_browser_triggered_for_session:
             self.backend_browser_triggered_for_session = True
             api_port = self.config.get("comfyui_api_port", DEFAULT_COMFYUI_API_PORT)
             comfyui_url = f"http://127.0.0.1:{api_port}"
             print(f"Opening backend browser: {comfyui_url}")
+            import webbrowser
             try: webbrowser.open_new_tab(comfyui_url)
             except Exception as e: print(f"Error opening backend: {e}")
         elif not comfy_is_active: print("DEBUG TRIGGER: ComfyUI stopped or not detected.")
         else: print("DEBUG TRIGGER: Backend browser already opened for this session.")
 
     def clear_output_widgets(self):
-        for widget in [self.main_output_text, self.app_output_text]:
+        for widget in [getattr(self, 'main_output_text', None), getattr(self, 'app_output_text', None)]:
             try:
-                if widget and widget.winfo_exists(): widget.config(state=tk.NORMAL); widget.delete('1.0', tk.END); widget.config(state=tk.DISABLED)
+                if widget and widget.winfo_exists(): widget.config(state=tk.NORMAL); widget.delete('1.0', tk.END); widget.config(state=tk.DISABLED); self.progress_tail.pop(str(widget), None)
             except tk.TclError: pass
+    def close_log_writers(self): self.services.close()
     def on_closing(self):
         print("Closing application...")
         # Check external detection as well / 同时检查外部检测
         if self._is_comfyui_running() or self._is_flask_running():
              if messagebox.askyesno("服务运行中", "服务仍在运行。\n是否在退出前停止 (仅停止此启动器管理的服务)？", parent=self.root):
                  self.stop_all_services() # Will only stop internal processes / 只会停止内部进程
-                 self.root.after(1000, self.root.destroy)
+                 self.root.after(1000, lambda: (self.close_log_writers(), self.root.destroy()))
              else:
                   # Still try to terminate managed processes if user says no to graceful stop
                   # 如果用户拒绝正常停止，仍然尝试终止托管进程
-                  if self._is_flask_running(): self.flask_process.terminate()
-                  if self._is_comfyui_running(): self.comfyui_process.terminate()
-                  self.stop_event.set(); self.root.destroy()
+                  for service in ServiceManager.SERVICES:
+                      if self.services.is_running(service): self.services.stop_events[service].set(); self.services.processes[service].terminate()
+                  self.close_log_writers(); self.root.destroy()
         else:
-             self.root.destroy()
+             self.close_log_writers(); self.root.destroy()
+
+# --- Headless Mode ---
+CONTROL_API_HOST = "127.0.0.1" # Local only / 仅限本机
+DEFAULT_CONTROL_API_PORT = 8190
+CONTROL_API_SERVICES = {"all": None, "comfyui": "ComfyUI", "backend": "ComfyUI", "flask": "Flask", "frontend": "Flask"}
+
+def make_control_handler(manager):
+    """Builds the request handler class of the local control API for headless mode:
+    GET /status, GET /resources, POST /start|/stop|/restart?service=all|comfyui|flask.
+    http.server is imported here so the GUI launcher never pays for it. / 在此导入 http.server，GUI 启动器无需承担其开销。"""
+    from http.server import BaseHTTPRequestHandler
+
+    class ControlRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = urlparse(self.path).path.rstrip("/")
+            if path == "/status": self._send_json(200, manager.status())
+            elif path == "/resources": self._send_json(200, manager.monitor.snapshot(include_history=True))
+            else: self._send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            parsed = urlparse(self.path); action = parsed.path.strip("/")
+            service_key = parse_qs(parsed.query).get("service", ["all"])[0].lower()
+            if action not in ("start", "stop", "restart"): self._send_json(404, {"error": f"Unknown action '{action}'"}); return
+            if service_key not in CONTROL_API_SERVICES: self._send_json(400, {"error": f"Unknown service '{service_key}'"}); return
+            # Starting blocks until ready, so answer right away and let /status report progress / 启动会阻塞至就绪，因此立即应答，进度由 /status 报告
+            threading.Thread(target=manager.perform, args=(action, CONTROL_API_SERVICES[service_key]), daemon=True).start()
+            self._send_json(202, {"accepted": True, "action": action, "service": service_key})
+
+        def _send_json(self, status_code, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status_code); self.send_header("Content-Type", "application/json; charset=utf-8"); self.send_header("Content-Length", str(len(body))); self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args): print(f"[Control API] {self.address_string()} {format % args}")
+
+    return ControlRequestHandler
+
+def run_headless(control_port=DEFAULT_CONTROL_API_PORT, start_services=True):
+    """Runs the launcher without Tk: starts the services, streams their output to stdout and the log files,
+    and serves the local control API until SIGINT/SIGTERM."""
+    config, _ = load_launcher_config()
+    output_lock = threading.Lock()
+    def print_output(service, source, line):
+        with output_lock: sys.stdout.write(f"{source} {line.rstrip(chr(13) + chr(10))}\n"); sys.stdout.flush()
+    manager = ServiceManager(config, on_output=print_output)
+    if not os.path.isfile(manager.venv_python_exe):
+        print(f"Frontend venv not found at {manager.venv_python_exe}; using this interpreter: {sys.executable}")
+        manager.venv_python_exe = sys.executable
+    missing = manager.missing_paths()
+    if missing:
+        print("缺少以下文件或目录 / Missing paths: " + ", ".join(missing) + f"\n请检查 {CONFIG_FILE}")
+        manager.close(); return 1
+
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((CONTROL_API_HOST, control_port), make_control_handler(manager))
+    threading.Thread(target=server.serve_forever, name="ControlAPI", daemon=True).start()
+    print(f"Control API: http://{CONTROL_API_HOST}:{control_port}/status (POST /start|/stop|/restart?service=all|comfyui|flask)")
+
+    shutdown_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM): signal.signal(sig, lambda *_: shutdown_event.set())
+    manager.start_supervisor(); manager.monitor.start()
+    if start_services: threading.Thread(target=manager.perform, args=("start",), daemon=True).start()
+    try:
+        while not shutdown_event.wait(1.0): pass
+    finally:
+        print("Shutting down headless launcher...")
+        server.shutdown(); manager.perform("stop"); manager.close()
+    return 0
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ComfyFlow service launcher")
+    parser.add_argument("--headless", action="store_true", help="Run without the Tk GUI and serve a local control API")
+    parser.add_argument("--control-port", type=int, default=DEFAULT_CONTROL_API_PORT, help="Port of the headless control API")
+    parser.add_argument("--no-start", action="store_true", help="Headless: wait for a /start request instead of starting services")
+    parser.add_argument("--profile-startup", action="store_true", help="Print an import/init timing breakdown once the window is shown")
+    cli_args = parser.parse_args()
+    startup_mark("module imports")
+    if cli_args.headless: sys.exit(run_headless(cli_args.control_port, start_services=not cli_args.no_start))
+    if tk is None: print("tkinter is not available; use --headless."); sys.exit(1)
+
     base_project_dir_check = os.path.dirname(os.path.abspath(__file__))
     venv_python_check = os.path.join(base_project_dir_check, "venv", "Scripts", "python.exe")
     app_script_check = os.path.join(base_project_dir_check, "app.py")
@@ -801,7 +1683,9 @@ if __name__ == "__main__":
         messagebox.showwarning("启动警告 / Startup Warning", error_msg + "应用程序将继续启动。 / Application will continue.")
         root_warn.destroy()
 
+    startup_mark("startup checks")
+
     # Start the application
-    root = tk.Tk()
-    app = ConfigurableServiceRunnerApp(root)
+    root = tk.Tk(); startup_mark("Tk root")
+    app = ConfigurableServiceRunnerApp(root, profile_startup=cli_args.profile_startup)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,140 @@
+# File: logging_setup.py
+# Non-blocking, per-subsystem logging for app.py / app.py 的非阻塞、分子系统日志
+# Callers only merge the message arguments and put records on a queue; redaction, formatting and writing happen in the
+# QueueListener thread. Large payloads (Base64 images, uploads) are redacted and long message bodies truncated, so a log line
+# never costs megabytes; tracebacks are appended in full.
+# 调用方只合并消息参数并把日志记录放入队列；脱敏、格式化和写出在 QueueListener 线程中完成。
+# 大载荷（Base64 图像、上传数据）会被脱敏、过长的消息正文会被截断，因此一行日志不会占用数 MB；异常堆栈完整保留。
+
+import re
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+APP_LOGGER = 'ComfyFlowApp'
+# Subsystem -> logger name; levels come from 'log_levels' in the shared config / 子系统 -> 记录器名称；级别来自共享配置中的 'log_levels'
+SUBSYSTEM_LOGGERS = {
+    'app': APP_LOGGER,
+    'listener': f'{APP_LOGGER}.listener', # ComfyUI WS listener / ComfyUI WS 监听器
+    'bridge': f'{APP_LOGGER}.bridge', # NodeBridge namespace / NodeBridge 命名空间
+    'socketio': f'{APP_LOGGER}.socketio', # Socket.IO server (logs every event payload at INFO) / Socket.IO 服务器（INFO 级别会记录每个事件载荷）
+    'engineio': f'{APP_LOGGER}.engineio', # Engine.IO transport (logs every packet at INFO) / Engine.IO 传输层（INFO 级别会记录每个数据包）
+}
+DEFAULT_LOG_LEVELS = {'app': 'INFO', 'listener': 'INFO', 'bridge': 'INFO', 'socketio': 'WARNING', 'engineio': 'WARNING'}
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_MAX_MESSAGE_CHARS = 2000 # Longer messages are cut / 超过此长度的消息会被截断
+LOG_MAX_QUEUE = 10000 # Records beyond this are dropped instead of blocking the caller / 超出部分直接丢弃，不阻塞调用方
+
+# Data URLs and long bare Base64 runs / 数据 URL 和较长的裸 Base64 串
+_DATA_URL_RE = re.compile(r'(data:[\w/+.-]+;base64,)[A-Za-z0-9+/=]{32,}')
+_BASE64_RE = re.compile(r'[A-Za-z0-9+/]{256,}={0,2}')
+
+def redact(message, max_chars=LOG_MAX_MESSAGE_CHARS):
+    """Replaces embedded Base64 payloads with their size and truncates the message to max_chars."""
+    """将内嵌的 Base64 载荷替换为其大小，并将消息截断为 max_chars。"""
+    message = _DATA_URL_RE.sub(lambda m: f"{m.group(1)}<{len(m.group(0)) - len(m.group(1))} chars>", message)
+    message = _BASE64_RE.sub(lambda m: f"<base64 {len(m.group(0))} chars>", message)
+    if len(message) > max_chars:
+        message = f"{message[:max_chars]}... (+{len(message) - max_chars} chars)"
+    return message
+
+class RedactingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: records are dropped (and counted) when the queue is full. On the calling thread it only
+    merges the message arguments, so later changes to them cannot alter the line; exc_info travels with the record to the
+    in-process listener, which redacts and formats it."""
+    """从不阻塞的 QueueHandler：队列满时丢弃记录（并计数）。在调用线程上只合并消息参数，使其之后的变化不会影响日志内容；
+    exc_info 随记录传给同进程的监听器，由其脱敏和格式化。"""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage(); record.args = None
+        return record
+
+    def enqueue(self, record):
+        try: self.queue.put_nowait(record)
+        except queue.Full: self.dropped += 1
+
+class SamplingFilter(logging.Filter):
+    """Lets through at most one record per interval for each extra={'sample_key': ...}; the next one reports how many were skipped.
+    Records without a sample_key always pass."""
+    """对每个 extra={'sample_key': ...}，每个间隔最多放行一条记录；下一条会报告跳过的数量。没有 sample_key 的记录总是放行。"""
+    def __init__(self, interval=1.0):
+        super().__init__()
+        self.interval = interval
+        self._last = {} # { sample_key: (last_time, suppressed) }
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample_key', None)
+        if key is None or self.interval <= 0: return True
+        now = time.monotonic()
+        with self._lock:
+            last_time, suppressed = self._last.get(key, (0.0, 0))
+            if now - last_time < self.interval:
+                self._last[key] = (last_time, suppressed + 1); return False
+            self._last[key] = (now, 0)
+        if suppressed: record.msg = f"{record.msg} (+{suppressed} similar suppressed)"
+        return True
+
+class RedactingQueueListener(QueueListener):
+    """QueueListener that redacts and truncates the message body on its own thread; the traceback is left whole."""
+    """在自身线程上对消息正文脱敏并截断的 QueueListener；异常堆栈保持完整。"""
+    def prepare(self, record):
+        record.msg = redact(str(record.msg))
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message (+ exception)."""
+    """每行一个 JSON 对象：时间、级别、记录器、消息（及异常）。"""
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        if record.exc_info: entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text: entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+_listener = None
+_sampling_filter = SamplingFilter()
+
+def configure_logging(log_format='text', sample_interval=1.0):
+    """Routes all logging through a bounded queue to a background QueueListener writing to stderr. Safe to call once."""
+    """将所有日志通过有界队列转发给写入 stderr 的后台 QueueListener。只需调用一次。"""
+    global _listener
+    if _listener is not None: return _listener
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(LOG_FORMAT))
+    log_queue = queue.Queue(LOG_MAX_QUEUE)
+    queue_handler = RedactingQueueHandler(log_queue)
+    queue_handler.addFilter(_sampling_filter)
+    root = logging.getLogger()
+    for handler in list(root.handlers): root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+    _sampling_filter.interval = sample_interval
+    _listener = RedactingQueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop) # Flush what is still queued / 写出队列中剩余的记录
+    return _listener
+
+def apply_log_levels(levels, sample_interval=None):
+    """Sets the level of each subsystem logger (unknown subsystems and level names are ignored). Returns the levels applied."""
+    """设置每个子系统记录器的级别（忽略未知的子系统和级别名）。返回实际应用的级别。"""
+    applied = {}
+    for subsystem, level_name in dict(DEFAULT_LOG_LEVELS, **(levels or {})).items():
+        level = logging.getLevelName(str(level_name).upper())
+        if subsystem in SUBSYSTEM_LOGGERS and isinstance(level, int):
+            logging.getLogger(SUBSYSTEM_LOGGERS[subsystem]).setLevel(level); applied[subsystem] = logging.getLevelName(level)
+    if sample_interval is not None: _sampling_filter.interval = sample_interval
+    return applied
+
+def get_logger(subsystem):
+    """Returns the logger of a subsystem in SUBSYSTEM_LOGGERS."""
+    """返回 SUBSYSTEM_LOGGERS 中某个子系统的记录器。"""
+    return logging.getLogger(SUBSYSTEM_LOGGERS[subsystem])
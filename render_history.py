@@ -0,0 +1,130 @@
+# File: render_history.py
+# Persistent render history for app.py / app.py 的持久化渲染历史
+# Every completed prompt is recorded in an embedded SQLite index (prompt id, client, workflow, input hashes, output files,
+# dimensions, timings, thumbnail). The gallery reads pages with keyset pagination on (finished_at, id), so a page costs
+# the same at row 10 and at row 500,000 — no OFFSET scans.
+# 每个完成的任务都记录在内嵌的 SQLite 索引中（任务 ID、客户端、工作流、输入摘要、输出文件、尺寸、耗时、缩略图）。
+# 画廊按 (finished_at, id) 做键集分页读取，因此第 10 行和第 50 万行的翻页代价相同——不做 OFFSET 扫描。
+
+import json
+import base64
+import sqlite3
+import threading
+
+SCHEMA_VERSION = 1
+MAX_PAGE_SIZE = 200
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS renders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    prompt_id TEXT NOT NULL UNIQUE,
+    client_id TEXT,
+    batch_id TEXT,
+    workflow_key TEXT,
+    encoder_profile TEXT,
+    input_hashes TEXT NOT NULL DEFAULT '{}',
+    outputs TEXT NOT NULL DEFAULT '[]',
+    thumbnail TEXT,
+    image_count INTEGER NOT NULL DEFAULT 0,
+    cached_nodes INTEGER,
+    total_nodes INTEGER,
+    transport TEXT,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    queued_at REAL,
+    started_at REAL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_renders_finished ON renders (finished_at, id);
+CREATE INDEX IF NOT EXISTS idx_renders_workflow ON renders (workflow_key, finished_at, id);
+CREATE INDEX IF NOT EXISTS idx_renders_client ON renders (client_id, finished_at, id);
+CREATE INDEX IF NOT EXISTS idx_renders_pinned ON renders (pinned) WHERE pinned = 1;
+"""
+# Filters accepted by RenderHistory.page() -> SQL condition / RenderHistory.page() 接受的过滤条件 -> SQL 条件
+FILTERS = {
+    'workflow_key': 'workflow_key = ?',
+    'client_id': 'client_id = ?',
+    'batch_id': 'batch_id = ?',
+    'since': 'finished_at >= ?',
+    'until': 'finished_at < ?',
+    'pinned': 'pinned = ?',
+}
+JSON_COLUMNS = ('input_hashes', 'outputs')
+
+class HistoryCursorError(ValueError):
+    """Raised for a malformed pagination cursor. / 分页游标格式错误时抛出。"""
+
+def encode_cursor(finished_at, row_id):
+    """Opaque cursor pointing after (finished_at, id). / 指向 (finished_at, id) 之后的不透明游标。"""
+    return base64.urlsafe_b64encode(json.dumps([finished_at, row_id]).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        finished_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(finished_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise HistoryCursorError(f"Invalid cursor: {cursor!r}") from e
+
+class RenderHistory:
+    """SQLite-backed render index. One connection shared across threads, serialized by a lock; WAL keeps reads cheap."""
+    """基于 SQLite 的渲染索引。各线程共用一个连接并由锁串行化；WAL 模式使读取开销很小。"""
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL') # Durable enough for an index; far fewer fsyncs / 对索引足够可靠，fsync 少得多
+            self._conn.executescript(SCHEMA)
+            self._conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+
+    def record(self, entry):
+        """Inserts (or replaces) the entry of a completed prompt. JSON columns may be given as dicts/lists."""
+        """插入（或替换）已完成任务的条目。JSON 列可直接传入字典/列表。"""
+        entry = {key: json.dumps(value) if key in JSON_COLUMNS else value for key, value in entry.items()}
+        columns = ', '.join(entry); placeholders = ', '.join('?' * len(entry))
+        with self._lock:
+            cursor = self._conn.execute(f'INSERT OR REPLACE INTO renders ({columns}) VALUES ({placeholders})', tuple(entry.values()))
+            return cursor.lastrowid
+
+    def get(self, prompt_id):
+        """Returns the entry of a prompt, or None. / 返回任务的条目，不存在时返回 None。"""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM renders WHERE prompt_id = ?', (prompt_id,)).fetchone()
+        return self._row_to_entry(row) if row else None
+
+    def set_pinned(self, prompt_id, pinned):
+        """Pins or unpins an entry. Returns False if there is no such entry. / 置顶或取消置顶条目。条目不存在时返回 False。"""
+        with self._lock:
+            return self._conn.execute('UPDATE renders SET pinned = ? WHERE prompt_id = ?', (int(bool(pinned)), prompt_id)).rowcount > 0
+
+    def pinned_paths(self):
+        """Returns the output file paths of all pinned entries. / 返回所有置顶条目的输出文件路径。"""
+        with self._lock:
+            rows = self._conn.execute('SELECT outputs FROM renders WHERE pinned = 1').fetchall()
+        return {output['path'] for row in rows for output in json.loads(row[0] or '[]') if output.get('path')}
+
+    def page(self, filters=None, cursor=None, limit=50):
+        """Returns (entries, next_cursor), newest first. Unknown filter names are ignored; next_cursor is None on the last page."""
+        """返回 (条目列表, next_cursor)，最新的在前。忽略未知的过滤名；最后一页的 next_cursor 为 None。"""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        conditions = []; params = []
+        for name, value in (filters or {}).items():
+            if name in FILTERS and value not in (None, ''):
+                conditions.append(FILTERS[name]); params.append(value)
+        if cursor:
+            conditions.append('(finished_at, id) < (?, ?)'); params.extend(decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._lock:
+            rows = self._conn.execute(f'SELECT * FROM renders {where} ORDER BY finished_at DESC, id DESC LIMIT ?', (*params, limit + 1)).fetchall()
+        entries = [self._row_to_entry(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(entries[-1]['finished_at'], entries[-1]['id']) if len(rows) > limit else None
+        return entries, next_cursor
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+    @staticmethod
+    def _row_to_entry(row):
+        entry = dict(row)
+        for key in JSON_COLUMNS: entry[key] = json.loads(entry[key] or 'null')
+        return entry
@@ -0,0 +1,100 @@
+# File: retention.py
+# Size/age retention for ComfyUI's output, input and temp directories / ComfyUI 输出、输入和临时目录的容量/时长保留策略
+# DirectoryIndex keeps an in-memory listing between sweeps: only directories whose mtime changed are listed again, and only
+# names not seen before are stat()ed, so a sweep over millions of files costs a few syscalls once the index is warm.
+# sweep() deletes the oldest unprotected files until the directory is within its quota.
+# DirectoryIndex 在两次清理之间保留内存中的文件列表：只重新列出 mtime 变化的目录，且只对新出现的文件名调用 stat()，
+# 因此索引预热后，对数百万文件的一次清理只需少量系统调用。sweep() 删除最旧的未受保护文件，直到目录回到配额以内。
+
+import os
+import time
+
+class DirectoryIndex:
+    """Incremental listing of the files under root. / root 下文件的增量列表。"""
+    def __init__(self, root):
+        self.root = root
+        self._dirs = {} # { directory: (dir_mtime, [subdirs], {path: (size, mtime)}) }
+
+    def refresh(self):
+        """Brings the listing up to date. Returns the number of directories that had to be listed again."""
+        """更新文件列表。返回需要重新列出的目录数。"""
+        relisted = 0; seen = set()
+        stack = [self.root] if os.path.isdir(self.root) else []
+        while stack:
+            directory = stack.pop(); seen.add(directory)
+            try: dir_mtime = os.stat(directory).st_mtime
+            except OSError: continue
+            cached = self._dirs.get(directory)
+            if cached and cached[0] == dir_mtime:
+                stack.extend(cached[1]); continue
+            known_files = cached[2] if cached else {}
+            subdirs = []; files = {}
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            if entry.path in known_files:
+                                files[entry.path] = known_files[entry.path]; continue
+                            try: st = entry.stat(follow_symlinks=False)
+                            except OSError: continue
+                            files[entry.path] = (st.st_size, st.st_mtime)
+            except OSError:
+                continue
+            self._dirs[directory] = (dir_mtime, subdirs, files)
+            stack.extend(subdirs); relisted += 1
+        for directory in set(self._dirs) - seen: del self._dirs[directory] # Removed directories / 已删除的目录
+        return relisted
+
+    def files(self):
+        """Yields (path, size, mtime) of every indexed file. / 逐个返回已索引文件的 (path, size, mtime)。"""
+        for _, _, files in self._dirs.values():
+            for path, (size, mtime) in files.items(): yield path, size, mtime
+
+    def forget(self, path):
+        cached = self._dirs.get(os.path.dirname(path))
+        if cached: cached[2].pop(path, None)
+
+    def update(self, path, size, mtime):
+        """Records a fresh stat of an indexed file. / 记录已索引文件的最新 stat 结果。"""
+        cached = self._dirs.get(os.path.dirname(path))
+        if cached and path in cached[2]: cached[2][path] = (size, mtime)
+
+def sweep(index, max_bytes=0, max_age=0, min_age=600, is_protected=None, now=None):
+    """Deletes the oldest files of an index that are older than max_age seconds, or while the total exceeds max_bytes (0 = no limit).
+    Files younger than min_age seconds and files for which is_protected(path) is true are never deleted.
+    Returns stats: files, bytes (after the sweep), deleted, reclaimed_bytes, protected, errors."""
+    """删除索引中早于 max_age 秒的最旧文件，或在总量超过 max_bytes 时持续删除（0 表示不限制）。
+    不会删除新于 min_age 秒的文件以及 is_protected(path) 为真的文件。
+    返回统计：files、bytes（清理后）、deleted、reclaimed_bytes、protected、errors。"""
+    now = now or time.time()
+    index.refresh()
+    files = sorted(index.files(), key=lambda item: item[2])
+    total = sum(size for _, size, _ in files)
+    stats = {'files': len(files), 'bytes': total, 'deleted': 0, 'reclaimed_bytes': 0, 'protected': 0, 'errors': 0}
+    def should_delete(size, mtime):
+        over_quota = max_bytes and stats['bytes'] > max_bytes
+        expired = max_age and now - mtime > max_age
+        return (over_quota or expired) and now - mtime >= min_age
+    for path, size, mtime in files:
+        if not should_delete(size, mtime): break # Sorted oldest first / 已按从旧到新排序
+        if is_protected and is_protected(path):
+            stats['protected'] += 1; continue
+        try:
+            st = os.stat(path)
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                # Rewritten since it was indexed: decide again on the fresh size/mtime / 建立索引后被重写：按最新的大小/时间重新判断
+                index.update(path, st.st_size, st.st_mtime)
+                stats['bytes'] += st.st_size - size; size = st.st_size
+                if not should_delete(size, st.st_mtime): continue
+            os.remove(path)
+        except FileNotFoundError:
+            st = None
+        except OSError:
+            stats['errors'] += 1; continue
+        index.forget(path)
+        stats['files'] -= 1; stats['bytes'] -= size
+        if st is not None:
+            stats['deleted'] += 1; stats['reclaimed_bytes'] += size
+    return stats
@@ -0,0 +1,239 @@
+# File: shared_config.py
+# Shared configuration for launcher.py and app.py / launcher.py 与 app.py 共用的配置
+# launcher_config.json is the single source; both processes load it through load_config() and app.py watches it for changes.
+# launcher_config.json 是唯一配置来源；两个进程都通过 load_config() 读取，app.py 还会监视其变化。
+
+import os
+import json
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# The launcher passes its config path to the app so both always read the same file / 启动器将配置路径传给应用，保证两者读取同一文件
+CONFIG_FILE = os.environ.get("COMFYFLOW_CONFIG") or os.path.join(BASE_DIR, "launcher_config.json")
+
+VALID_VRAM_MODES = ["default", "high", "low"]
+VALID_PREVIEW_METHODS = ["none", "latent2rgb", "taesd", "auto"] # ComfyUI --preview-method
+VALID_IMAGE_FORMATS = ("PNG", "JPEG", "WEBP")
+VALID_LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+RETENTION_DIRECTORIES = ("output", "input", "temp") # Directories retention quotas can apply to
+
+# --- Validators / 校验函数 ---
+# Each returns the normalized value or raises ValueError / 每个函数返回规范化后的值，或抛出 ValueError
+def _string(value):
+    if not isinstance(value, str): raise ValueError("expected a string")
+    return value
+
+def _boolean(value):
+    if not isinstance(value, bool): raise ValueError("expected true/false")
+    return value
+
+def _port(value):
+    port = int(value)
+    if not (1 <= port <= 65535): raise ValueError("port out of range 1-65535")
+    return str(port) # Stored as a string, as the launcher UI edits it / 以字符串保存，与启动器界面一致
+
+def _host(value):
+    value = _string(value).strip()
+    if not value or any(c in value for c in "/: "): raise ValueError("expected a host name or IP address")
+    return value
+
+def _number(minimum, integer=False):
+    def validate(value):
+        if isinstance(value, bool): raise ValueError("expected a number")
+        number = int(value) if integer else float(value)
+        if number < minimum: raise ValueError(f"must be >= {minimum}")
+        return number
+    return validate
+
+def _choice(options):
+    def validate(value):
+        if value not in options: raise ValueError(f"expected one of {', '.join(options)}")
+        return value
+    return validate
+
+def _string_list(value):
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value): raise ValueError("expected a list of strings")
+    return value
+
+def _string_dict(value):
+    if not isinstance(value, dict) or not all(isinstance(k, str) and isinstance(v, str) for k, v in value.items()): raise ValueError("expected an object of strings")
+    return value
+
+def _retention_quotas(value):
+    if not isinstance(value, dict): raise ValueError("expected an object of directory quotas")
+    for name, quota in value.items():
+        if name not in RETENTION_DIRECTORIES: raise ValueError(f"unknown directory '{name}', expected one of {', '.join(RETENTION_DIRECTORIES)}")
+        if not isinstance(quota, dict) or set(quota) - {'max_gb', 'max_age_days'}: raise ValueError(f"'{name}' expects max_gb and/or max_age_days")
+        for key, limit in quota.items():
+            if isinstance(limit, bool) or not isinstance(limit, (int, float)) or limit < 0: raise ValueError(f"'{name}.{key}' must be a number >= 0")
+    return value
+
+def _log_levels(value):
+    value = _string_dict(value)
+    bad = [level for level in value.values() if level.upper() not in VALID_LOG_LEVELS]
+    if bad: raise ValueError(f"unknown level {bad[0]!r}, expected one of {', '.join(VALID_LOG_LEVELS)}")
+    return {name: level.upper() for name, level in value.items()}
+
+def _encoder_profiles(value):
+    if not isinstance(value, dict): raise ValueError("expected an object of profiles")
+    for name, settings in value.items():
+        if not isinstance(settings, dict) or str(settings.get('format', '')).upper() not in VALID_IMAGE_FORMATS:
+            raise ValueError(f"profile '{name}' needs a format of {', '.join(VALID_IMAGE_FORMATS)}")
+    return {name: dict(settings, format=settings['format'].upper()) for name, settings in value.items()}
+
+# --- Schema / 配置结构 ---
+# key: (default, validator). Empty directory values are derived from comfyui_dir. / 目录为空时由 comfyui_dir 推导。
+CONFIG_SCHEMA = {
+    # Launcher / 启动器
+    "comfyui_dir": ("", _string),
+    "python_exe": ("", _string),
+    "comfyui_api_port": ("8188", _port),
+    "fp16_vae": (False, _boolean),
+    "fp8_unet": (False, _boolean),
+    "fp8_textenc": (False, _boolean),
+    "disable_cuda_malloc": (False, _boolean),
+    "vram_mode": ("default", _choice(VALID_VRAM_MODES)),
+    "preview_method": ("latent2rgb", _choice(VALID_PREVIEW_METHODS)), # latent2rgb is nearly free; taesd looks better / latent2rgb 几乎无开销；taesd 效果更好
+    "log_max_lines": (5000, _number(100, integer=True)),
+    "resource_sample_interval": (2.0, _number(0.2)),
+    "rss_alert_mb": (0, _number(0)),
+    "warmup_enabled": (False, _boolean),
+    "warmup_workflows": ([], _string_list), # File names in comfyui_workflow_dir (API format) / comfyui_workflow_dir 中的文件名（API 格式）
+    "warmup_timeout": (300, _number(1)),
+    # Shared ComfyUI location / 共用的 ComfyUI 位置
+    "comfyui_host": ("127.0.0.1", _host),
+    "comfyui_workflow_dir": ("", _string),
+    "comfyui_input_dir": ("", _string),
+    "comfyui_output_dir": ("", _string),
+    "comfyui_temp_dir": ("", _string),
+    # App / 应用
+    "comfyui_http_pool_size": (8, _number(1, integer=True)),
+    "comfyui_http_timeout": (5.0, _number(0.5)),
+    "encoder_profiles": ({}, _encoder_profiles), # Added to / override the built-in profiles / 添加或覆盖内置编码配置
+    "default_encoder_profile": ("balanced", _string),
+    "workflow_encoder_profiles": ({}, _string_dict),
+    "config_reload_interval": (2.0, _number(0.5)),
+    "workflow_cache_size": (64, _number(1, integer=True)), # Compiled workflows kept in memory / 内存中保留的已编译工作流数
+    "preview_max_fps": (4.0, _number(0)), # Live sampler previews forwarded per second; 0 disables them / 每秒转发的实时采样预览数，0 表示关闭
+    "preview_max_size": (512, _number(64, integer=True)), # Longest side in px; larger previews are downscaled / 最长边像素，更大的预览会被缩小
+    "session_grace_seconds": (120, _number(0)), # A disconnected browser keeps its render this long; 0 cancels at once / 断开的浏览器在此时长内保留渲染，0 表示立即取消
+    "session_replay_max_events": (100, _number(1, integer=True)), # Events replayed to a reconnecting browser / 向重连浏览器重放的事件数上限
+    "session_replay_max_mb": (64, _number(1)), # Image bytes kept for replay per session / 每个会话为重放保留的图像字节数
+    "api_job_max_active": (4, _number(1, integer=True)), # REST jobs in ComfyUI's queue at once / 同时位于 ComfyUI 队列中的 REST 任务数
+    "api_job_history": (200, _number(1, integer=True)), # Finished REST jobs kept for polling / 保留供轮询的已结束 REST 任务数
+    "api_webhook_hosts": (["127.0.0.1", "localhost", "::1"], _string_list), # Local callbacks only by default / 默认只允许本地回调
+    "history_dir": ("", _string), # Render index and thumbnails; empty = 'history' next to app.py / 渲染索引和缩略图，为空时使用 app.py 旁的 'history'
+    "history_thumbnail_size": (256, _number(32, integer=True)), # Longest side of gallery thumbnails in px / 画廊缩略图最长边像素
+    # Per directory (output, input, temp): {"max_gb": ..., "max_age_days": ...}; 0 or missing = no limit / 按目录配额，0 或缺省表示不限制
+    "retention_quotas": ({}, _retention_quotas),
+    "retention_interval": (600, _number(10)), # Seconds between retention sweeps / 保留策略清理间隔（秒）
+    "retention_min_age": (600, _number(60)), # Files younger than this (seconds) are never deleted / 新于此时长（秒）的文件永不删除
+    # Per-subsystem levels: app, listener, bridge, socketio, engineio / 分子系统日志级别
+    "log_levels": ({"app": "INFO", "listener": "INFO", "bridge": "INFO", "socketio": "WARNING", "engineio": "WARNING"}, _log_levels),
+    "log_format": ("text", _choice(["text", "json"])),
+    "log_sample_interval": (1.0, _number(0)), # Seconds between logged progress/executing events; 0 logs all / 进度等高频事件的记录间隔（秒），0 表示全部记录
+}
+
+def default_config():
+    """Returns a fresh copy of the defaults."""
+    """返回默认配置的新副本。"""
+    return {key: json.loads(json.dumps(default)) for key, (default, _) in CONFIG_SCHEMA.items()}
+
+def validate_config(raw):
+    """Validates a loaded JSON object against CONFIG_SCHEMA. Invalid values fall back to their defaults; unknown keys are kept.
+    Returns (config, problems)."""
+    """按 CONFIG_SCHEMA 校验配置。无效值回退为默认值；未知键保留。返回 (config, problems)。"""
+    if not isinstance(raw, dict): return default_config(), ["top level must be a JSON object"]
+    config = dict(raw); problems = []
+    for key, (default, validator) in CONFIG_SCHEMA.items():
+        if key not in raw: config[key] = json.loads(json.dumps(default)); continue
+        try: config[key] = validator(raw[key])
+        except (TypeError, ValueError) as e:
+            problems.append(f"{key}={raw[key]!r}: {e}; using {default!r}")
+            config[key] = json.loads(json.dumps(default))
+    return config, problems
+
+def read_config_file(path=CONFIG_FILE):
+    """Reads the raw JSON object from the config file; raises OSError/ValueError."""
+    """读取配置文件中的原始 JSON 对象；失败时抛出 OSError/ValueError。"""
+    with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+
+def load_config(path=CONFIG_FILE):
+    """Loads and validates the config file. Returns (config, loaded_from_file, problems); a missing or unreadable file gives the defaults."""
+    """加载并校验配置文件。返回 (config, loaded_from_file, problems)；文件缺失或无法读取时使用默认值。"""
+    try: raw = read_config_file(path)
+    except FileNotFoundError: return default_config(), False, []
+    except (OSError, ValueError) as e: return default_config(), False, [f"cannot read {path}: {e}"]
+    config, problems = validate_config(raw)
+    return config, True, problems
+
+def apply_env_overrides(config):
+    """Returns a copy of config with the COMFYUI_HOST/COMFYUI_API_PORT environment variables applied (set by the launcher)."""
+    """返回应用了 COMFYUI_HOST/COMFYUI_API_PORT 环境变量（由启动器设置）的配置副本。"""
+    config = dict(config)
+    for key, env_name in (("comfyui_host", "COMFYUI_HOST"), ("comfyui_api_port", "COMFYUI_API_PORT")):
+        if os.environ.get(env_name):
+            try: config[key] = CONFIG_SCHEMA[key][1](os.environ[env_name])
+            except ValueError: pass
+    return config
+
+def comfyui_address(config):
+    """Returns "host:port" of the ComfyUI API."""
+    """返回 ComfyUI API 的 "host:port"。"""
+    return f"{config['comfyui_host']}:{config['comfyui_api_port']}"
+
+def comfyui_paths(config):
+    """Returns the ComfyUI workflows/input/output/temp directories; explicit *_dir keys win over comfyui_dir subfolders."""
+    """返回 ComfyUI 的工作流/输入/输出/临时目录；显式的 *_dir 键优先于 comfyui_dir 子目录。"""
+    base = config.get("comfyui_dir") or ""
+    defaults = {"workflows": ("comfyui_workflow_dir", os.path.join("user", "default", "workflows")), "input": ("comfyui_input_dir", "input"),
+                "output": ("comfyui_output_dir", "output"), "temp": ("comfyui_temp_dir", "temp")}
+    return {name: os.path.normpath(config.get(key) or os.path.join(base, subfolder)) if (config.get(key) or base) else ""
+            for name, (key, subfolder) in defaults.items()}
+
+# --- Change Watcher / 变更监视器 ---
+class ConfigWatcher:
+    """Polls the config file and calls on_change(config, changed_keys, problems) with the validated new config.
+    A half-written or invalid file is reported once and the previous config stays in effect."""
+    """轮询配置文件，并以校验后的新配置调用 on_change(config, changed_keys, problems)。
+    写入一半或无效的文件只报告一次，继续使用之前的配置。"""
+    def __init__(self, config, on_change, on_error=None, path=CONFIG_FILE, interval=2.0):
+        self.config = config
+        self.on_change = on_change
+        self.on_error = on_error or (lambda message: None)
+        self.path = path
+        self.interval = interval
+        self._signature = self._file_signature()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="ConfigWatcher")
+            self._thread.start()
+
+    def stop(self): self._stop_event.set()
+
+    def _file_signature(self):
+        try: stat = os.stat(self.path); return (stat.st_mtime_ns, stat.st_size)
+        except OSError: return None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try: self.check()
+            except Exception as e: self.on_error(f"config watcher error: {e}")
+
+    def check(self):
+        """Reloads the file if it changed since the last check. Returns the changed keys (empty if nothing changed)."""
+        """若文件自上次检查后有变化则重新加载。返回变化的键（无变化时为空）。"""
+        signature = self._file_signature()
+        if signature is None or signature == self._signature: return set()
+        self._signature = signature
+        try: raw = read_config_file(self.path)
+        except (OSError, ValueError) as e: self.on_error(f"ignoring unreadable {self.path}: {e}"); return set()
+        config, problems = validate_config(raw)
+        changed = {key for key in set(config) | set(self.config) if config.get(key) != self.config.get(key)}
+        self.config = config
+        if changed: self.on_change(config, changed, problems)
+        self.interval = config.get("config_reload_interval", self.interval)
+        return changed
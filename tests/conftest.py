@@ -0,0 +1,5 @@
+# Tests import the top-level modules of the repository / 测试直接导入仓库顶层模块
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,92 @@
+# Tests for render_history.py / render_history.py 的测试
+import sqlite3
+
+import pytest
+
+import render_history
+from render_history import HistoryCursorError, RenderHistory, decode_cursor, encode_cursor
+
+@pytest.fixture
+def history(tmp_path):
+    index = RenderHistory(str(tmp_path / 'history.db'))
+    yield index
+    index.close()
+
+def record(history, prompt_id, finished_at, **fields):
+    history.record(dict({'prompt_id': prompt_id, 'finished_at': finished_at}, **fields))
+
+def test_record_and_get_round_trips_json_columns(history):
+    record(history, 'p1', 10.0, workflow_key='wf.json', input_hashes={'Text': 'abc'}, outputs=[{'path': '/out/a.png', 'width': 64}])
+    entry = history.get('p1')
+    assert entry['workflow_key'] == 'wf.json'
+    assert entry['input_hashes'] == {'Text': 'abc'}
+    assert entry['outputs'] == [{'path': '/out/a.png', 'width': 64}]
+    assert entry['pinned'] == 0
+    assert history.get('missing') is None
+
+def test_record_replaces_the_same_prompt(history):
+    record(history, 'p1', 10.0, image_count=1)
+    record(history, 'p1', 11.0, image_count=2)
+    entries, _ = history.page()
+    assert [(e['prompt_id'], e['image_count']) for e in entries] == [('p1', 2)]
+
+def test_pages_are_newest_first_and_complete_with_equal_timestamps(history):
+    # Ties on finished_at are ordered by id, so keyset pages neither skip nor repeat rows / finished_at 相同时按 id 排序，翻页不丢不重
+    for i in range(7):
+        record(history, f"p{i}", 100.0 if i < 4 else 200.0)
+    seen = []; cursor = None
+    while True:
+        entries, cursor = history.page(cursor=cursor, limit=3)
+        seen.extend(e['prompt_id'] for e in entries)
+        if cursor is None: break
+    assert seen == ['p6', 'p5', 'p4', 'p3', 'p2', 'p1', 'p0']
+
+def test_last_page_has_no_cursor(history):
+    record(history, 'p1', 1.0); record(history, 'p2', 2.0)
+    entries, cursor = history.page(limit=2)
+    assert len(entries) == 2 and cursor is None
+
+def test_filters_and_unknown_filters(history):
+    record(history, 'a', 1.0, workflow_key='one.json', client_id='c1')
+    record(history, 'b', 2.0, workflow_key='two.json', client_id='c1')
+    record(history, 'c', 3.0, workflow_key='one.json', client_id='c2')
+    ids = lambda filters: [e['prompt_id'] for e in history.page(filters)[0]]
+    assert ids({'workflow_key': 'one.json'}) == ['c', 'a']
+    assert ids({'client_id': 'c1', 'since': 2.0}) == ['b']
+    assert ids({'until': 2.0}) == ['a']
+    assert ids({'workflow_key': '', 'bogus': 'x'}) == ['c', 'b', 'a']
+
+def test_page_size_is_clamped(history):
+    for i in range(render_history.MAX_PAGE_SIZE + 5):
+        record(history, f"p{i}", float(i))
+    entries, cursor = history.page(limit=10_000)
+    assert len(entries) == render_history.MAX_PAGE_SIZE and cursor is not None
+    assert len(history.page(limit=0)[0]) == 1
+
+def test_pinning(history):
+    record(history, 'p1', 1.0, outputs=[{'path': '/out/a.png'}, {'path': None}])
+    record(history, 'p2', 2.0, outputs=[{'path': '/out/b.png'}])
+    assert history.set_pinned('p1', True)
+    assert not history.set_pinned('missing', True)
+    assert history.pinned_paths() == {'/out/a.png'}
+    assert [e['prompt_id'] for e in history.page({'pinned': 1})[0]] == ['p1']
+    history.set_pinned('p1', False)
+    assert history.pinned_paths() == set()
+
+def test_cursor_round_trip_and_errors():
+    assert decode_cursor(encode_cursor(12.5, 7)) == (12.5, 7)
+    for bad in ('not-base64!', encode_cursor('x', 1), 'e30'):
+        with pytest.raises(HistoryCursorError):
+            decode_cursor(bad)
+
+def test_paging_uses_the_finished_index(history):
+    plan = history._conn.execute('EXPLAIN QUERY PLAN SELECT * FROM renders WHERE (finished_at, id) < (?, ?) '
+                                 'ORDER BY finished_at DESC, id DESC LIMIT 10', (1.0, 1)).fetchall()
+    assert any('idx_renders_finished' in row[-1] for row in plan)
+
+def test_schema_version_is_set(tmp_path):
+    path = str(tmp_path / 'history.db')
+    RenderHistory(path).close()
+    RenderHistory(path).close() # Reopening an existing index is fine / 重新打开已有索引没有问题
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == render_history.SCHEMA_VERSION
@@ -0,0 +1,99 @@
+# Tests for retention.py / retention.py 的测试
+import os
+import time
+
+import pytest
+
+from retention import DirectoryIndex, sweep
+
+NOW = 1_000_000.0
+
+def write(path, size, age):
+    """Writes a file of `size` bytes whose mtime is `age` seconds before NOW. / 写入 size 字节、mtime 为 NOW 之前 age 秒的文件。"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f: f.write(b'x' * size)
+    os.utime(path, (NOW - age, NOW - age))
+    return str(path)
+
+def names(index):
+    return sorted(os.path.basename(path) for path, _, _ in index.files())
+
+@pytest.fixture
+def root(tmp_path):
+    return tmp_path / 'output'
+
+def test_quota_deletes_oldest_first(root):
+    for name, age in (('new', 700), ('mid', 800), ('old', 900)):
+        write(root / name, 100, age)
+    index = DirectoryIndex(str(root))
+    stats = sweep(index, max_bytes=150, min_age=600, now=NOW)
+    assert sorted(os.listdir(root)) == ['new']
+    assert stats['deleted'] == 2 and stats['reclaimed_bytes'] == 200
+    assert stats['files'] == 1 and stats['bytes'] == 100
+    assert names(index) == ['new']
+
+def test_max_age_without_quota(root):
+    write(root / 'expired', 10, 5000); write(root / 'fresh', 10, 1000)
+    stats = sweep(DirectoryIndex(str(root)), max_age=3600, min_age=600, now=NOW)
+    assert sorted(os.listdir(root)) == ['fresh'] and stats['deleted'] == 1
+
+def test_min_age_wins_over_quota(root):
+    write(root / 'young', 100, 10)
+    stats = sweep(DirectoryIndex(str(root)), max_bytes=1, min_age=600, now=NOW)
+    assert os.listdir(root) == ['young'] and stats['deleted'] == 0
+
+def test_protected_files_are_skipped(root):
+    keep = write(root / 'keep', 100, 900); write(root / 'drop', 100, 800)
+    stats = sweep(DirectoryIndex(str(root)), max_bytes=150, min_age=600, is_protected=lambda path: path == keep, now=NOW)
+    assert os.listdir(root) == ['keep']
+    assert stats['protected'] == 1 and stats['deleted'] == 1
+
+def test_no_limits_delete_nothing(root):
+    write(root / 'a', 100, 99999)
+    stats = sweep(DirectoryIndex(str(root)), now=NOW)
+    assert os.listdir(root) == ['a'] and stats == dict(stats, files=1, bytes=100, deleted=0)
+
+def test_rewritten_file_is_judged_on_its_fresh_stat(root):
+    index = DirectoryIndex(str(root))
+    path = write(root / 'rewritten', 100, 5000); write(root / 'other', 100, 4900)
+    index.refresh()
+    # Rewritten in place after indexing: smaller and younger, while the directory listing is unchanged
+    # 建立索引后被原地重写：更小、更新，而目录列表不变
+    dir_mtime = os.stat(root).st_mtime
+    write(root / 'rewritten', 10, 1000); os.utime(root, (dir_mtime, dir_mtime))
+    stats = sweep(index, max_age=3600, min_age=600, now=NOW)
+    assert os.listdir(root) == ['rewritten']
+    assert stats['reclaimed_bytes'] == 100 and stats['bytes'] == 10
+    assert [(size, mtime) for p, size, mtime in index.files() if p == path] == [(10, NOW - 1000)]
+
+def test_file_gone_before_delete_is_not_counted(root):
+    index = DirectoryIndex(str(root))
+    path = write(root / 'gone', 100, 900)
+    index.refresh(); os.remove(path)
+    dir_mtime = NOW - 5; os.utime(root, (dir_mtime, dir_mtime))
+    index._dirs[str(root)] = (dir_mtime,) + index._dirs[str(root)][1:] # Listing still believed current / 仍认为列表是最新的
+    stats = sweep(index, max_bytes=1, min_age=600, now=NOW)
+    assert stats['deleted'] == 0 and stats['files'] == 0 and stats['bytes'] == 0
+
+def test_refresh_relists_only_changed_directories(root):
+    write(root / 'a' / 'one', 1, 900); write(root / 'b' / 'two', 1, 900)
+    index = DirectoryIndex(str(root))
+    assert index.refresh() == 3
+    assert index.refresh() == 0
+    time.sleep(0.01)
+    write(root / 'a' / 'three', 1, 900)
+    os.utime(root / 'a', None) # Make the change visible on coarse mtime filesystems / 在 mtime 精度较低的文件系统上也能看到变化
+    assert index.refresh() == 1
+    assert names(index) == ['one', 'three', 'two']
+
+def test_refresh_drops_removed_directories(root):
+    write(root / 'sub' / 'file', 1, 900); write(root / 'top', 1, 900)
+    index = DirectoryIndex(str(root)); index.refresh()
+    os.remove(root / 'sub' / 'file'); os.rmdir(root / 'sub')
+    index.refresh()
+    assert names(index) == ['top']
+
+def test_missing_root_is_empty(tmp_path):
+    index = DirectoryIndex(str(tmp_path / 'absent'))
+    assert index.refresh() == 0
+    assert sweep(index, max_bytes=1, now=NOW)['files'] == 0
@@ -0,0 +1,193 @@
+# Tests for workflow_compiler.py / workflow_compiler.py 的测试
+import pytest
+
+import workflow_compiler
+from workflow_compiler import MODE_BYPASSED, MODE_MUTED, WorkflowCompileError, compile_ui_workflow, map_widget_values, validate_prompt
+
+OBJECT_INFO = {
+    'CheckpointLoaderSimple': {
+        'input': {'required': {'ckpt_name': [['model.safetensors', 'other.safetensors']]}},
+        'output': ['MODEL', 'CLIP', 'VAE'],
+    },
+    'CLIPTextEncode': {
+        'input': {'required': {'text': ['STRING', {'multiline': True}], 'clip': ['CLIP']}},
+        'input_order': {'required': ['text', 'clip']},
+        'output': ['CONDITIONING'],
+    },
+    'KSampler': {
+        'input': {'required': {
+            'model': ['MODEL'], 'seed': ['INT', {'control_after_generate': True}], 'steps': ['INT', {}], 'cfg': ['FLOAT', {}],
+            'sampler_name': ['COMBO', {'options': ['euler', 'dpmpp_2m']}], 'positive': ['CONDITIONING'], 'latent_image': ['LATENT'],
+        }},
+        'input_order': {'required': ['model', 'seed', 'steps', 'cfg', 'sampler_name', 'positive', 'latent_image']},
+        'output': ['LATENT'],
+    },
+    'EmptyLatentImage': {
+        'input': {'required': {'width': ['INT', {}], 'height': ['INT', {}]}},
+        'output': ['LATENT'],
+    },
+    'LatentUpscale': {
+        'input': {'required': {'samples': ['LATENT'], 'scale': ['FLOAT', {}]}},
+        'output': ['LATENT'],
+    },
+    'LoadImage': {
+        'input': {'required': {'image': [['a.png', 'b.png'], {'image_upload': True}]}},
+        'output': ['IMAGE', 'MASK'],
+    },
+    'SaveImage': {
+        'input': {'required': {'images': ['IMAGE'], 'filename_prefix': ['STRING', {}]}},
+        'output': [],
+        'output_node': True,
+    },
+}
+
+def ui_node(node_id, node_type, widgets=(), inputs=(), mode=0, outputs=()):
+    return {'id': node_id, 'type': node_type, 'mode': mode, 'widgets_values': list(widgets),
+            'inputs': [{'name': name, 'type': link_type, 'link': link} for name, link_type, link in inputs],
+            'outputs': list(outputs)}
+
+def ui_workflow(nodes, links):
+    return {'nodes': nodes, 'links': links}
+
+# --- Widget mapping / 控件映射 ---
+def test_seed_control_value_is_skipped():
+    node = ui_node(3, 'KSampler', [42, 'randomize', 20, 7.5, 'euler'])
+    assert map_widget_values(node, OBJECT_INFO['KSampler']) == {'seed': 42, 'steps': 20, 'cfg': 7.5, 'sampler_name': 'euler'}
+
+def test_seed_without_control_value():
+    node = ui_node(3, 'KSampler', [42, 20, 7.5, 'euler'])
+    assert map_widget_values(node, OBJECT_INFO['KSampler']) == {'seed': 42, 'steps': 20, 'cfg': 7.5, 'sampler_name': 'euler'}
+
+def test_upload_button_value_is_skipped():
+    node = ui_node(1, 'LoadImage', ['a.png', 'image'])
+    assert map_widget_values(node, OBJECT_INFO['LoadImage']) == {'image': 'a.png'}
+
+def test_widgets_stored_by_name():
+    node = {'id': 1, 'type': 'EmptyLatentImage', 'widgets_values': {'height': 768, 'width': 512, 'batch': 1}}
+    assert map_widget_values(node, OBJECT_INFO['EmptyLatentImage']) == {'width': 512, 'height': 768}
+
+def test_force_input_is_not_a_widget():
+    schema = {'input': {'required': {'text': ['STRING', {'forceInput': True}], 'strength': ['FLOAT', {}]}}}
+    assert [name for name, _, _ in workflow_compiler.widget_inputs(schema)] == ['strength']
+
+# --- Graph compilation / 图编译 ---
+def test_compiles_links_and_widgets():
+    workflow = ui_workflow(
+        [ui_node(1, 'CheckpointLoaderSimple', ['model.safetensors']),
+         ui_node(2, 'CLIPTextEncode', ['a cat'], inputs=[('clip', 'CLIP', 10)])],
+        [[10, 1, 1, 2, 1, 'CLIP']])
+    prompt = compile_ui_workflow(workflow, OBJECT_INFO)
+    assert prompt['1']['inputs'] == {'ckpt_name': 'model.safetensors'}
+    assert prompt['2']['inputs'] == {'text': 'a cat', 'clip': ['1', 1]}
+    assert prompt['2']['class_type'] == 'CLIPTextEncode'
+
+def test_object_link_format():
+    workflow = ui_workflow(
+        [ui_node(1, 'CheckpointLoaderSimple', ['model.safetensors']),
+         ui_node(2, 'CLIPTextEncode', ['a cat'], inputs=[('clip', 'CLIP', 10)])],
+        [{'id': 10, 'origin_id': 1, 'origin_slot': 1, 'target_id': 2, 'target_slot': 1, 'type': 'CLIP'}])
+    assert compile_ui_workflow(workflow, OBJECT_INFO)['2']['inputs']['clip'] == ['1', 1]
+
+def test_reroute_is_resolved():
+    workflow = ui_workflow(
+        [ui_node(1, 'CheckpointLoaderSimple', ['model.safetensors']),
+         ui_node(5, 'Reroute', inputs=[('', '*', 10)]),
+         ui_node(2, 'CLIPTextEncode', ['a cat'], inputs=[('clip', 'CLIP', 11)])],
+        [[10, 1, 1, 5, 0, 'CLIP'], [11, 5, 0, 2, 1, 'CLIP']])
+    prompt = compile_ui_workflow(workflow, OBJECT_INFO)
+    assert '5' not in prompt
+    assert prompt['2']['inputs']['clip'] == ['1', 1]
+
+def test_bypassed_node_passes_its_matching_input_through():
+    workflow = ui_workflow(
+        [ui_node(1, 'EmptyLatentImage', [512, 512]),
+         ui_node(2, 'LatentUpscale', [2.0], inputs=[('samples', 'LATENT', 10)], mode=MODE_BYPASSED),
+         ui_node(3, 'KSampler', [1, 20, 7.0, 'euler'], inputs=[('latent_image', 'LATENT', 11)])],
+        [[10, 1, 0, 2, 0, 'LATENT'], [11, 2, 0, 3, 6, 'LATENT']])
+    prompt = compile_ui_workflow(workflow, OBJECT_INFO)
+    assert '2' not in prompt
+    assert prompt['3']['inputs']['latent_image'] == ['1', 0]
+
+def test_muted_source_drops_the_input():
+    workflow = ui_workflow(
+        [ui_node(1, 'EmptyLatentImage', [512, 512], mode=MODE_MUTED),
+         ui_node(3, 'KSampler', [1, 20, 7.0, 'euler'], inputs=[('latent_image', 'LATENT', 11)])],
+        [[11, 1, 0, 3, 6, 'LATENT']])
+    prompt = compile_ui_workflow(workflow, OBJECT_INFO)
+    assert '1' not in prompt
+    assert 'latent_image' not in prompt['3']['inputs']
+
+def test_primitive_node_value_is_inlined():
+    workflow = ui_workflow(
+        [ui_node(7, 'PrimitiveNode', [1234, 'fixed']),
+         ui_node(3, 'KSampler', [1, 20, 7.0, 'euler'], inputs=[('seed', 'INT', 12)])],
+        [[12, 7, 0, 3, 1, 'INT']])
+    prompt = compile_ui_workflow(workflow, OBJECT_INFO)
+    assert '7' not in prompt
+    assert prompt['3']['inputs']['seed'] == 1234
+
+def test_unknown_node_type_raises():
+    workflow = ui_workflow([ui_node(1, 'NotInstalled')], [])
+    with pytest.raises(WorkflowCompileError) as error:
+        compile_ui_workflow(workflow, OBJECT_INFO)
+    assert error.value.unknown_types == ('NotInstalled',)
+
+def test_group_node_hint():
+    workflow = ui_workflow([ui_node(1, 'workflow>My Group')], [])
+    with pytest.raises(WorkflowCompileError, match='Group nodes and subgraphs'):
+        compile_ui_workflow(workflow, OBJECT_INFO)
+
+def test_is_ui_workflow():
+    assert workflow_compiler.is_ui_workflow({'nodes': [], 'links': []})
+    assert not workflow_compiler.is_ui_workflow({'1': {'class_type': 'SaveImage', 'inputs': {}}})
+
+# --- Validation / 校验 ---
+def valid_prompt():
+    return {
+        '1': {'class_type': 'LoadImage', 'inputs': {'image': 'a.png'}},
+        '2': {'class_type': 'SaveImage', 'inputs': {'images': ['1', 0], 'filename_prefix': 'out'}},
+    }
+
+def test_valid_prompt_has_no_problems():
+    assert validate_prompt(valid_prompt(), OBJECT_INFO) == []
+
+def test_unknown_class_type():
+    prompt = valid_prompt(); prompt['3'] = {'class_type': 'Missing', 'inputs': {}}
+    assert validate_prompt(prompt, OBJECT_INFO) == ["node 3: unknown node type 'Missing'"]
+
+def test_missing_required_input_unless_ignored():
+    prompt = valid_prompt(); del prompt['2']['inputs']['filename_prefix']
+    assert validate_prompt(prompt, OBJECT_INFO) == ["node 2 (SaveImage): missing required input 'filename_prefix'"]
+    assert validate_prompt(prompt, OBJECT_INFO, ignore_inputs=('filename_prefix',)) == []
+
+def test_dangling_link_and_missing_output_slot():
+    prompt = valid_prompt(); prompt['2']['inputs']['images'] = ['9', 0]
+    assert validate_prompt(prompt, OBJECT_INFO) == ["node 2 (SaveImage): input 'images' links to missing node 9"]
+    prompt['2']['inputs']['images'] = ['1', 5]
+    assert validate_prompt(prompt, OBJECT_INFO) == ["node 2 (SaveImage): input 'images' links to missing output 5 of node 1"]
+
+def test_link_type_mismatch():
+    prompt = valid_prompt(); prompt['2']['inputs']['images'] = ['1', 1]
+    assert validate_prompt(prompt, OBJECT_INFO) == ["node 2 (SaveImage): input 'images' expects IMAGE, got MASK from node 1"]
+
+def test_wildcard_and_union_types_match():
+    assert workflow_compiler._types_match('*', 'IMAGE')
+    assert workflow_compiler._types_match('IMAGE,MASK', 'MASK')
+    assert not workflow_compiler._types_match('LATENT', 'IMAGE')
+
+def test_combo_value_not_offered():
+    prompt = valid_prompt(); prompt['1']['inputs']['image'] = 'c.png'
+    assert validate_prompt(prompt, OBJECT_INFO) == ["node 1 (LoadImage): 'c.png' is not an available image"]
+
+def test_combo_in_options_dict():
+    prompt = {'1': {'class_type': 'KSampler', 'inputs': {'sampler_name': 'ddim'}}}
+    problems = validate_prompt(prompt, OBJECT_INFO, ignore_inputs=('model', 'seed', 'steps', 'cfg', 'positive', 'latent_image'))
+    assert problems == ["node 1 (KSampler): 'ddim' is not an available sampler_name", 'the workflow has no output node']
+
+def test_prompt_without_output_node():
+    prompt = {'1': {'class_type': 'LoadImage', 'inputs': {'image': 'a.png'}}}
+    assert validate_prompt(prompt, OBJECT_INFO) == ['the workflow has no output node']
+
+def test_problems_are_capped():
+    prompt = {str(i): {'class_type': 'Missing', 'inputs': {}} for i in range(30)}
+    assert len(validate_prompt(prompt, OBJECT_INFO, max_problems=5)) == 5
@@ -0,0 +1,186 @@
+# File: workflow_compiler.py
+# Compiles ComfyUI editor (UI-format) workflows into API-format prompts / 将 ComfyUI 编辑器（UI 格式）工作流编译为 API 格式任务图
+# UI files hold 'nodes'/'links' arrays and positional widget values; POST /prompt expects {node_id: {class_type, inputs}}.
+# Widget values are mapped to input names with ComfyUI's /object_info schema, the same way the editor does it.
+# UI 文件保存 'nodes'/'links' 数组和按位置排列的控件值；POST /prompt 需要 {node_id: {class_type, inputs}}。
+# 控件值借助 ComfyUI 的 /object_info 结构映射为输入名，与编辑器的做法一致。
+
+MODE_MUTED = 2 # "Never" in the editor / 编辑器中的"禁用"
+MODE_BYPASSED = 4
+# Editor-only nodes that never reach the backend / 仅存在于编辑器、不会发送到后端的节点
+VIRTUAL_NODE_TYPES = ('Reroute', 'PrimitiveNode', 'Note', 'MarkdownNote')
+WIDGET_TYPES = ('INT', 'FLOAT', 'STRING', 'BOOLEAN', 'COMBO')
+# Companion values the editor stores after some widgets / 编辑器在某些控件后额外保存的值
+SEED_CONTROL_VALUES = ('fixed', 'increment', 'decrement', 'randomize')
+UPLOAD_OPTIONS = ('image_upload', 'video_upload', 'audio_upload')
+
+class WorkflowCompileError(ValueError):
+    """Raised when a UI-format workflow cannot be turned into an API prompt."""
+    """UI 格式工作流无法转换为 API 任务图时抛出。"""
+    def __init__(self, message, unknown_types=()):
+        super().__init__(message)
+        self.unknown_types = tuple(unknown_types) # Node types missing from /object_info / /object_info 中缺少的节点类型
+
+def is_ui_workflow(workflow):
+    """True for editor-format files ('nodes' and 'links' arrays); API-format prompts are plain {node_id: node} objects."""
+    """编辑器格式文件（含 'nodes' 和 'links' 数组）返回 True；API 格式任务图是普通的 {node_id: node} 对象。"""
+    return isinstance(workflow, dict) and isinstance(workflow.get('nodes'), list) and isinstance(workflow.get('links'), list)
+
+def widget_inputs(node_schema):
+    """Returns [(name, type, options)] of the inputs the editor shows as widgets, in widgets_values order."""
+    """按 widgets_values 顺序返回编辑器以控件形式显示的输入 [(名称, 类型, 选项)]。"""
+    spec = node_schema.get('input', {})
+    order = node_schema.get('input_order') or {}
+    widgets = []
+    for section in ('required', 'optional'):
+        inputs = spec.get(section) or {}
+        for name in order.get(section) or list(inputs):
+            if name not in inputs: continue
+            input_spec = inputs[name]
+            input_type = input_spec[0] if input_spec else None
+            options = input_spec[1] if len(input_spec) > 1 and isinstance(input_spec[1], dict) else {}
+            if isinstance(input_type, list): input_type = 'COMBO' # Legacy combo spec is the list of choices / 旧式下拉框定义即选项列表
+            if input_type in WIDGET_TYPES and not options.get('forceInput'):
+                widgets.append((name, input_type, options))
+    return widgets
+
+def map_widget_values(node, node_schema):
+    """Maps a UI node's widgets_values (list or dict) to {input_name: value}."""
+    """将 UI 节点的 widgets_values（列表或字典）映射为 {输入名: 值}。"""
+    values = node.get('widgets_values')
+    widgets = widget_inputs(node_schema)
+    if isinstance(values, dict): # Some custom nodes store widgets by name / 部分自定义节点按名称保存控件
+        return {name: values[name] for name, _, _ in widgets if name in values}
+    values = list(values or [])
+    extra = len(values) - len(widgets) # Slots taken by seed controls / upload buttons / 种子控制或上传按钮占用的位置
+    mapped = {}; position = 0
+    for name, input_type, options in widgets:
+        if position >= len(values): break
+        mapped[name] = values[position]; position += 1
+        if extra <= 0 or position >= len(values): continue
+        has_control = input_type == 'INT' and (options.get('control_after_generate') or name in ('seed', 'noise_seed'))
+        if (has_control and values[position] in SEED_CONTROL_VALUES) or any(options.get(key) for key in UPLOAD_OPTIONS):
+            position += 1; extra -= 1
+    return mapped
+
+def _link_table(links):
+    """Returns {link_id: (origin_id, origin_slot, type)}; accepts the array and the object link formats."""
+    """返回 {link_id: (origin_id, origin_slot, type)}；兼容数组和对象两种链接格式。"""
+    table = {}
+    for link in links:
+        if isinstance(link, dict):
+            table[link['id']] = (link['origin_id'], link['origin_slot'], link.get('type'))
+        elif isinstance(link, list) and len(link) >= 5:
+            table[link[0]] = (link[1], link[2], link[5] if len(link) > 5 else None)
+    return table
+
+def compile_ui_workflow(workflow, object_info):
+    """Compiles an editor-format workflow into an API-format prompt.
+    Links are resolved through Reroute nodes and bypassed nodes (matching input of the same type), PrimitiveNode values are
+    inlined, muted nodes and links coming from them are dropped. Groups are layout only; group bypass/mute is already stored
+    in each node's mode. Raises WorkflowCompileError for unknown node types, group nodes and subgraphs."""
+    """将编辑器格式工作流编译为 API 格式任务图。
+    链接会穿过 Reroute 节点和被绕过的节点（同类型的对应输入）解析，PrimitiveNode 的值被内联，禁用的节点及仅由其提供的输入被丢弃。
+    分组仅用于布局；分组的绕过/禁用已保存在各节点的 mode 中。遇到未知节点类型、组节点和子图时抛出 WorkflowCompileError。"""
+    nodes = {node['id']: node for node in workflow['nodes'] if isinstance(node, dict) and 'id' in node}
+    links = _link_table(workflow['links'])
+
+    def resolve(link_id, seen=()):
+        # Returns ('link', [node_id, slot]), ('value', v) or None when the source is muted/missing / 来源被禁用或缺失时返回 None
+        if link_id is None or link_id not in links or link_id in seen: return None
+        origin_id, origin_slot, link_type = links[link_id]
+        origin = nodes.get(origin_id)
+        if origin is None or origin.get('mode') == MODE_MUTED: return None
+        seen = seen + (link_id,)
+        origin_inputs = origin.get('inputs') or []
+        if origin.get('type') == 'Reroute':
+            return resolve(origin_inputs[0].get('link'), seen) if origin_inputs else None
+        if origin.get('type') == 'PrimitiveNode':
+            values = origin.get('widgets_values') or []
+            return ('value', values[0]) if values else None
+        if origin.get('mode') == MODE_BYPASSED:
+            # Pass through the input of the same type, preferring the same slot like the editor / 与编辑器一致，优先同槽位的同类型输入
+            candidates = [origin_inputs[origin_slot]] if origin_slot < len(origin_inputs) else []
+            candidates += origin_inputs
+            for candidate in candidates:
+                if candidate.get('link') is not None and (link_type is None or candidate.get('type') in (link_type, '*')):
+                    return resolve(candidate['link'], seen)
+            return None
+        return ('link', [str(origin_id), origin_slot])
+
+    prompt = {}; unknown = []
+    for node_id, node in nodes.items():
+        node_type = node.get('type')
+        if node.get('mode') in (MODE_MUTED, MODE_BYPASSED) or node_type in VIRTUAL_NODE_TYPES: continue
+        if node_type not in object_info:
+            unknown.append(str(node_type)); continue
+        inputs = map_widget_values(node, object_info[node_type])
+        for node_input in node.get('inputs') or []:
+            resolved = resolve(node_input.get('link'))
+            if resolved is None: continue # Unlinked widget inputs keep their widget value / 未连接的控件输入保留控件值
+            inputs[node_input['name']] = resolved[1]
+        prompt[str(node_id)] = {'class_type': node_type, 'inputs': inputs, '_meta': {'title': node.get('title') or node_type}}
+
+    if unknown:
+        subgraph_ids = {graph.get('id') for graph in (workflow.get('definitions') or {}).get('subgraphs') or [] if isinstance(graph, dict)}
+        grouped = any(t.startswith('workflow>') or t.startswith('workflow/') or t in subgraph_ids for t in unknown)
+        hint = " Group nodes and subgraphs are not supported; export the workflow in API format." if grouped else ""
+        raise WorkflowCompileError(f"Unknown node types: {', '.join(sorted(set(unknown)))}.{hint}", unknown_types=set(unknown))
+    return prompt
+
+# --- Prompt Validation / 任务图校验 ---
+def _input_specs(node_schema):
+    """Returns ({name: spec} of required inputs, {name: spec} of all declared inputs)."""
+    """返回 (必需输入的 {名称: 定义}, 所有声明输入的 {名称: 定义})。"""
+    spec = node_schema.get('input', {})
+    required = dict(spec.get('required') or {})
+    return required, dict(required, **(spec.get('optional') or {}))
+
+def _types_match(output_type, input_type):
+    # Same rules as ComfyUI: '*' matches anything, comma-separated types match if they share one / 与 ComfyUI 规则相同
+    if output_type == input_type or '*' in (output_type, input_type): return True
+    if not isinstance(output_type, str) or not isinstance(input_type, str): return False
+    return bool(set(output_type.split(',')) & set(input_type.split(',')))
+
+def validate_prompt(prompt, object_info, ignore_inputs=(), max_problems=20):
+    """Checks an API-format prompt against the /object_info schema before it is queued: unknown node classes, missing required
+    inputs, dangling links, link type mismatches, combo values that are not offered, and prompts without an output node.
+    Inputs in ignore_inputs are filled in later by the caller. Returns a list of problems (empty if the prompt looks valid)."""
+    """在提交前按 /object_info 结构检查 API 格式任务图：未知节点类、缺失的必需输入、悬空链接、链接类型不匹配、
+    不在选项中的下拉值，以及没有输出节点的任务图。ignore_inputs 中的输入稍后由调用方填充。返回问题列表（有效时为空）。"""
+    problems = []; has_output = False
+    for node_id, node in prompt.items():
+        if len(problems) >= max_problems: break
+        class_type = node.get('class_type') if isinstance(node, dict) else None
+        if class_type not in object_info:
+            problems.append(f"node {node_id}: unknown node type '{class_type}'"); continue
+        node_schema = object_info[class_type]
+        has_output = has_output or bool(node_schema.get('output_node'))
+        required, declared = _input_specs(node_schema)
+        inputs = node.get('inputs') or {}
+        for name in required:
+            if name not in inputs and name not in ignore_inputs: problems.append(f"node {node_id} ({class_type}): missing required input '{name}'")
+        for name, value in inputs.items():
+            if name not in declared: continue # Extra inputs (e.g. NodeBridge context) are ignored by ComfyUI / ComfyUI 会忽略额外输入
+            expected = declared[name][0] if declared[name] else None
+            options = declared[name][1] if len(declared[name]) > 1 and isinstance(declared[name][1], dict) else {}
+            if isinstance(value, list):
+                if len(value) != 2 or str(value[0]) not in prompt:
+                    problems.append(f"node {node_id} ({class_type}): input '{name}' links to missing node {value[0] if value else '?'}"); continue
+                origin = prompt[str(value[0])]
+                origin_outputs = object_info.get(origin.get('class_type'), {}).get('output') or []
+                if not isinstance(value[1], int) or not 0 <= value[1] < len(origin_outputs):
+                    if origin.get('class_type') in object_info:
+                        problems.append(f"node {node_id} ({class_type}): input '{name}' links to missing output {value[1]} of node {value[0]}")
+                    continue
+                output_type = origin_outputs[value[1]]
+                if isinstance(expected, list) or expected == 'COMBO' or isinstance(output_type, list): continue # Combo sources / 下拉来源
+                if not _types_match(output_type, expected):
+                    problems.append(f"node {node_id} ({class_type}): input '{name}' expects {expected}, got {output_type} from node {value[0]}")
+            else:
+                choices = expected if isinstance(expected, list) else (options.get('options') if expected == 'COMBO' else None)
+                if choices and isinstance(value, str) and value not in choices:
+                    problems.append(f"node {node_id} ({class_type}): '{value}' is not an available {name}")
+    if prompt and not has_output and len(problems) < max_problems:
+        problems.append("the workflow has no output node")
+    return problems[:max_problems]